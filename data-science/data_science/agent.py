@@ -31,6 +31,8 @@ from .sub_agents import bqml_agent
 from .sub_agents.bigquery.tools import (
     get_database_settings as get_bq_database_settings,
 )
+from .sub_agents.bigquery.schema_format import serialize_schema
+from .sub_agents.bigquery.schema_linking import prune_schema
 from .prompts import return_instructions_root
 from .tools import call_db_agent, call_ds_agent
 
@@ -49,7 +51,19 @@ def setup_before_agent_call(callback_context: CallbackContext):
     # setting up schema in instruction
     if callback_context.state["all_db_settings"]["use_database"] == "BigQuery":
         callback_context.state["database_settings"] = get_bq_database_settings()
-        schema = callback_context.state["database_settings"]["bq_schema_and_samples"]
+        # Only put the part of the schema that is relevant to the user's
+        # message into the instruction.
+        question = None
+        if callback_context.user_content and callback_context.user_content.parts:
+            question = " ".join(
+                part.text for part in callback_context.user_content.parts if part.text
+            )
+        schema = serialize_schema(
+            prune_schema(
+                callback_context.state["database_settings"]["bq_schema_and_samples"],
+                question,
+            )
+        )
 
         callback_context._invocation_context.agent.instruction = (
             return_instructions_root()
@@ -67,6 +67,7 @@ def return_instructions_ds() -> str:
 
   **Data Handling:** 
   - If data is provided in the prompt, parse it into a pandas DataFrame
+  - If the prompt names a data file, e.g. `query_result.parquet`, load it with `pandas.read_parquet`; the prompt only shows a summary and the first rows of it
   - ALWAYS parse all the data provided
   - NEVER edit the data that is given to you
   - Use data exploration to understand the structure before analysis
@@ -1,8 +1,13 @@
+import asyncio
 import tempfile
 import docker
 import os
 from typing import Optional
 from google.adk.tools import ToolContext
+from data_science.utils.result_artifacts import (
+    QUERY_RESULT_ARTIFACT,
+    load_query_result,
+)
 
 class AnalyticsConfig:
     """Configuration for analytics agent."""
@@ -32,19 +37,30 @@ def _create_docker_container(client: docker.DockerClient, temp_file: str) -> doc
         timeout=config.docker_timeout
     )
 
-def execute_python_code(code: str, tool_context: Optional[ToolContext] = None) -> str:
-    """Execute Python code in a Docker container."""
-    temp_file = None
+async def execute_python_code(code: str, tool_context: Optional[ToolContext] = None) -> str:
+    """Execute Python code in a Docker container.
+
+    The latest query result of the session is available to the code as
+    `query_result.parquet` in its working directory.
+    """
     try:
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            f.write(code)
-            temp_file = f.name
-        
-        # Run in Docker container
-        client = docker.from_env()
-        container = _create_docker_container(client, temp_file)
-        execution_result = container.decode('utf-8')
+        # The code and its data live in a directory of their own, which is
+        # mounted into the container.
+        with tempfile.TemporaryDirectory() as work_dir:
+            temp_file = os.path.join(work_dir, 'main.py')
+            with open(temp_file, 'w') as f:
+                f.write(code)
+            data = await load_query_result(tool_context) if tool_context else None
+            if data is not None:
+                with open(os.path.join(work_dir, QUERY_RESULT_ARTIFACT), 'wb') as f:
+                    f.write(data)
+
+            # Run in Docker container
+            client = docker.from_env()
+            container = await asyncio.to_thread(
+                _create_docker_container, client, temp_file
+            )
+            execution_result = container.decode('utf-8')
 
         if tool_context:
             tool_context.state["result"] = execution_result
@@ -55,8 +71,4 @@ def execute_python_code(code: str, tool_context: Optional[ToolContext] = None) -
         error_message = f"Error: {str(e)}"
         if tool_context:
             tool_context.state["result"] = error_message
-        return error_message
-    finally:
-        # Clean up temporary file
-        if temp_file and os.path.exists(temp_file):
-            os.unlink(temp_file)
\ No newline at end of file
+        return error_message
\ No newline at end of file
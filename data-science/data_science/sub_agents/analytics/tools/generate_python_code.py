@@ -2,6 +2,12 @@ from typing import Optional
 from google.adk.tools import ToolContext
 import os
 import google.genai as genai
+from data_science.utils.result_artifacts import data_context
+from data_science.utils.streaming import (
+    FencedBlockParser,
+    read_code_block,
+    record_progress,
+)
 
 def _code_generation_prompt(natural_language: str, context_info: str = "") -> str:
     """Build the prompt for code generation."""
@@ -13,7 +19,7 @@ def _code_generation_prompt(natural_language: str, context_info: str = "") -> st
     - Include all necessary imports at the top
     - Make the code self-contained and executable
     - Include print statements to show results and outputs
-    - Handle data parsing if data is provided in the request
+    - Handle data parsing if data is provided in the request, and load the data from its file if a file is named
     - Use proper error handling where appropriate
     - Follow Python best practices
     - If working with data, always explore it first (show shape, head, info)
@@ -21,44 +27,41 @@ def _code_generation_prompt(natural_language: str, context_info: str = "") -> st
     
     Code:"""
 
-def _clean_response_code(code: str) -> str:
-    """Clean up the response code by removing markdown formatting."""
-    code = code.strip()
-    if code.startswith("```python"):
-        code = code[9:]
-    if code.startswith("```"):
-        code = code[3:]
-    if code.endswith("```"):
-        code = code[:-3]
-    return code.strip()
+async def generate_python_from_nl(natural_language: str, tool_context: Optional[ToolContext] = None) -> str:
+    """Generate Python code from natural language using Google's Gemini.
 
-def generate_python_from_nl(natural_language: str, tool_context: Optional[ToolContext] = None) -> str:
-    """Generate Python code from natural language using Google's Gemini."""
+    The response is streamed and the generation stops at the end of the first
+    code block; the stage is recorded in `python_generation_progress`.
+    """
     try:
-        # Check for API key
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            return "Error: GOOGLE_API_KEY environment variable not set"
-        
         # Use the same model as the agent for consistency
         model_name = os.getenv("ANALYTICS_AGENT_MODEL", "gemini-pro")
-        
-        # Configure Gemini
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(model_name)
-        
+
+        # The client reads the Vertex AI or API key settings from the environment
+        client = genai.Client()
+
         # Build context-aware prompt
         context_info = ""
-        if tool_context and "query_result" in tool_context.state:
-            context_info = f"\n\nContext: You have access to data from a previous query: {tool_context.state['query_result']}"
-        
+        data = data_context(tool_context.state) if tool_context else None
+        if data:
+            context_info = f"\n\nContext: {data}"
+
         # Enhanced prompt for better code generation
         prompt = _code_generation_prompt(natural_language, context_info)
-        
-        response = model.generate_content(prompt)
-        
-        code = _clean_response_code(response.text)
+
+        stream = await client.aio.models.generate_content_stream(
+            model=model_name, contents=prompt
+        )
+        code = await read_code_block(
+            stream,
+            FencedBlockParser(languages=("python", "py", "")),
+            on_progress=(
+                record_progress(tool_context.state, "python_generation_progress")
+                if tool_context
+                else None
+            ),
+        )
         return code.strip()
-        
+
     except Exception as e:
         return f"Error generating code: {str(e)}"
\ No newline at end of file
@@ -14,6 +14,7 @@
 
 """Database Agent: get data from database (BigQuery) using NL2SQL."""
 
+import asyncio
 import os
 
 from typing import Any, Dict, Optional
@@ -25,9 +26,14 @@ from google.adk.tools.bigquery import BigQueryToolset
 from google.adk.tools.bigquery.config import BigQueryToolConfig, WriteMode
 from google.genai import types
 
+from data_science.utils.result_artifacts import rows_to_table, save_query_result
+
 from . import tools
 from .chase_sql import chase_db_tools
+from .dry_run import get_query_validator
 from .prompts import return_instructions_bigquery
+from .result_cache import get_query_result_cache
+from .result_export import export_query_result
 
 NL2SQL_METHOD = os.getenv("NL2SQL_METHOD", "BASELINE")
 
@@ -44,15 +50,59 @@ def setup_before_agent_call(callback_context: CallbackContext) -> None:
             tools.get_database_settings()
 
 
-def store_results_in_context(
+async def check_result_cache(
+    tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext
+) -> Optional[Dict]:
+
+  # Answer repeated queries from the shared result cache, skipping BigQuery.
+  if tool.name == ADK_BUILTIN_BQ_EXECUTE_SQL_TOOL and not args.get("dry_run"):
+    result_cache = get_query_result_cache()
+    if result_cache is not None:
+      # The lookup reads table metadata from BigQuery; keep it off the
+      # event loop.
+      return await asyncio.to_thread(
+          result_cache.lookup,
+          tool_context.function_call_id,
+          args["project_id"],
+          args["query"],
+      )
+
+  return None
+
+
+async def validate_query(
+    tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext
+) -> Optional[Dict]:
+
+  # Dry run the query first; invalid and too expensive queries are sent back
+  # to the agent for correction instead of being executed.
+  if (
+      tool.name == ADK_BUILTIN_BQ_EXECUTE_SQL_TOOL and not args.get("dry_run")
+  ) or tool.name == export_query_result.__name__:
+    validator = get_query_validator()
+    if validator is not None:
+      # The dry run is a BigQuery job; keep it off the event loop.
+      return await asyncio.to_thread(
+          validator.validate, args["project_id"], args["query"]
+      )
+
+  return None
+
+
+async def store_results_in_context(
     tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Dict
 ) -> Optional[Dict]:
 
-  # We are setting a state for the data science agent to be able to use the sql
-  # query results as context 
+  # We are storing the sql query results as an artifact for the data science
+  # agent, and their summary in the state for the prompts.
   if tool.name == ADK_BUILTIN_BQ_EXECUTE_SQL_TOOL:
     if tool_response["status"] == "SUCCESS":
-        tool_context.state["query_result"] = tool_response["rows"]
+      await save_query_result(tool_context, rows_to_table(tool_response["rows"]))
+    result_cache = get_query_result_cache()
+    if result_cache is not None:
+      await asyncio.to_thread(
+          result_cache.store, tool_context.function_call_id, tool_response
+      )
 
   return None
 
@@ -60,7 +110,7 @@ def store_results_in_context(
 bigquery_tool_filter = [ADK_BUILTIN_BQ_EXECUTE_SQL_TOOL]
 bigquery_tool_config = BigQueryToolConfig(
     write_mode=WriteMode.BLOCKED,
-    max_query_result_rows=80
+    max_query_result_rows=tools.MAX_NUM_ROWS
 )
 bigquery_toolset = BigQueryToolset(
     tool_filter=bigquery_tool_filter,
@@ -78,8 +128,11 @@ database_agent = Agent(
             else tools.initial_bq_nl2sql
         ),
         bigquery_toolset,
+        export_query_result,
     ],
     before_agent_callback=setup_before_agent_call,
+    # Cached results were validated when they ran.
+    before_tool_callback=[check_result_cache, validate_query],
     after_tool_callback=store_results_in_context,
     generate_content_config=types.GenerateContentConfig(temperature=0.01),
 )
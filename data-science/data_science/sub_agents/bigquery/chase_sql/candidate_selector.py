@@ -0,0 +1,240 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Selection of the best SQL candidate by self-consistency voting.
+
+Candidates that do not parse or do not conform to the schema are discarded.
+The remaining candidates are grouped by what they compute: by their result on
+a local SQLite replica of the sampled rows when they can be executed there and
+return rows, and otherwise by their canonical (sqlglot-optimized) AST. The
+first candidate of the largest group wins.
+"""
+
+import collections
+import hashlib
+import logging
+import sqlite3
+from typing import Any
+
+import sqlglot
+
+from .sql_postprocessor import sql_translator
+
+logger = logging.getLogger(__name__)
+
+SqlTranslator = sql_translator.SqlTranslator
+
+
+def to_sqlglot_schema(
+    bq_schema_and_samples: dict[str, Any], fingerprint: str | None = None
+) -> dict[str, Any]:
+    """Converts the `bq_schema_and_samples` dict into the SQLGlot schema format.
+
+    The conversion is memoized per fingerprint; see
+    `SqlTranslator.prepare_schema`.
+    """
+    return (
+        SqlTranslator.rewrite_schema_for_sqlglot(bq_schema_and_samples, fingerprint)
+        or {}
+    )
+
+
+def _table_names(schema_dict: dict[str, Any]) -> set[str]:
+    """Returns the names of the tables in a (possibly nested) SQLGlot schema."""
+    names = set()
+    for name, value in schema_dict.items():
+        if all(isinstance(v, str) for v in value.values()):
+            names.add(name)
+        else:
+            names |= _table_names(value)
+    return names
+
+
+def check_candidate(
+    sql_query: str,
+    schema_dict: dict[str, Any],
+    db: str | None,
+    catalog: str | None,
+    fingerprint: str | None = None,
+) -> str | None:
+    """Returns the canonical form of a valid candidate, or None if it is invalid.
+
+    Args:
+        sql_query (str): The candidate SQL, in the BigQuery dialect.
+        schema_dict (dict): The SQLGlot schema to check the candidate against.
+        db (str): The dataset of the tables.
+        catalog (str): The project of the tables.
+        fingerprint (str, optional): The fingerprint of the schema.
+
+    Returns:
+        str: The sqlglot-optimized SQL, or None if the candidate does not parse,
+        does not conform to the schema or is not a query.
+    """
+    if not sql_query:
+        return None
+    # pylint: disable=protected-access
+    errors, optimized_sql = SqlTranslator._check_for_errors(
+        sql_query=sql_query,
+        sql_dialect=SqlTranslator.OUTPUT_DIALECT,
+        db=db,
+        catalog=catalog,
+        schema_dict=schema_dict,
+        fingerprint=fingerprint,
+    )
+    # pylint: enable=protected-access
+    if errors is not None:
+        return None
+    # Text that is not a query can still parse, e.g. as a bare column.
+    expression = sqlglot.parse_one(optimized_sql, read="bigquery")
+    if not isinstance(expression, sqlglot.exp.Query):
+        return None
+    cte_names = {cte.alias_or_name for cte in expression.find_all(sqlglot.exp.CTE)}
+    known_tables = _table_names(schema_dict)
+    for table in expression.find_all(sqlglot.exp.Table):
+        if table.name not in known_tables and table.name not in cte_names:
+            return None
+    return optimized_sql
+
+
+def _canonical_form(optimized_sql: str) -> str:
+    """Renames the table aliases of an optimized query by order of appearance."""
+    expression = sqlglot.parse_one(optimized_sql, read="bigquery")
+    aliases: dict[str, str] = {}
+    for table_alias in expression.find_all(sqlglot.exp.TableAlias):
+        aliases.setdefault(table_alias.name, f"_t{len(aliases)}")
+    for table_alias in expression.find_all(sqlglot.exp.TableAlias):
+        table_alias.set("this", sqlglot.exp.to_identifier(aliases[table_alias.name]))
+    for column in expression.find_all(sqlglot.exp.Column):
+        if column.table in aliases:
+            column.set("table", sqlglot.exp.to_identifier(aliases[column.table]))
+    return expression.sql(dialect="bigquery")
+
+
+class SampleReplica:
+    """In-memory SQLite database with the sampled rows of the schema.
+
+    Tables are created on first use, named by their table ID only.
+    """
+
+    def __init__(self, bq_schema_and_samples: dict[str, Any]):
+        self._schema = {
+            table_name.split(".")[-1]: table_context
+            for table_name, table_context in bq_schema_and_samples.items()
+        }
+        self._connection = sqlite3.connect(":memory:")
+        self._created: set[str] = set()
+
+    def _create_table(self, table_id: str) -> None:
+        table_context = self._schema[table_id]
+        columns = [column for column, _ in table_context["table_schema"]]
+        example_values = table_context.get("example_values", {})
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        self._connection.execute(f'CREATE TABLE "{table_id}" ({column_list})')
+        num_rows = max((len(example_values.get(c, [])) for c in columns), default=0)
+        for row in range(num_rows):
+            literals = [
+                values[row] if row < len(values) else "NULL"
+                for values in (example_values.get(c, []) for c in columns)
+            ]
+            # The samples are BigQuery literals, but quotes inside strings are
+            # doubled as in standard SQL; let sqlglot rewrite them for SQLite.
+            # Rows with nested or exotic values are left out.
+            for read in ("bigquery", None):
+                try:
+                    select = sqlglot.transpile(
+                        f"SELECT {', '.join(literals)}", read=read, write="sqlite"
+                    )[0]
+                    self._connection.execute(f'INSERT INTO "{table_id}" {select}')
+                    break
+                except (sqlglot.errors.SqlglotError, sqlite3.Error):
+                    continue
+        self._created.add(table_id)
+
+    def execute(self, sql_query: str) -> list[tuple] | None:
+        """Runs a BigQuery query on the replica.
+
+        Returns:
+            list: The result rows, or None if the query cannot run on SQLite.
+        """
+        try:
+            expression = sqlglot.parse_one(sql_query, read="bigquery")
+            for table in expression.find_all(sqlglot.exp.Table):
+                if table.name not in self._schema:
+                    continue
+                if table.name not in self._created:
+                    self._create_table(table.name)
+                table.set("catalog", None)
+                table.set("db", None)
+            return self._connection.execute(expression.sql(dialect="sqlite")).fetchall()
+        except (sqlglot.errors.SqlglotError, sqlite3.Error):
+            return None
+
+
+def _result_key(rows: list[tuple]) -> str:
+    """Fingerprints a result independently of the row order."""
+    return hashlib.sha1(repr(sorted(map(repr, rows))).encode("utf-8")).hexdigest()
+
+
+def select_candidate(
+    candidates: list[str | None],
+    bq_schema_and_samples: dict[str, Any],
+    db: str,
+    catalog: str,
+    execute: bool = True,
+    fingerprint: str | None = None,
+) -> str | None:
+    """Selects the candidate that most other valid candidates agree with.
+
+    Args:
+        candidates (list): The candidate SQL queries, in generation order.
+        bq_schema_and_samples (dict): The schema and sampled rows.
+        db (str): The dataset of the tables.
+        catalog (str): The project of the tables.
+        execute (bool): Whether to group candidates by their result on the
+          local replica of the sampled rows.
+        fingerprint (str, optional): The fingerprint of the schema.
+
+    Returns:
+        str: The selected candidate. If no candidate is valid, the first
+        non-empty candidate, or None.
+    """
+    schema_dict = to_sqlglot_schema(bq_schema_and_samples, fingerprint)
+    replica = SampleReplica(bq_schema_and_samples) if execute else None
+    groups: dict[tuple[str, str], list[int]] = collections.defaultdict(list)
+    for index, candidate in enumerate(candidates):
+        canonical_sql = check_candidate(
+            candidate, schema_dict, db, catalog, fingerprint
+        )
+        if canonical_sql is None:
+            continue
+        key = ("ast", _canonical_form(canonical_sql))
+        if replica is not None:
+            rows = replica.execute(candidate)
+            # An empty result on a handful of rows says nothing about a query.
+            if rows:
+                key = ("result", _result_key(rows))
+        groups[key].append(index)
+
+    if not groups:
+        logger.warning("No valid candidate; using the first non-empty one")
+        return next((c for c in candidates if c), None)
+    # The largest group wins; ties go to the group with the earliest candidate.
+    winner = max(groups.values(), key=lambda members: (len(members), -members[0]))
+    logger.info(
+        "Selected candidate %d with %d of %d votes",
+        winner[0],
+        len(winner),
+        len(candidates),
+    )
+    return candidates[winner[0]]
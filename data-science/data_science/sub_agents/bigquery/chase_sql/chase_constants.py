@@ -36,6 +36,12 @@ chase_sql_constants_dict: immutabledict.immutabledict[str, Any] = (
             "temperature": 0.5,
             # Type of SQL generation method.
             "generate_sql_type": "dc",
+            # How the candidates are selected: "all" waits for every candidate
+            # and uses the first one, "first_valid" uses the first candidate
+            # that validates against the schema and cancels the rest, "race"
+            # does the same with every candidate sent to a different region,
+            # and "vote" uses the candidate most valid candidates agree with.
+            "candidate_selection": os.getenv("CHASE_CANDIDATE_SELECTION", "all"),
         }
     )
 )
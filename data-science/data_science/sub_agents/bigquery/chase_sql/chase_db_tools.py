@@ -14,21 +14,33 @@
 
 """This code contains the implementation of the tools used for the CHASE-SQL agent."""
 
+import asyncio
 import enum
 import os
 
 from google.adk.tools import ToolContext
 
+from ..nl2sql_cache import cache_nl2sql
+from ..schema_format import serialize_schema
+from ..schema_linking import prune_schema
+
+from . import candidate_selector
+from .context_cache import CONTEXT_CACHE, split_prompt_template
+
 # pylint: disable=g-importing-member
 from .dc_prompt_template import DC_PROMPT_TEMPLATE
-from .llm_utils import GeminiModel
+from .llm_utils import REGION_ROUTER, GeminiModel, call_first_valid_async
 from .qp_prompt_template import QP_PROMPT_TEMPLATE
 from .sql_postprocessor import sql_translator
+from .sql_postprocessor.partition_rewriter import rewrite_for_partitions
 
 # pylint: enable=g-importing-member
 
 BQ_DATA_PROJECT_ID = os.getenv("BQ_DATA_PROJECT_ID")
 
+# Returned instead of SQL when no candidate could be generated.
+NO_CANDIDATE_ERROR = "Error: No SQL candidate could be generated."
+
 
 class GenerateSQLType(enum.Enum):
     """Enum for the different types of SQL generation methods.
@@ -41,6 +53,22 @@ class GenerateSQLType(enum.Enum):
     QP = "qp"
 
 
+class CandidateSelection(enum.Enum):
+    """Enum for the different ways of selecting a SQL candidate.
+
+    ALL: Wait for all candidates and use the first one.
+    FIRST_VALID: Use the first candidate that validates against the schema.
+    RACE: Like FIRST_VALID, with every candidate sent to a different region.
+    VOTE: Wait for all candidates and use the one most valid candidates agree
+      with.
+    """
+
+    ALL = "all"
+    FIRST_VALID = "first_valid"
+    RACE = "race"
+    VOTE = "vote"
+
+
 def exception_wrapper(func):
     """A decorator to catch exceptions in a function and return the exception as a string.
 
@@ -79,21 +107,79 @@ def parse_response(response: str) -> str:
     return query.strip()
 
 
-def initial_bq_nl2sql(
+def sql_validator(
+    bq_schema_and_samples: dict,
+    db: str | None,
+    catalog: str | None,
+    fingerprint: str | None = None,
+):
+    """Returns a function that checks a SQL query against the schema with sqlglot.
+
+    Args:
+       bq_schema_and_samples (dict): The schema to validate against.
+       db (str): The dataset of the tables.
+       catalog (str): The project of the tables.
+       fingerprint (str, optional): The fingerprint of the schema.
+
+    Returns:
+       callable: A function that returns True if the SQL query is valid.
+    """
+    schema_dict = candidate_selector.to_sqlglot_schema(
+        bq_schema_and_samples, fingerprint
+    )
+
+    def is_valid(sql_query: str) -> bool:
+        return (
+            candidate_selector.check_candidate(
+                sql_query, schema_dict, db, catalog, fingerprint
+            )
+            is not None
+        )
+
+    return is_valid
+
+
+def _generation_settings(tool_context: ToolContext) -> str:
+    """Identifies the model and CHASE settings that shape the generated SQL."""
+    settings = tool_context.state["database_settings"]
+    return "/".join(
+        str(settings[key])
+        for key in (
+            "model",
+            "temperature",
+            "generate_sql_type",
+            "number_of_candidates",
+            "transpile_to_bigquery",
+            "candidate_selection",
+        )
+    )
+
+
+@rewrite_for_partitions
+@cache_nl2sql("chase", _generation_settings)
+async def initial_bq_nl2sql(
     question: str,
     tool_context: ToolContext,
 ) -> str:
     """Generates an initial SQL query from a natural language question.
 
+    The candidates are generated concurrently without blocking the event loop;
+    the translator runs on a worker thread.
+
     Args:
       question: Natural language question.
       tool_context: Function context.
 
     Returns:
-      str: An SQL statement to answer this question.
+      str: An SQL statement to answer this question, or `NO_CANDIDATE_ERROR`
+        if every candidate request failed.
     """
     print("****** Running agent with ChaseSQL algorithm.")
     bq_schema_and_samples = tool_context.state["database_settings"]["bq_schema_and_samples"]
+    # Identifies the SQLGlot schema prepared by `update_database_settings`.
+    schema_fingerprint = tool_context.state["database_settings"].get(
+        "bq_schema_fingerprint"
+    )
     project = tool_context.state["database_settings"]["bq_data_project_id"]
     db = tool_context.state["database_settings"]["bq_dataset_id"]
     transpile_to_bigquery = tool_context.state["database_settings"][
@@ -113,25 +199,95 @@ def initial_bq_nl2sql(
     generate_sql_type = tool_context.state["database_settings"]["generate_sql_type"]
 
     if generate_sql_type == GenerateSQLType.DC.value:
-        prompt = DC_PROMPT_TEMPLATE.format(
-            SCHEMA=bq_schema_and_samples,
-            QUESTION=question,
-            BQ_DATA_PROJECT_ID=BQ_DATA_PROJECT_ID
-        )
+        template = DC_PROMPT_TEMPLATE
     elif generate_sql_type == GenerateSQLType.QP.value:
-        prompt = QP_PROMPT_TEMPLATE.format(
-            SCHEMA=bq_schema_and_samples,
+        template = QP_PROMPT_TEMPLATE
+    else:
+        raise ValueError(f"Unsupported generate_sql_type: {generate_sql_type}")
+
+    candidate_selection = tool_context.state["database_settings"].get(
+        "candidate_selection", CandidateSelection.ALL.value
+    )
+    model_name = model
+    model = GeminiModel(model_name=model_name, temperature=temperature)
+    generator = model
+    cache_name = None
+    # Context caches are regional, so racing across regions sends full prompts.
+    if CONTEXT_CACHE.enabled and candidate_selection != CandidateSelection.RACE.value:
+        # The cached prefix holds the full schema, so that it is the same for
+        # every question.
+        prefix, question_part = split_prompt_template(template)
+        cache_name = await asyncio.to_thread(
+            CONTEXT_CACHE.cache_name,
+            model_name,
+            generate_sql_type,
+            prefix.format(
+                SCHEMA=serialize_schema(bq_schema_and_samples),
+                BQ_DATA_PROJECT_ID=BQ_DATA_PROJECT_ID,
+            ),
+        )
+    if cache_name is not None:
+        prompt = question_part.format(QUESTION=question)
+        generator = GeminiModel(
+            model_name=model_name, temperature=temperature, cache_name=cache_name
+        )
+    else:
+        # Only the prompt gets the pruned schema. The translator below
+        # validates the SQL against the full schema.
+        prompt = template.format(
+            SCHEMA=serialize_schema(prune_schema(bq_schema_and_samples, question)),
             QUESTION=question,
-            BQ_DATA_PROJECT_ID=BQ_DATA_PROJECT_ID
+            BQ_DATA_PROJECT_ID=BQ_DATA_PROJECT_ID,
+        )
+
+    if candidate_selection == CandidateSelection.ALL.value:
+        requests = [prompt for _ in range(number_of_candidates)]
+        responses = await generator.call_parallel_async(
+            requests, parser_func=parse_response
+        )
+        # Take just the first response.
+        responses = responses[0]
+    elif candidate_selection == CandidateSelection.VOTE.value:
+        requests = [prompt for _ in range(number_of_candidates)]
+        candidates = await generator.call_parallel_async(
+            requests, parser_func=parse_response
+        )
+        responses = await asyncio.to_thread(
+            candidate_selector.select_candidate,
+            candidates,
+            bq_schema_and_samples,
+            db=db,
+            catalog=project,
+            fingerprint=schema_fingerprint,
+        )
+    elif candidate_selection in (
+        CandidateSelection.FIRST_VALID.value,
+        CandidateSelection.RACE.value,
+    ):
+        if candidate_selection == CandidateSelection.RACE.value:
+            models = [
+                GeminiModel(
+                    model_name=model_name, temperature=temperature, region=region
+                )
+                for region in REGION_ROUTER.choose_distinct(number_of_candidates)
+            ]
+        else:
+            models = [generator] * number_of_candidates
+        responses = await call_first_valid_async(
+            [(m, prompt) for m in models],
+            is_valid=sql_validator(
+                bq_schema_and_samples,
+                db=db,
+                catalog=project,
+                fingerprint=schema_fingerprint,
+            ),
+            parser_func=parse_response,
         )
     else:
-        raise ValueError(f"Unsupported generate_sql_type: {generate_sql_type}")
+        raise ValueError(f"Unsupported candidate_selection: {candidate_selection}")
 
-    model = GeminiModel(model_name=model, temperature=temperature)
-    requests = [prompt for _ in range(number_of_candidates)]
-    responses = model.call_parallel(requests, parser_func=parse_response)
-    # Take just the first response.
-    responses = responses[0]
+    if not responses:
+        return NO_CANDIDATE_ERROR
 
     # If postprocessing of the SQL to transpile it to BigQuery is required,
     # then do it here.
@@ -144,8 +300,13 @@ def initial_bq_nl2sql(
         )
         # pylint: disable=g-bad-todo
         # pylint: enable=g-bad-todo
-        responses: str = translator.translate(
-            responses, ddl_schema=bq_schema_and_samples, db=db, catalog=project
+        responses: str = await asyncio.to_thread(
+            translator.translate,
+            responses,
+            ddl_schema=bq_schema_and_samples,
+            db=db,
+            catalog=project,
+            fingerprint=schema_fingerprint,
         )
 
     return responses
@@ -0,0 +1,212 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Context caching of the static part of the CHASE-SQL prompts.
+
+The DC and QP prompts start with hundreds of lines of fixed few-shot examples
+followed by the schema; only the question at the end changes between calls.
+The manager keeps that prefix in a Vertex AI context cache, so that each call
+only sends the question.
+"""
+
+import collections
+import dataclasses
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from vertexai.preview import caching
+
+logger = logging.getLogger(__name__)
+
+# The last question section, the real one, closes both prompt templates.
+QUESTION_SECTION = "**************************\n【Question】"
+
+
+def split_prompt_template(template: str) -> tuple[str, str]:
+    """Splits a prompt template into its static prefix and its question part.
+
+    Args:
+        template (str): A prompt template with a `【Question】` section.
+
+    Returns:
+        tuple[str, str]: The part before the question section, with the
+        `SCHEMA` and `BQ_DATA_PROJECT_ID` placeholders, and the rest, with the
+        `QUESTION` placeholder.
+    """
+    index = template.rindex(QUESTION_SECTION)
+    return template[:index], template[index:]
+
+
+@dataclasses.dataclass
+class _CacheEntry:
+    """A cached prefix; `name` is None if creating the cache failed."""
+
+    key: str
+    name: str | None
+    expires_at: float
+
+
+class ContextCacheManager:
+    """Creates, refreshes and replaces the context caches of the prompt prefixes.
+
+    Every (model, slot) pair, e.g. a model and a prompt template, has at most
+    one cache. A cache is created on first use, its TTL is extended when it is
+    about to expire, and it is replaced (and the old one deleted) when the
+    prefix changes, e.g. because the schema changed.
+
+    The Vertex AI calls run outside of the lock. While a cache of a slot is
+    being created, other calls for the slot send their prompt uncached
+    instead of waiting.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 3600,
+        refresh_margin_seconds: float = 300,
+        failure_backoff_seconds: float = 600,
+    ):
+        """Initializes the manager.
+
+        Args:
+            ttl_seconds (float): The lifetime of a cache; 0 disables caching.
+            refresh_margin_seconds (float): How long before it expires a cache
+              in use gets a new TTL.
+            failure_backoff_seconds (float): How long to send prompts uncached
+              after creating a cache failed, e.g. because the prefix is below
+              the minimum size of a cache.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = min(refresh_margin_seconds, ttl_seconds / 2)
+        self.failure_backoff_seconds = failure_backoff_seconds
+        self.stats = collections.Counter()
+        self._entries: dict[tuple[str, str], _CacheEntry] = {}
+        # The (model, slot) pairs with a Vertex AI call in flight.
+        self._in_flight: set[tuple[str, str]] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def _create(self, model_name: str, slot: str, key: str, prefix: str) -> _CacheEntry:
+        try:
+            cached_content = caching.CachedContent.create(
+                model_name=model_name,
+                contents=[prefix],
+                ttl=datetime.timedelta(seconds=self.ttl_seconds),
+                display_name=f"chase-sql-{slot}-{key[:8]}",
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("Could not create a context cache for %s: %s", slot, e)
+            self._count("failures")
+            return _CacheEntry(
+                key, None, time.monotonic() + self.failure_backoff_seconds
+            )
+        self._count("created")
+        return _CacheEntry(
+            key, cached_content.resource_name, time.monotonic() + self.ttl_seconds
+        )
+
+    def _refresh(self, name: str) -> bool:
+        try:
+            caching.CachedContent(cached_content_name=name).update(
+                ttl=datetime.timedelta(seconds=self.ttl_seconds)
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("Could not refresh the context cache %s: %s", name, e)
+            return False
+        self._count("refreshed")
+        return True
+
+    def _delete(self, name: str) -> None:
+        try:
+            caching.CachedContent(cached_content_name=name).delete()
+            self._count("deleted")
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # The cache expires by itself anyway.
+            logger.warning("Could not delete the context cache %s: %s", name, e)
+
+    def cache_name(self, model_name: str, slot: str, prefix: str) -> str | None:
+        """Returns the name of a live cache of the prefix, creating it if needed.
+
+        Args:
+            model_name (str): The model the cache is used with.
+            slot (str): What the prefix is, e.g. the name of the prompt template.
+            prefix (str): The prompt prefix to cache.
+
+        Returns:
+            str: The resource name of the cache, or None if the prompt has to
+            be sent uncached.
+        """
+        if not self.enabled:
+            return None
+        key = hashlib.sha1(f"{model_name}\n{prefix}".encode("utf-8")).hexdigest()
+        slot_key = (model_name, slot)
+        refresh = stale = None
+        with self._lock:
+            entry = self._entries.get(slot_key)
+            now = time.monotonic()
+            if entry is not None and entry.key == key:
+                if entry.name is None:
+                    if now < entry.expires_at:
+                        return None
+                elif entry.expires_at - now > self.refresh_margin_seconds:
+                    self.stats["hits"] += 1
+                    return entry.name
+                elif entry.expires_at > now:
+                    refresh = entry
+            elif entry is not None:
+                stale = entry.name
+            if slot_key in self._in_flight:
+                # Another call is refreshing or replacing the cache.
+                if refresh is not None:
+                    self.stats["hits"] += 1
+                    return refresh.name
+                return None
+            self._in_flight.add(slot_key)
+
+        try:
+            if refresh is not None and self._refresh(refresh.name):
+                with self._lock:
+                    refresh.expires_at = time.monotonic() + self.ttl_seconds
+                    self.stats["hits"] += 1
+                return refresh.name
+            if stale is not None:
+                logger.info("Prompt prefix of %s changed; replacing its context cache", slot)
+                self._delete(stale)
+            entry = self._create(model_name, slot, key, prefix)
+            with self._lock:
+                self._entries[slot_key] = entry
+            return entry.name
+        finally:
+            with self._lock:
+                self._in_flight.discard(slot_key)
+
+
+# Context caches are billed Vertex AI resources, so they are opt-in.
+CONTEXT_CACHE = ContextCacheManager(
+    ttl_seconds=(
+        float(os.getenv("CHASE_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+        if os.getenv("CHASE_CONTEXT_CACHE", "false").lower() == "true"
+        else 0
+    )
+)
@@ -14,11 +14,12 @@
 
 """This code contains the LLM utils for the CHASE-SQL Agent."""
 
-import functools
+import asyncio
+import contextlib
+import logging
 import os
-import random
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Callable, List, Optional
 
 import dotenv
@@ -29,8 +30,13 @@ from vertexai.generative_models import (GenerationConfig, HarmBlockThreshold,
 from vertexai.preview import caching
 from vertexai.preview.generative_models import GenerativeModel
 
+from .region_router import RegionRouter
+from .retry_policy import DEFAULT_RETRY_POLICY, RetryPolicy
+
 dotenv.load_dotenv(override=True)
 
+logger = logging.getLogger(__name__)
+
 SAFETY_FILTER_CONFIG = {
     HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_NONE,
     HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
@@ -63,7 +69,6 @@ GEMINI_AVAILABLE_REGIONS = [
     "asia-northeast1",
     "asia-east1",
     "europe-west1",
-    "us-central1",
     "asia-northeast3",
     "asia-south1",
     "asia-southeast1",
@@ -79,39 +84,73 @@ aiplatform.init(
 )
 vertexai.init(project=GCP_PROJECT, location=GCP_LOCATION)
 
+# Shared by all models that distribute their requests across regions.
+REGION_ROUTER = RegionRouter(GEMINI_AVAILABLE_REGIONS)
 
-def retry(max_attempts=8, base_delay=1, backoff_factor=2):
-    """Decorator to add retry logic to a function.
+# Process-wide limits for concurrent model requests. A requests-per-second
+# value of 0 disables rate limiting.
+MAX_CONCURRENT_REQUESTS = int(os.getenv("CHASE_MAX_CONCURRENT_REQUESTS", "16"))
+REQUESTS_PER_SECOND = float(os.getenv("CHASE_REQUESTS_PER_SECOND", "0"))
 
-    Args:
-        max_attempts (int): The maximum number of attempts.
-        base_delay (int): The base delay in seconds for the exponential backoff.
-        backoff_factor (int): The factor by which to multiply the delay for each
-          subsequent attempt.
 
-    Returns:
-        Callable: The decorator function.
+class RequestLimiter:
+    """Caps the number of in-flight model requests and their rate.
+
+    Combines a semaphore for concurrency with a token bucket for the request
+    rate. All requests run on the shared request loop, so one limiter covers
+    every session of the process.
     """
 
-    def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            attempts = 0
-            while attempts < max_attempts:
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Attempt {attempts + 1} failed with error: {e}")
-                    attempts += 1
-                    if attempts >= max_attempts:
-                        raise e
-                    delay = base_delay * (backoff_factor**attempts)
-                    delay = delay + random.uniform(0, 0.1 * delay)
-                    time.sleep(delay)
+    def __init__(self, max_concurrency: int, requests_per_second: float = 0):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.requests_per_second = requests_per_second
+        self._capacity = max(1.0, requests_per_second)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+
+    async def _take_token(self):
+        if self.requests_per_second <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity,
+                self._tokens + (now - self._updated) * self.requests_per_second,
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.requests_per_second)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Waits until a request may be sent and holds a slot while it runs."""
+        async with self._semaphore:
+            await self._take_token()
+            yield
+
+
+REQUEST_LIMITER = RequestLimiter(MAX_CONCURRENT_REQUESTS, REQUESTS_PER_SECOND)
+
+_request_loop: asyncio.AbstractEventLoop | None = None
+_request_loop_lock = threading.Lock()
 
-        return wrapper
 
-    return decorator
+def get_request_loop() -> asyncio.AbstractEventLoop:
+    """Returns the event loop that runs all parallel model requests.
+
+    The loop runs on a daemon thread, so sync and async callers on any thread
+    share the same limiter and async clients.
+    """
+    global _request_loop
+    with _request_loop_lock:
+        if _request_loop is None:
+            _request_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_request_loop.run_forever, name="gemini-requests", daemon=True
+            ).start()
+        return _request_loop
 
 
 class GeminiModel:
@@ -124,33 +163,58 @@ class GeminiModel:
         distribute_requests: bool = False,
         cache_name: str | None = None,
         temperature: float = 0.01,
+        region: str | None = None,
+        retry_policy: RetryPolicy | None = None,
         **kwargs,
     ):
         self.model_name = model_name
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
         self.finetuned_model = finetuned_model
         self.arguments = kwargs
         self.distribute_requests = distribute_requests
         self.temperature = temperature
-        model_name = self.model_name
-        if not self.finetuned_model and self.distribute_requests:
-            random_region = random.choice(GEMINI_AVAILABLE_REGIONS)
-            model_name = GEMINI_URL.format(
-                GCP_PROJECT=GCP_PROJECT,
-                region=random_region,
-                model_name=self.model_name,
-            )
+        self.region = region if not self.finetuned_model else None
+        # Requests are routed per call unless a region or a cache pins them.
+        self._routed = (
+            not self.finetuned_model
+            and self.distribute_requests
+            and region is None
+            and cache_name is None
+        )
+        self._region_models: dict[str, GenerativeModel] = {}
         if cache_name is not None:
             cached_content = caching.CachedContent(cached_content_name=cache_name)
             self.model = GenerativeModel.from_cached_content(
                 cached_content=cached_content
             )
+        elif self.region is not None:
+            self.model = self._regional_model(self.region)
         else:
             self.model = GenerativeModel(model_name=model_name)
 
-    @retry(max_attempts=12, base_delay=2, backoff_factor=2)
+    def _regional_model(self, region: str) -> GenerativeModel:
+        if region not in self._region_models:
+            self._region_models[region] = GenerativeModel(
+                model_name=GEMINI_URL.format(
+                    GCP_PROJECT=GCP_PROJECT,
+                    region=region,
+                    model_name=self.model_name,
+                )
+            )
+        return self._region_models[region]
+
+    def _model_for_call(self) -> tuple[GenerativeModel, str | None]:
+        """Returns the model to call and its region, if it is tracked."""
+        if self._routed:
+            region = REGION_ROUTER.choose()
+            return self._regional_model(region), region
+        return self.model, self.region
+
     def call(self, prompt: str, parser_func=None) -> str:
         """Calls the Gemini model with the given prompt.
 
+        Failed calls are retried according to the retry policy of the model.
+
         Args:
             prompt (str): The prompt to call the model with.
             parser_func (callable, optional): A function that processes the LLM
@@ -160,74 +224,217 @@ class GeminiModel:
         Returns:
             str: The processed response from the model.
         """
-        response = self.model.generate_content(
-            prompt,
-            generation_config=GenerationConfig(
-                temperature=self.temperature,
-                **self.arguments,
-            ),
-            safety_settings=SAFETY_FILTER_CONFIG,
-        ).text
+        response = self.retry_policy.call(self._call_once, prompt)
         if parser_func:
             return parser_func(response)
         return response
 
+    def _call_once(self, prompt: str) -> str:
+        """Makes a single request and records its outcome for the router."""
+        model, region = self._model_for_call()
+        start = time.monotonic()
+        try:
+            response = model.generate_content(
+                prompt,
+                generation_config=GenerationConfig(
+                    temperature=self.temperature,
+                    **self.arguments,
+                ),
+                safety_settings=SAFETY_FILTER_CONFIG,
+            ).text
+        except Exception as e:
+            if region is not None:
+                REGION_ROUTER.record_failure(region, e)
+            raise
+        if region is not None:
+            REGION_ROUTER.record_success(region, time.monotonic() - start)
+        return response
+
+    async def call_async(self, prompt: str, parser_func=None) -> str:
+        """Calls the Gemini model asynchronously, within the request limiter.
+
+        Failed calls are retried according to the retry policy of the model;
+        the request limiter slot is released while waiting between attempts.
+
+        Args:
+            prompt (str): The prompt to call the model with.
+            parser_func (callable, optional): A function that processes the LLM
+              output.
+
+        Returns:
+            str: The processed response from the model.
+        """
+        response = await self.retry_policy.call_async(self._call_once_async, prompt)
+        if parser_func:
+            return parser_func(response)
+        return response
+
+    async def _call_once_async(self, prompt: str) -> str:
+        """Makes a single request and records its outcome for the router."""
+        model, region = self._model_for_call()
+        async with REQUEST_LIMITER.slot():
+            start = time.monotonic()
+            try:
+                response = await model.generate_content_async(
+                    prompt,
+                    generation_config=GenerationConfig(
+                        temperature=self.temperature,
+                        **self.arguments,
+                    ),
+                    safety_settings=SAFETY_FILTER_CONFIG,
+                )
+            except Exception as e:
+                if region is not None:
+                    REGION_ROUTER.record_failure(region, e)
+                raise
+        if region is not None:
+            REGION_ROUTER.record_success(region, time.monotonic() - start)
+        return response.text
+
+    async def _gather(
+        self,
+        prompts: List[str],
+        parser_func: Optional[Callable[[str], str]],
+        timeout: float,
+    ) -> List[Optional[str]]:
+        """Runs the prompts on the request loop and cancels them on timeout."""
+
+        async def worker(index: int, prompt: str):
+            try:
+                return await self.call_async(prompt, parser_func)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Error for prompt %d: %s", index, e)
+                return f"Error after retries: {str(e)}"
+
+        tasks = [asyncio.ensure_future(worker(i, p)) for i, p in enumerate(prompts)]
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        results = []
+        for index, task in enumerate(tasks):
+            if task in pending:
+                logger.warning("Timeout occurred for prompt %d", index)
+                results.append("Timeout")
+            elif task.exception() is not None:
+                logger.error(
+                    "Unhandled error for prompt %d: %s", index, task.exception()
+                )
+                results.append("Unhandled Error")
+            else:
+                results.append(task.result())
+        return results
+
+    async def call_parallel_async(
+        self,
+        prompts: List[str],
+        parser_func: Optional[Callable[[str], str]] = None,
+        timeout: int = 60,
+    ) -> List[Optional[str]]:
+        """Async variant of `call_parallel`.
+
+        Cancelling the caller cancels the outstanding requests.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._gather(prompts, parser_func, timeout),
+            get_request_loop(),
+        )
+        return await asyncio.wrap_future(future)
+
     def call_parallel(
         self,
         prompts: List[str],
         parser_func: Optional[Callable[[str], str]] = None,
         timeout: int = 60,
-        max_retries: int = 5,
     ) -> List[Optional[str]]:
-        """Calls the Gemini model for multiple prompts in parallel using threads with retry logic.
+        """Calls the Gemini model for multiple prompts concurrently with retry logic.
+
+        The requests run as asyncio tasks on the shared request loop, bounded
+        by the process-wide request limiter. Requests still running after
+        `timeout` seconds are cancelled.
 
         Args:
             prompts (List[str]): A list of prompts to call the model with.
             parser_func (callable, optional): A function to process each response.
-            timeout (int): The maximum time (in seconds) to wait for each thread.
-            max_retries (int): The maximum number of retries for timed-out threads.
+            timeout (int): The maximum time (in seconds) to wait for all prompts.
 
         Returns:
             List[Optional[str]]:
-            A list of responses, or None for threads that failed.
+            A list of responses in the order of the prompts, or an error
+            message for prompts that failed or timed out.
         """
-        results = [None] * len(prompts)
-
-        def worker(index: int, prompt: str):
-            """Thread worker function to call the model and store the result with retries."""
-            retries = 0
-            while retries <= max_retries:
-                try:
-                    return self.call(prompt, parser_func)
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Error for prompt {index}: {str(e)}")
-                    retries += 1
-                    if retries <= max_retries:
-                        print(f"Retrying ({retries}/{max_retries}) for prompt {index}")
-                        time.sleep(1)  # Small delay before retrying
-                    else:
-                        return f"Error after retries: {str(e)}"
-
-        # Create and start one thread for each prompt
-        with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
-            future_to_index = {
-                executor.submit(worker, i, prompt): i
-                for i, prompt in enumerate(prompts)
-            }
-
-            for future in as_completed(future_to_index, timeout=timeout):
-                index = future_to_index[future]
-                try:
-                    results[index] = future.result()
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Unhandled error for prompt {index}: {e}")
-                    results[index] = "Unhandled Error"
-
-        # Handle remaining unfinished tasks after the timeout
-        for future in future_to_index:
-            index = future_to_index[future]
-            if not future.done():
-                print(f"Timeout occurred for prompt {index}")
-                results[index] = "Timeout"
+        future = asyncio.run_coroutine_threadsafe(
+            self._gather(prompts, parser_func, timeout),
+            get_request_loop(),
+        )
+        return future.result()
 
-        return results
+
+async def _first_valid(
+    requests: List[tuple[GeminiModel, str]],
+    is_valid: Callable[[str], bool],
+    parser_func: Optional[Callable[[str], str]],
+    timeout: float,
+) -> Optional[str]:
+    """Returns the first valid response and cancels the outstanding requests.
+
+    If no response is valid, returns the first response received, or None if
+    every request failed or timed out.
+    """
+    tasks = [
+        asyncio.ensure_future(model.call_async(prompt, parser_func))
+        for model, prompt in requests
+    ]
+    fallback = None
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=timeout):
+            try:
+                response = await next_done
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Candidate failed: %s", e)
+                continue
+            # Validation is CPU bound; keep it off the request loop.
+            if response and await asyncio.to_thread(is_valid, response):
+                return response
+            if fallback is None:
+                fallback = response
+    except asyncio.TimeoutError:
+        logger.warning("Timeout occurred while waiting for a valid candidate")
+    finally:
+        for task in tasks:
+            task.cancel()
+    if fallback is None:
+        logger.warning("Every candidate request failed")
+    else:
+        logger.warning("No valid candidate; using the first response received")
+    return fallback
+
+
+async def call_first_valid_async(
+    requests: List[tuple[GeminiModel, str]],
+    is_valid: Callable[[str], bool],
+    parser_func: Optional[Callable[[str], str]] = None,
+    timeout: int = 60,
+) -> Optional[str]:
+    """Sends all requests and returns as soon as one response is valid.
+
+    Args:
+        requests (List[tuple[GeminiModel, str]]): The model and prompt of each
+          request. Different models, e.g. pinned to different regions, race
+          against each other.
+        is_valid (callable): Returns True if a parsed response is acceptable.
+        parser_func (callable, optional): A function to process each response.
+        timeout (int): The maximum time (in seconds) to wait for a valid
+          response.
+
+    Returns:
+        Optional[str]: The first valid response. If no response is valid, the
+        first response received, or None if every request failed.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        _first_valid(requests, is_valid, parser_func, timeout),
+        get_request_loop(),
+    )
+    return await asyncio.wrap_future(future)
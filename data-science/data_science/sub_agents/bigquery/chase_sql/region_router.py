@@ -0,0 +1,158 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Health-aware routing of model requests across Vertex AI regions.
+
+The router keeps an exponentially weighted moving average (EWMA) of the
+latency and of the error rate of every region. Each request picks two random
+healthy regions and goes to the one with the better score ("power of two
+choices"), which favors fast regions without sending all traffic to one of
+them. Regions that keep returning 429 or 5xx errors are ejected for a backoff
+period that grows with every ejection.
+"""
+
+import dataclasses
+import logging
+import random
+import threading
+import time
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class RegionStats:
+    """Health statistics of one region."""
+
+    latency: float | None = None
+    error_rate: float = 0.0
+    consecutive_failures: int = 0
+    ejections: int = 0
+    ejected_until: float = 0.0
+
+
+def is_region_error(error: Exception) -> bool:
+    """True if an error says the region is throttling or unhealthy.
+
+    Covers the `google.api_core` exceptions, which carry the HTTP status as
+    `code`, and timeouts.
+    """
+    if isinstance(error, TimeoutError):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and (code == 429 or code >= 500)
+
+
+class RegionRouter:
+    """Routes each request to a healthy, fast region."""
+
+    def __init__(
+        self,
+        regions: Iterable[str],
+        alpha: float = 0.2,
+        eject_after_failures: int = 3,
+        base_ejection_seconds: float = 30.0,
+        max_ejection_seconds: float = 300.0,
+        error_penalty: float = 4.0,
+    ):
+        """Initializes the router.
+
+        Args:
+            regions (Iterable[str]): The regions to route to. Duplicates are
+              ignored.
+            alpha (float): Weight of the newest sample in the moving averages.
+            eject_after_failures (int): Consecutive region errors after which a
+              region is ejected.
+            base_ejection_seconds (float): Duration of the first ejection; every
+              further ejection of the same region doubles it.
+            max_ejection_seconds (float): Upper bound of an ejection.
+            error_penalty (float): How much the error rate inflates the latency
+              score of a region.
+        """
+        self.regions = list(dict.fromkeys(regions))
+        self.alpha = alpha
+        self.eject_after_failures = eject_after_failures
+        self.base_ejection_seconds = base_ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self.error_penalty = error_penalty
+        self.stats = {region: RegionStats() for region in self.regions}
+        self._lock = threading.Lock()
+
+    def _healthy(self, now: float) -> list[str]:
+        healthy = [r for r in self.regions if self.stats[r].ejected_until <= now]
+        # If every region is ejected, fall back to the one that returns first.
+        return healthy or [min(self.regions, key=lambda r: self.stats[r].ejected_until)]
+
+    def _score(self, region: str, default_latency: float) -> float:
+        stats = self.stats[region]
+        latency = stats.latency if stats.latency is not None else default_latency
+        return latency * (1 + self.error_penalty * stats.error_rate)
+
+    def _default_latency(self) -> float:
+        # Unmeasured regions look as fast as the fastest measured one, so they
+        # get explored.
+        latencies = [s.latency for s in self.stats.values() if s.latency is not None]
+        return min(latencies, default=1.0)
+
+    def choose(self) -> str:
+        """Returns the region for the next request."""
+        with self._lock:
+            healthy = self._healthy(time.monotonic())
+            if len(healthy) == 1:
+                return healthy[0]
+            default_latency = self._default_latency()
+            first, second = random.sample(healthy, 2)
+            return min(
+                (first, second), key=lambda r: self._score(r, default_latency)
+            )
+
+    def choose_distinct(self, count: int) -> list[str]:
+        """Returns `count` regions, distinct while there are enough healthy ones."""
+        with self._lock:
+            healthy = self._healthy(time.monotonic())
+            default_latency = self._default_latency()
+            healthy.sort(key=lambda r: (self._score(r, default_latency), random.random()))
+        return [healthy[i % len(healthy)] for i in range(count)]
+
+    def record_success(self, region: str, latency: float) -> None:
+        """Records a successful request and its latency."""
+        with self._lock:
+            stats = self.stats.setdefault(region, RegionStats())
+            stats.latency = (
+                latency
+                if stats.latency is None
+                else self.alpha * latency + (1 - self.alpha) * stats.latency
+            )
+            stats.error_rate *= 1 - self.alpha
+            stats.consecutive_failures = 0
+            stats.ejections = 0
+
+    def record_failure(self, region: str, error: Exception) -> None:
+        """Records a failed request; region errors may eject the region."""
+        if not is_region_error(error):
+            return
+        with self._lock:
+            stats = self.stats.setdefault(region, RegionStats())
+            stats.error_rate = self.alpha + (1 - self.alpha) * stats.error_rate
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.eject_after_failures:
+                duration = min(
+                    self.max_ejection_seconds,
+                    self.base_ejection_seconds * 2**stats.ejections,
+                )
+                stats.ejected_until = time.monotonic() + duration
+                stats.ejections += 1
+                stats.consecutive_failures = 0
+                logger.warning("Ejecting region %s for %.0fs", region, duration)
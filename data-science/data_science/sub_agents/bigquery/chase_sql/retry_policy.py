@@ -0,0 +1,170 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Retry policy for the model calls of the CHASE-SQL agent.
+
+Only errors that are worth retrying (throttling, server errors, timeouts and
+dropped connections) are retried. Delays use exponential backoff with full
+jitter, or the delay the server asked for, and no call retries past an
+overall deadline.
+"""
+
+import asyncio
+import collections
+import dataclasses
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+from .region_router import is_region_error
+
+logger = logging.getLogger(__name__)
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for throttling, server errors, timeouts and connection errors."""
+    return is_region_error(error) or isinstance(error, ConnectionError)
+
+
+def retry_after(error: Exception) -> float | None:
+    """Returns the delay in seconds the server asked for, if any.
+
+    Reads a `Retry-After` header of the HTTP response and the `RetryInfo`
+    detail of gRPC errors.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    if value is not None:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+
+class RetryMetrics:
+    """Process-wide counters of the retry budget."""
+
+    def __init__(self):
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def snapshot(self) -> dict[str, float]:
+        """Returns the counters and the share of attempts that were retries."""
+        with self._lock:
+            counters = dict(self._counters)
+        attempts = counters.get("attempts", 0)
+        counters["retry_ratio"] = counters.get("retries", 0) / attempts if attempts else 0.0
+        return counters
+
+
+RETRY_METRICS = RetryMetrics()
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    """Jittered exponential backoff bounded by attempts and an overall deadline.
+
+    Attributes:
+      max_attempts: The maximum number of attempts, including the first one.
+      base_delay: The backoff ceiling of the first retry, in seconds.
+      backoff_factor: The factor by which the ceiling grows per retry.
+      max_delay: The upper bound of a single delay, in seconds.
+      deadline: The time after which no further attempt is started, in seconds
+        from the first attempt.
+    """
+
+    max_attempts: int = 5
+    base_delay: float = 1.0
+    backoff_factor: float = 2.0
+    max_delay: float = 20.0
+    deadline: float = 60.0
+    metrics: RetryMetrics = dataclasses.field(default=RETRY_METRICS, repr=False)
+
+    def _next_delay(
+        self, attempt: int, error: Exception, started: float
+    ) -> float | None:
+        """Returns the delay before the next attempt, or None to give up."""
+        if not is_retryable(error):
+            self.metrics.add("not_retryable")
+            return None
+        if attempt >= self.max_attempts:
+            self.metrics.add("exhausted")
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            ceiling = self.base_delay * self.backoff_factor ** (attempt - 1)
+            delay = random.uniform(0, min(self.max_delay, ceiling))
+        if time.monotonic() - started + delay > self.deadline:
+            self.metrics.add("deadline_exceeded")
+            return None
+        self.metrics.add("retries")
+        self.metrics.add("sleep_seconds", delay)
+        logger.warning(
+            "Attempt %d failed with error: %s; retrying in %.1fs",
+            attempt,
+            error,
+            delay,
+        )
+        return delay
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Calls `func`, sleeping between retries."""
+        started = time.monotonic()
+        self.metrics.add("calls")
+        for attempt in range(1, self.max_attempts + 1):
+            self.metrics.add("attempts")
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                delay = self._next_delay(attempt, e, started)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def call_async(
+        self, func: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """Awaits `func`, sleeping asynchronously between retries."""
+        started = time.monotonic()
+        self.metrics.add("calls")
+        for attempt in range(1, self.max_attempts + 1):
+            self.metrics.add("attempts")
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                delay = self._next_delay(attempt, e, started)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy(
+    max_attempts=int(os.getenv("CHASE_RETRY_MAX_ATTEMPTS", "5")),
+    deadline=float(os.getenv("CHASE_RETRY_DEADLINE_SECONDS", "60")),
+)
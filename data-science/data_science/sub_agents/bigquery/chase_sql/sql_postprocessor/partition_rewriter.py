@@ -0,0 +1,456 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Partition- and cluster-aware rewriting of generated BigQuery SQL.
+
+BigQuery only prunes partitions for filters it can evaluate on the
+partitioning column itself. The rewriter reads the `partitioning` and
+`clustering` entries that schema discovery stores in `bq_schema_and_samples`
+and, for every partitioned table a query reads:
+
+1. turns `EXTRACT(YEAR FROM column) = year` filters into ranges on the column,
+   which BigQuery can prune on;
+2. adds the period the question names, e.g. "in 2024" or "in March 2024", as
+   a filter on the partitioning column when that period can only refer to
+   it (see `PartitionRewriter.rewrite`);
+3. warns if the query still reads all partitions, or all blocks of a
+   clustered table, with any other time range of the question, e.g. "in the
+   last 30 days", as a hint for a partition filter.
+
+A period is not added when the query may already restrict it through another
+column, such as a year column, since a filter on the partitioning column
+would then drop rows.
+"""
+
+import dataclasses
+import datetime
+import functools
+import inspect
+import logging
+import re
+from typing import Any, Callable
+
+import sqlglot
+from sqlglot import exp
+
+_TEMPORAL_TYPES = frozenset({"DATE", "DATETIME", "TIMESTAMP"})
+_MONTHS = (
+    "january february march april may june july august september october "
+    "november december"
+).split()
+_UNIT = r"(day|week|month|quarter|year)s?"
+_LAST_N = re.compile(rf"\b(?:last|past|previous)\s+(\d+)\s+{_UNIT}\b")
+_LAST_ONE = re.compile(rf"\b(?:last|past|previous)\s+{_UNIT}\b")
+_THIS = re.compile(rf"\bthis\s+{_UNIT}\b")
+_MONTH_YEAR = re.compile(rf"\b({'|'.join(_MONTHS)})\s+((?:19|20)\d\d)\b")
+_YEAR = re.compile(r"\b(?:in|during|for|of)\s+((?:19|20)\d\d)\b")
+_ISO_DATE = r"(\d{4}-\d{2}-\d{2})"
+_BETWEEN = re.compile(rf"\b(?:between|from)\s+{_ISO_DATE}\s+(?:and|to)\s+{_ISO_DATE}")
+_SINCE = re.compile(rf"\b(?:since|after)\s+{_ISO_DATE}")
+_ANY_YEAR = re.compile(r"\b((?:19|20)\d\d)\b")
+_RELATIVE = re.compile(
+    rf"{_LAST_N.pattern}|{_LAST_ONE.pattern}|{_THIS.pattern}|{_SINCE.pattern}"
+    r"|\b(?:yesterday|today|ago|recent(?:ly)?)\b"
+)
+
+
+def _add_months(day: datetime.date, months: int) -> datetime.date:
+    month = day.year * 12 + day.month - 1 + months
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+def _period_start(today: datetime.date, unit: str) -> datetime.date:
+    if unit == "day":
+        return today
+    if unit == "week":
+        return today - datetime.timedelta(days=today.weekday())
+    if unit == "month":
+        return today.replace(day=1)
+    if unit == "quarter":
+        return datetime.date(today.year, (today.month - 1) // 3 * 3 + 1, 1)
+    return datetime.date(today.year, 1, 1)
+
+
+def _go_back(today: datetime.date, number: int, unit: str) -> datetime.date:
+    """Returns the start of the last `number` units, e.g. the last 2 months.
+
+    Both readings of such ranges, rolling ("the 2 months up to today") and
+    calendar ("the 2 previous months"), are covered, so that the filter
+    never drops rows the question asks about.
+    """
+    if unit in ("day", "week"):
+        start = today - datetime.timedelta(days=number * (7 if unit == "week" else 1))
+    else:
+        months = number * {"month": 1, "quarter": 3, "year": 12}[unit]
+        start = _add_months(today.replace(day=1), -months)
+    return _period_start(start, unit)
+
+
+def time_range(
+    question: str, today: datetime.date
+) -> tuple[datetime.date, datetime.date] | None:
+    """Returns the date range a question names, if any.
+
+    Args:
+        question (str): The natural language question.
+        today (datetime.date): The date relative ranges are resolved against.
+
+    Returns:
+        tuple: The first day of the range and the day after its last day, or
+        None if the question names no range.
+    """
+    text = question.lower()
+    next_day = today + datetime.timedelta(days=1)
+    if match := _BETWEEN.search(text):
+        start, end = (datetime.date.fromisoformat(d) for d in match.groups())
+        return start, end + datetime.timedelta(days=1)
+    if match := _SINCE.search(text):
+        return datetime.date.fromisoformat(match.group(1)), next_day
+    if match := _LAST_N.search(text):
+        return _go_back(today, int(match.group(1)), match.group(2)), next_day
+    if match := _LAST_ONE.search(text):
+        return _go_back(today, 1, match.group(1)), next_day
+    if match := _THIS.search(text):
+        return _period_start(today, match.group(1)), next_day
+    if "yesterday" in text:
+        return today - datetime.timedelta(days=1), today
+    if re.search(r"\btoday\b", text):
+        return today, next_day
+    if match := _MONTH_YEAR.search(text):
+        start = datetime.date(int(match.group(2)), _MONTHS.index(match.group(1)) + 1, 1)
+        return start, _add_months(start, 1)
+    if match := _YEAR.search(text):
+        year = int(match.group(1))
+        return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+    return None
+
+
+def explicit_time_range(question: str) -> tuple[datetime.date, datetime.date] | None:
+    """Returns the period a question names by its dates, if it names one.
+
+    Unlike `time_range`, only a single calendar year, month or date range
+    counts, e.g. "in 2024", "in march 2024" or "between 2024-01-01 and
+    2024-01-31". Questions that also mention other years, or a range
+    relative to today, name no single period.
+
+    Returns:
+        tuple: The first day of the period and the day after its last day, or
+        None.
+    """
+    text = question.lower()
+    if _RELATIVE.search(text):
+        return None
+    if match := _BETWEEN.search(text):
+        start, end = (datetime.date.fromisoformat(d) for d in match.groups())
+        end += datetime.timedelta(days=1)
+    elif match := _MONTH_YEAR.search(text):
+        start = datetime.date(int(match.group(2)), _MONTHS.index(match.group(1)) + 1, 1)
+        end = _add_months(start, 1)
+    elif match := _YEAR.search(text):
+        year = int(match.group(1))
+        start, end = datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+    else:
+        return None
+    last_year = (end - datetime.timedelta(days=1)).year
+    if any(not start.year <= int(y) <= last_year for y in _ANY_YEAR.findall(text)):
+        return None
+    return start, end
+
+
+@dataclasses.dataclass
+class RewriteResult:
+    """The rewritten SQL and what the rewriter did.
+
+    Attributes:
+      sql: The rewritten SQL, or the input SQL if nothing changed.
+      rewrites: A description of every change.
+      warnings: The full scans the query will still do.
+    """
+
+    sql: str
+    rewrites: list[str] = dataclasses.field(default_factory=list)
+    warnings: list[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.rewrites)
+
+
+def _table_id(table: exp.Table) -> str:
+    return ".".join(part for part in (table.catalog, table.db, table.name) if part)
+
+
+def _lookup(
+    schema_and_samples: dict[str, Any], table: exp.Table
+) -> tuple[str, dict] | None:
+    """Returns the ID and schema entry of a table; its ID may omit the project."""
+    table_id = _table_id(table).lower()
+    for name, table_context in schema_and_samples.items():
+        lowered = name.lower()
+        if lowered == table_id or lowered.endswith("." + table_id):
+            return name, table_context
+    return None
+
+
+def _refers_to(column: exp.Column, table: exp.Table, name: str) -> bool:
+    return column.name.lower() == name.lower() and (
+        not column.table
+        or column.table.lower() in (table.alias_or_name.lower(), table.name.lower())
+    )
+
+
+def _literal(day: datetime.date, column_type: str) -> exp.Expression:
+    return exp.cast(exp.Literal.string(day.isoformat()), column_type)
+
+
+def _year_range(
+    predicate: exp.EQ, table: exp.Table, field: str, column_type: str
+) -> exp.Expression | None:
+    """Returns a range on `field` for `EXTRACT(YEAR FROM field) = year`."""
+    for extract, value in (
+        (predicate.left, predicate.right),
+        (predicate.right, predicate.left),
+    ):
+        if (
+            isinstance(extract, exp.Extract)
+            and extract.name.upper() == "YEAR"
+            and isinstance(extract.expression, exp.Column)
+            and _refers_to(extract.expression, table, field)
+            and isinstance(value, exp.Literal)
+            and value.is_int
+        ):
+            year = int(value.this)
+            column = extract.expression.copy()
+            return exp.and_(
+                column >= _literal(datetime.date(year, 1, 1), column_type),
+                column.copy() < _literal(datetime.date(year + 1, 1, 1), column_type),
+            )
+    return None
+
+
+class PartitionRewriter:
+    """Rewrites queries so that BigQuery can prune partitions and blocks."""
+
+    def __init__(self, schema_and_samples: dict[str, Any]):
+        """Initializes the rewriter.
+
+        Args:
+            schema_and_samples (dict): The `bq_schema_and_samples` of the
+              database settings, keyed by `project.dataset.table`.
+        """
+        self.schema_and_samples = schema_and_samples
+
+    def rewrite(
+        self,
+        sql: str,
+        question: str | None = None,
+        today: datetime.date | None = None,
+    ) -> RewriteResult:
+        """Rewrites a query for the partitioned and clustered tables it reads.
+
+        The period named by the question (see `explicit_time_range`) is added
+        as a filter on a table only if the query does not filter the table on
+        its partitioning column, the partitioning column is the only date or
+        time column of the table, the table is the FROM table of its SELECT
+        and the query mentions none of the years of the period, e.g. as a
+        filter on a year column. Other time ranges of the question are only
+        suggested in the full scan warnings.
+
+        Args:
+            sql (str): The generated BigQuery SQL.
+            question (str, optional): The question the SQL answers.
+            today (datetime.date, optional): The date relative time ranges are
+              resolved against. Defaults to the current UTC date.
+
+        Returns:
+            RewriteResult: The rewritten SQL, the changes and the warnings.
+        """
+        result = RewriteResult(sql=sql)
+        try:
+            expression = sqlglot.parse_one(sql, read="bigquery")
+        except sqlglot.errors.SqlglotError:
+            return result
+        today = today or datetime.datetime.now(datetime.timezone.utc).date()
+        question_range = time_range(question, today) if question else None
+        period = explicit_time_range(question) if question else None
+
+        for table in list(expression.find_all(exp.Table)):
+            entry = _lookup(self.schema_and_samples, table)
+            if entry is None:
+                continue
+            table_id, table_context = entry
+            partitioning = table_context.get("partitioning")
+            clustering = table_context.get("clustering") or []
+            select = table.find_ancestor(exp.Select)
+            where = select.args.get("where") if select is not None else None
+            condition = where.this if where is not None else None
+            if partitioning:
+                if self._prune(result, table, table_id, partitioning, table_context, condition):
+                    continue
+                if period is not None and self._add_period(
+                    result,
+                    expression,
+                    table,
+                    table_id,
+                    partitioning,
+                    table_context,
+                    period,
+                ):
+                    continue
+            if clustering and self._filters(condition, table, clustering[0]):
+                continue
+            if partitioning:
+                warning = (
+                    f"Full scan of partitioned table {table_id}: the query does "
+                    f"not filter on its partitioning column {partitioning['field']}."
+                )
+                if partitioning.get("require_filter"):
+                    warning += " BigQuery rejects queries on this table without one."
+                if question_range is not None:
+                    start, end = question_range
+                    warning += (
+                        f" If the question's period [{start}, {end}) refers to "
+                        f"{partitioning['field']}, filter on it."
+                    )
+                result.warnings.append(warning)
+            elif clustering:
+                result.warnings.append(
+                    f"Full scan of clustered table {table_id}: the query does not "
+                    f"filter on its first clustering column {clustering[0]}."
+                )
+
+        if result.changed:
+            result.sql = expression.sql(dialect="bigquery")
+        return result
+
+    @staticmethod
+    def _filters(condition: exp.Expression | None, table: exp.Table, field: str) -> bool:
+        return condition is not None and any(
+            _refers_to(column, table, field) for column in condition.find_all(exp.Column)
+        )
+
+    @staticmethod
+    def _add_period(
+        result: RewriteResult,
+        expression: exp.Expression,
+        table: exp.Table,
+        table_id: str,
+        partitioning: dict[str, Any],
+        table_context: dict[str, Any],
+        period: tuple[datetime.date, datetime.date],
+    ) -> bool:
+        """Filters the table on the question's period; True if it did."""
+        field = partitioning["field"]
+        temporal_columns = [
+            (name, column_type.upper())
+            for name, column_type in table_context.get("table_schema", [])
+            if column_type.upper() in _TEMPORAL_TYPES
+        ]
+        if len(temporal_columns) != 1 or temporal_columns[0][0] != field:
+            return False
+        select = table.parent.parent if isinstance(table.parent, exp.From) else None
+        if not isinstance(select, exp.Select):
+            return False
+        start, end = period
+        last_year = (end - datetime.timedelta(days=1)).year
+        years = {str(year) for year in range(start.year, last_year + 1)}
+        if any(
+            any(year in literal.this for year in years)
+            for literal in expression.find_all(exp.Literal)
+        ):
+            return False
+        column_type = temporal_columns[0][1]
+        column = exp.column(field, table=table.alias_or_name)
+        select.where(
+            exp.and_(
+                column >= _literal(start, column_type),
+                column.copy() < _literal(end, column_type),
+            ),
+            copy=False,
+        )
+        result.rewrites.append(
+            f"Filtered {table_id}.{field} on the question's period [{start}, {end})."
+        )
+        return True
+
+    def _prune(
+        self,
+        result: RewriteResult,
+        table: exp.Table,
+        table_id: str,
+        partitioning: dict[str, Any],
+        table_context: dict[str, Any],
+        condition: exp.Expression | None,
+    ) -> bool:
+        """Makes the partition filters of the query prunable; True if it has any."""
+        field = partitioning["field"]
+        if not self._filters(condition, table, field):
+            return False
+        column_types = dict(table_context.get("table_schema", []))
+        column_type = {"_PARTITIONTIME": "TIMESTAMP", "_PARTITIONDATE": "DATE"}.get(
+            field.upper(), column_types.get(field, "")
+        ).upper()
+        if column_type not in _TEMPORAL_TYPES:
+            return True
+        for predicate in list(condition.find_all(exp.EQ)):
+            replacement = _year_range(predicate, table, field, column_type)
+            if replacement is not None:
+                predicate.replace(exp.paren(replacement))
+                result.rewrites.append(
+                    f"Turned a year filter on {table_id}.{field} into a range."
+                )
+        return True
+
+
+def rewrite_for_partitions(func: Callable) -> Callable:
+    """Decorates an NL2SQL tool to rewrite its SQL with `PartitionRewriter`.
+
+    Apply it outside of `cache_nl2sql`, so that the period is taken from the
+    question being answered rather than from a similar cached question. The
+    rewrites and warnings are logged and stored in
+    `tool_context.state["partition_rewrite"]`; the returned SQL is the
+    rewritten query alone.
+    """
+
+    def apply(sql: str, question: str, tool_context) -> str:
+        settings = tool_context.state["database_settings"]
+        result = PartitionRewriter(settings["bq_schema_and_samples"]).rewrite(
+            sql, question
+        )
+        for rewrite in result.rewrites:
+            logging.info("Partition rewrite: %s", rewrite)
+        for warning in result.warnings:
+            logging.warning("%s", warning)
+        tool_context.state["partition_rewrite"] = {
+            "rewrites": result.rewrites,
+            "warnings": result.warnings,
+        }
+        tool_context.state["sql_query"] = result.sql
+        return result.sql
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(question: str, tool_context) -> str:
+            sql = await func(question, tool_context)
+            return apply(sql, question, tool_context) if sql else sql
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(question: str, tool_context) -> str:
+        sql = func(question, tool_context)
+        return apply(sql, question, tool_context) if sql else sql
+
+    return wrapper
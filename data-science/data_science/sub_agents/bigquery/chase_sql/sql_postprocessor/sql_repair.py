@@ -0,0 +1,326 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rule-based repair of SQL errors found by SQLGlot.
+
+Many errors in generated SQL are mechanical: a table that is missing its
+dataset, a table or column name with the wrong case or quoting, a column
+qualified with an alias that does not exist, or identifiers quoted as
+strings. The rules below fix them against the schema without an LLM round
+trip. A repair is only kept if the SQLGlot check then passes; otherwise the
+original errors go to the LLM.
+
+Names are only matched if they differ in case or quoting. A misspelled name,
+e.g. `sales_2024` for a `sales_2023` table, may well be a different table or
+column, and a rename would pass the check and silently run the wrong query,
+so it is left to the LLM.
+"""
+
+import collections
+import dataclasses
+import re
+import threading
+from typing import Any, Callable, Iterable
+
+import sqlglot
+from sqlglot.optimizer.scope import Scope, traverse_scope
+
+
+@dataclasses.dataclass(frozen=True)
+class RepairSchema:
+    """The tables of a SQLGlot schema, by name.
+
+    Attributes:
+      tables: The column names and types per table name.
+      paths: The enclosing schema keys per table name, e.g. ("project",
+        "dataset").
+    """
+
+    tables: dict[str, dict[str, str]]
+    paths: dict[str, tuple[str, ...]]
+
+
+# A rule takes the SQL query, its SQLGlot errors and the schema, and returns a
+# rewrite or None.
+RepairRule = Callable[[str, str, RepairSchema], str | None]
+# Checks a SQL query; returns its errors, or None, and the optimized query.
+CheckFunction = Callable[[str], tuple[str | None, str]]
+
+_UNRESOLVED_COLUMN = re.compile(
+    r"Column '(?P<column>[^']+)' could not be resolved"
+    r"(?: for table: '(?P<table>[^']+)')?"
+)
+
+
+def repair_schema(
+    schema_dict: dict[str, Any] | None, path: tuple[str, ...] = ()
+) -> RepairSchema:
+    """Returns the tables of a (possibly nested) SQLGlot schema by name."""
+    schema = RepairSchema({}, {})
+    for name, value in (schema_dict or {}).items():
+        if all(isinstance(v, str) for v in value.values()):
+            schema.tables[name] = value
+            schema.paths[name] = path
+        else:
+            nested = repair_schema(value, path + (name,))
+            schema.tables.update(nested.tables)
+            schema.paths.update(nested.paths)
+    return schema
+
+
+def _same_name(name: str, candidates: Iterable[str]) -> str | None:
+    """Returns the candidate that matches `name` ignoring case, if any."""
+    return next((c for c in candidates if c.lower() == name.lower()), None)
+
+
+def _parse(sql_query: str) -> sqlglot.exp.Expression | None:
+    try:
+        return sqlglot.parse_one(sql_query, read="bigquery")
+    except sqlglot.errors.SqlglotError:
+        return None
+
+
+def _cte_names(expression: sqlglot.exp.Expression) -> set[str]:
+    return {cte.alias_or_name for cte in expression.find_all(sqlglot.exp.CTE)}
+
+
+def qualify_tables(sql_query: str, errors: str, schema: RepairSchema) -> str | None:
+    """Adds the dataset and project of the schema to unqualified tables."""
+    expression = _parse(sql_query)
+    if expression is None:
+        return None
+    cte_names = _cte_names(expression)
+    changed = False
+    for table in expression.find_all(sqlglot.exp.Table):
+        path = schema.paths.get(table.name)
+        if not path or table.name in cte_names:
+            continue
+        if not table.db:
+            table.set("db", sqlglot.exp.to_identifier(path[-1]))
+            changed = True
+        if not table.catalog and len(path) > 1:
+            table.set("catalog", sqlglot.exp.to_identifier(path[-2]))
+            changed = True
+    return expression.sql(dialect="bigquery") if changed else None
+
+
+def match_table_names(
+    sql_query: str, errors: str, schema: RepairSchema
+) -> str | None:
+    """Fixes the case of tables that are not in the schema."""
+    expression = _parse(sql_query)
+    if expression is None or not schema.tables:
+        return None
+    cte_names = _cte_names(expression)
+    changed = False
+    for table in expression.find_all(sqlglot.exp.Table):
+        if table.name in schema.tables or table.name in cte_names or not table.name:
+            continue
+        match = _same_name(table.name, schema.tables)
+        if match is not None:
+            table.set("this", sqlglot.exp.to_identifier(match))
+            changed = True
+    return expression.sql(dialect="bigquery") if changed else None
+
+
+def _source_columns(source: Any, schema: RepairSchema) -> list[str]:
+    """Returns the columns of a table or of a subquery of a scope.
+
+    A table that is not in the schema has the columns of the table
+    `match_table_names` renames it to.
+    """
+    if isinstance(source, Scope):
+        return list(source.expression.named_selects)
+    if isinstance(source, sqlglot.exp.Table):
+        name = _same_name(source.name, schema.tables)
+        return list(schema.tables[name]) if name is not None else []
+    return []
+
+
+def match_column_names(
+    sql_query: str, errors: str, schema: RepairSchema
+) -> str | None:
+    """Fixes the case of an unresolved column against the columns of its tables.
+
+    A qualified column is matched against the table or subquery its
+    qualifier names, an unqualified one against the sources of its SELECT.
+    """
+    match = _UNRESOLVED_COLUMN.search(errors)
+    expression = _parse(sql_query)
+    if match is None or expression is None:
+        return None
+    unresolved = match.group("column").lower()
+    changed = False
+    for scope in traverse_scope(expression):
+        sources = {name.lower(): source for name, source in scope.sources.items()}
+        for column in scope.columns:
+            if column.name.lower() != unresolved:
+                continue
+            if column.table:
+                candidates = _source_columns(sources.get(column.table.lower()), schema)
+            else:
+                candidates = [
+                    c for source in sources.values() for c in _source_columns(source, schema)
+                ]
+            replacement = _same_name(column.name, candidates)
+            if replacement is not None and replacement != column.name:
+                column.set("this", sqlglot.exp.to_identifier(replacement))
+                changed = True
+    return expression.sql(dialect="bigquery") if changed else None
+
+
+def drop_unknown_qualifiers(
+    sql_query: str, errors: str, schema: RepairSchema
+) -> str | None:
+    """Unqualifies columns whose qualifier is neither a table nor an alias."""
+    match = _UNRESOLVED_COLUMN.search(errors)
+    expression = _parse(sql_query)
+    if match is None or match.group("table") is None or expression is None:
+        return None
+    sources = {
+        name.lower()
+        for table in expression.find_all(sqlglot.exp.Table)
+        for name in (table.name, table.alias)
+        if name
+    } | {
+        subquery.alias.lower()
+        for subquery in expression.find_all(sqlglot.exp.Subquery, sqlglot.exp.CTE)
+        if subquery.alias
+    }
+    changed = False
+    for column in expression.find_all(sqlglot.exp.Column):
+        if column.table and column.table.lower() not in sources:
+            column.set("table", None)
+            changed = True
+    return expression.sql(dialect="bigquery") if changed else None
+
+
+def backtick_quoted_identifiers(
+    sql_query: str, errors: str, schema: RepairSchema
+) -> str | None:
+    """Quotes identifiers written in double quotes, e.g. "T1"."City", with backticks.
+
+    BigQuery reads double-quoted text as a string, so only names of tables and
+    columns in the schema, and of aliases, are rewritten.
+    """
+    names = {t.lower() for t in schema.tables} | {
+        c.lower() for table in schema.tables.values() for c in table
+    }
+    names |= {
+        alias.lower()
+        for alias in re.findall(r"\bAS\s+[`\"]?(\w+)", sql_query, flags=re.IGNORECASE)
+    }
+
+    def replace(match: re.Match) -> str:
+        name = match.group(1)
+        return f"`{name}`" if name.lower() in names else match.group(0)
+
+    return re.sub(r'"(\w+)"', replace, sql_query)
+
+
+DEFAULT_RULES: tuple[RepairRule, ...] = (
+    backtick_quoted_identifiers,
+    qualify_tables,
+    match_table_names,
+    drop_unknown_qualifiers,
+    match_column_names,
+)
+
+
+class SqlRepairEngine:
+    """Applies the repair rules until the SQLGlot check passes.
+
+    Rewrites that only change the errors are combined with further rewrites,
+    but a query is only repaired if the check passes in the end.
+
+    Attributes:
+      stats: Per rule, how often it rewrote a query ("<rule>.applied"), how
+        often the rewrite changed the errors ("<rule>.progress") and how often
+        it made the check pass ("<rule>.fixed"); and how many queries were
+        seen ("queries") and repaired ("repaired").
+    """
+
+    def __init__(self, rules: Iterable[RepairRule] = DEFAULT_RULES, max_rounds: int = 3):
+        self.rules = tuple(rules)
+        self.max_rounds = max_rounds
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def merge(self, stats: dict[str, int]) -> None:
+        """Adds the stats of another engine, e.g. of a worker process."""
+        with self._lock:
+            self.stats.update(stats)
+
+    def repair(
+        self,
+        sql_query: str,
+        errors: str,
+        schema_dict: dict[str, Any] | None,
+        check: CheckFunction,
+    ) -> tuple[str | None, str]:
+        """Repairs a query that failed the SQLGlot check.
+
+        Args:
+          sql_query: The SQL query that failed the check.
+          errors: The errors of the check.
+          schema_dict: The SQLGlot schema.
+          check: The SQLGlot check, e.g. `SqlTranslator._check_for_errors`.
+
+        Returns:
+          tuple of None and the optimized repaired query if a repair passes
+          the check, otherwise of the input errors and query.
+        """
+        self._count("queries")
+        schema = repair_schema(schema_dict)
+        original = errors, sql_query
+        for _ in range(self.max_rounds):
+            progress = False
+            for rule in self.rules:
+                try:
+                    candidate = rule(sql_query, errors, schema)
+                except (sqlglot.errors.SqlglotError, KeyError, ValueError):
+                    continue
+                if not candidate or candidate == sql_query:
+                    continue
+                self._count(f"{rule.__name__}.applied")
+                new_errors, new_sql = check(candidate)
+                if new_errors is None:
+                    self._count(f"{rule.__name__}.fixed")
+                    self._count("repaired")
+                    return None, new_sql
+                if new_errors != errors:
+                    self._count(f"{rule.__name__}.progress")
+                    sql_query, errors, progress = candidate, new_errors, True
+            if not progress:
+                break
+        return original
+
+    def hit_rates(self) -> dict[str, dict[str, float]]:
+        """Returns, per rule, its applications, fixes and fix rate."""
+        with self._lock:
+            stats = dict(self.stats)
+        rates = {}
+        for rule in self.rules:
+            applied = stats.get(f"{rule.__name__}.applied", 0)
+            fixed = stats.get(f"{rule.__name__}.fixed", 0)
+            rates[rule.__name__] = {
+                "applied": applied,
+                "fixed": fixed,
+                "hit_rate": fixed / applied if applied else 0.0,
+            }
+        return rates
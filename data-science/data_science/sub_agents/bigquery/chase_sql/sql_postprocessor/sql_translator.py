@@ -14,17 +14,28 @@
 
 """Translator from SQLite to BigQuery."""
 
+import collections
+import concurrent.futures
+import dataclasses
+import hashlib
+import multiprocessing
+import multiprocessing.context
+import os
 import re
-from typing import Any, Final
+import threading
+import time
+from typing import Any, Callable, Final, Hashable
 
 import regex
 import sqlglot
 import sqlglot.optimizer
+import sqlglot.schema
 
 from ..llm_utils import GeminiModel  # pylint: disable=g-importing-member
 from .correction_prompt_template import (
     CORRECTION_PROMPT_TEMPLATE_V1_0,
 )  # pylint: disable=g-importing-member
+from .sql_repair import SqlRepairEngine  # pylint: disable=g-importing-member
 
 
 ColumnSchemaType = tuple[str, str]
@@ -36,6 +47,13 @@ SQLGlotColumnsDictType = dict[str, str]
 SQLGlotSchemaType = dict[str, Any]
 
 BirdSampleType = dict[str, Any]
+# The `bq_schema_and_samples` dict of the database settings: table contexts
+# with a `table_schema` list, keyed by `project.dataset.table`.
+BqSchemaAndSamplesType = dict[str, dict[str, Any]]
+
+# Bounds of the memoized schemas and parse/optimize results.
+SCHEMA_CACHE_SIZE: Final[int] = 16
+QUERY_CACHE_SIZE: Final[int] = 1024
 
 
 def _isinstance_list_of_str_tuples_lists(obj: Any) -> bool:
@@ -82,11 +100,66 @@ def _isinstance_sqlglot_schema_type(obj: Any) -> bool:
     # pylint: enable=g-complex-comprehension
 
 
+def _isinstance_bq_schema_and_samples_type(obj: Any) -> bool:
+    """Checks if the object is a `bq_schema_and_samples` dict."""
+    return (
+        isinstance(obj, dict)
+        and bool(obj)
+        and all(
+            [
+                isinstance(v, dict) and isinstance(v.get("table_schema"), list)
+                for v in obj.values()
+            ]
+        )
+    )
+
+
 def _isinstance_bird_sample_type(obj: Any) -> bool:
     """Checks if the object is a SQLGlot schema type."""
     return isinstance(obj, dict) and not _isinstance_sqlglot_schema_type(obj)
 
 
+class _LruCache:
+    """A thread-safe LRU cache of computed values."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.stats = collections.Counter()
+        self._entries: collections.OrderedDict[Hashable, Any] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Returns the value of `key`, computing and storing it on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._entries[key]
+            self.stats["misses"] += 1
+        # Computed outside the lock; concurrent misses may compute twice.
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.stats.clear()
+
+
+def schema_fingerprint(schema: Any) -> str | None:
+    """Fingerprints a schema in any of the supported formats."""
+    if not schema:
+        return None
+    return hashlib.sha1(repr(schema).encode("utf-8")).hexdigest()
+
+
 class SqlTranslator:
     """Translator from SQLite to BigQuery.
 
@@ -96,7 +169,8 @@ class SqlTranslator:
 
     The translation is done by the following steps:
     1. (Optional) If there are errors in the input SQL query, the input SQL query
-       is first modified by the LLM to address the errors.
+       is first repaired by local rules and, if errors remain, modified by the
+       LLM to address them.
     2. The input SQL query is then translated to a SQL query in the output SQL
        dialect by the tool.
     3. (Optional) If there are errors in the tool output SQL query, the tool
@@ -119,6 +193,12 @@ class SqlTranslator:
     INPUT_DIALECT: Final[str] = "sqlite"
     OUTPUT_DIALECT: Final[str] = "bigquery"
 
+    # Shared by all translators, which work on the same few schemas.
+    _schema_cache: Final[_LruCache] = _LruCache(SCHEMA_CACHE_SIZE)
+    _query_cache: Final[_LruCache] = _LruCache(QUERY_CACHE_SIZE)
+    # Rule-based repairs tried before the LLM; see `repair_stats`.
+    _repair_engine: Final[SqlRepairEngine] = SqlRepairEngine()
+
     def __init__(
         self,
         model: str | GeminiModel = "gemini-2.5-flash",
@@ -148,10 +228,13 @@ class SqlTranslator:
 
     @classmethod
     def _apply_heuristics(cls, sql_query: str) -> str:
-        """Applies heuristics to the SQL query."""
-        if "''" in sql_query:
-            sql_query = sql_query.replace("''", "\\'")
-        return sql_query
+        """Applies heuristics to the SQL query.
+
+        BigQuery escapes a quote inside a string as \\' rather than '', so a
+        quote doubled inside a word, e.g. 'O''Hare', is rewritten; empty
+        strings are kept.
+        """
+        return re.sub(r"(?<=\w)''(?=\w)", r"\\'", sql_query)
 
     @classmethod
     def _extract_schema_from_ddl_statement(cls, ddl_statement: str) -> TableSchemaType:
@@ -276,16 +359,53 @@ class SqlTranslator:
             schema_dict = {catalog: schema_dict}
         return schema_dict
 
+    @classmethod
+    def format_bq_schema_and_samples(
+        cls, bq_schema_and_samples: BqSchemaAndSamplesType
+    ) -> SQLGlotSchemaType:
+        """Formats the `bq_schema_and_samples` dict for use in SQLGlot."""
+        return cls.format_schema(
+            [
+                (table_name, table_context["table_schema"])
+                for table_name, table_context in bq_schema_and_samples.items()
+            ]
+        )
+
     @classmethod
     def rewrite_schema_for_sqlglot(
-        cls, schema: str | SQLGlotSchemaType | BirdSampleType
+        cls,
+        schema: str | SQLGlotSchemaType | BirdSampleType | BqSchemaAndSamplesType,
+        fingerprint: str | None = None,
+    ) -> SQLGlotSchemaType:
+        """Rewrites the schema for use in SQLGlot.
+
+        The result is memoized per schema fingerprint and must not be modified.
+
+        Args:
+          schema: The schema, in any of the supported formats.
+          fingerprint: A fingerprint that identifies the schema, e.g. the
+            `bq_schema_fingerprint` of the database settings. If not given, it
+            is computed from the schema.
+        """
+        if not schema:
+            return None
+        return cls._schema_cache.get_or_compute(
+            ("sqlglot_schema", fingerprint or schema_fingerprint(schema)),
+            lambda: cls._rewrite_schema_for_sqlglot(schema),
+        )
+
+    @classmethod
+    def _rewrite_schema_for_sqlglot(
+        cls,
+        schema: str | SQLGlotSchemaType | BirdSampleType | BqSchemaAndSamplesType,
     ) -> SQLGlotSchemaType:
-        """Rewrites the schema for use in SQLGlot."""
         schema_dict = None
         if schema:
             if isinstance(schema, str):
                 schema = cls.extract_schema_from_ddls(schema)
                 schema_dict = cls.format_schema(schema)
+            elif _isinstance_bq_schema_and_samples_type(schema):
+                schema_dict = cls.format_bq_schema_and_samples(schema)
             elif _isinstance_sqlglot_schema_type(schema):
                 schema_dict = schema
             elif _isinstance_bird_sample_type(schema):
@@ -296,6 +416,43 @@ class SqlTranslator:
                 raise TypeError(f"Unsupported schema type: {type(schema)}")
         return schema_dict
 
+    @classmethod
+    def mapping_schema(
+        cls,
+        schema_dict: SQLGlotSchemaType | None,
+        sql_dialect: str,
+        fingerprint: str | None = None,
+    ) -> sqlglot.schema.MappingSchema | None:
+        """Returns the SQLGlot `MappingSchema`, memoized per schema and dialect."""
+        if not schema_dict:
+            return None
+        return cls._schema_cache.get_or_compute(
+            (
+                "mapping_schema",
+                fingerprint or schema_fingerprint(schema_dict),
+                sql_dialect.lower(),
+            ),
+            lambda: sqlglot.schema.MappingSchema(
+                schema_dict, dialect=sql_dialect.lower()
+            ),
+        )
+
+    @classmethod
+    def prepare_schema(
+        cls, bq_schema_and_samples: BqSchemaAndSamplesType, fingerprint: str
+    ) -> None:
+        """Builds the SQLGlot schema and `MappingSchema` ahead of translations.
+
+        Translations that pass the same fingerprint reuse them instead of
+        converting or fingerprinting the schema again.
+
+        Args:
+          bq_schema_and_samples: The schema and samples of the database settings.
+          fingerprint: The `bq_schema_fingerprint` of the database settings.
+        """
+        schema_dict = cls.rewrite_schema_for_sqlglot(bq_schema_and_samples, fingerprint)
+        cls.mapping_schema(schema_dict, cls.OUTPUT_DIALECT, fingerprint)
+
     @classmethod
     def _check_for_errors(
         cls,
@@ -304,6 +461,7 @@ class SqlTranslator:
         db: str | None = None,
         catalog: str | None = None,
         schema_dict: SQLGlotSchemaType | None = None,
+        fingerprint: str | None = None,
     ) -> tuple[str | None, str]:
         """Checks for errors in the SQL query.
 
@@ -315,11 +473,40 @@ class SqlTranslator:
             term for the project ID. This field is optional.
           schema_dict: The DDL schema to use for the translation. The DDL format is
             in the SQLGlot format. This field is optional.
+          fingerprint: The fingerprint of the schema, if known.
 
         Returns:
           tuple of the errors in the SQL query, or None if there are no errors, and
           the SQL query after optimization.
         """
+        if schema_dict and fingerprint is None:
+            fingerprint = schema_fingerprint(schema_dict)
+        return cls._query_cache.get_or_compute(
+            (
+                sql_query,
+                sql_dialect.lower(),
+                db,
+                catalog,
+                fingerprint,
+            ),
+            lambda: cls._parse_and_optimize(
+                sql_query,
+                sql_dialect,
+                db,
+                catalog,
+                cls.mapping_schema(schema_dict, sql_dialect, fingerprint),
+            ),
+        )
+
+    @classmethod
+    def _parse_and_optimize(
+        cls,
+        sql_query: str,
+        sql_dialect: str,
+        db: str | None,
+        catalog: str | None,
+        schema: sqlglot.schema.MappingSchema | None,
+    ) -> tuple[str | None, str]:
         try:
             # First, try to parse the SQL query into a SQLGlot AST.
             sql_query_ast = sqlglot.parse_one(
@@ -329,13 +516,26 @@ class SqlTranslator:
             )
             # Then add the database and catalog information for each table to the AST.
             for table in sql_query_ast.find_all(sqlglot.exp.Table):
-                table.set("catalog", sqlglot.exp.Identifier(this=catalog, quoted=True))
-                table.set("db", sqlglot.exp.Identifier(this=db, quoted=True))
+                if catalog:
+                    table.set("catalog", sqlglot.exp.Identifier(this=catalog, quoted=True))
+                if db:
+                    table.set("db", sqlglot.exp.Identifier(this=db, quoted=True))
+            # BigQuery has no default dataset, so tables of a schema with
+            # datasets must name theirs.
+            if schema is not None and schema.depth() > 1:
+                cte_names = {
+                    cte.alias_or_name for cte in sql_query_ast.find_all(sqlglot.exp.CTE)
+                }
+                for table in sql_query_ast.find_all(sqlglot.exp.Table):
+                    if not table.db and table.name not in cte_names:
+                        raise sqlglot.errors.OptimizeError(
+                            f"Table '{table.name}' is not qualified with its dataset"
+                        )
             # Then, try to optimize the SQL query.
             sql_query_ast = sqlglot.optimizer.optimize(
                 sql_query_ast,
                 dialect=sql_dialect.lower(),
-                schema=schema_dict,
+                schema=schema,
                 db=db,
                 catalog=catalog,
                 error_level=sqlglot.ErrorLevel.IMMEDIATE,
@@ -345,6 +545,32 @@ class SqlTranslator:
             return str(e), sql_query
         return None, sql_query
 
+    @classmethod
+    def repair_stats(cls) -> dict[str, dict[str, float]]:
+        """Returns how often each repair rule was applied and fixed a query."""
+        return cls._repair_engine.hit_rates()
+
+    @classmethod
+    def _correction_prompt(
+        cls,
+        sql_query: str,
+        errors: str,
+        sql_dialect: str,
+        schema_dict: SQLGlotSchemaType | None,
+    ) -> str:
+        """Returns the prompt that asks the LLM to fix the errors."""
+        if schema_dict:
+            # If the schema is provided, then insert it into the prompt.
+            schema_insert = f"\nThe database schema is:\n{schema_dict}\n"
+        else:
+            schema_insert = "\n"
+        return CORRECTION_PROMPT_TEMPLATE_V1_0.format(
+            sql_dialect=sql_dialect.lower(),
+            errors=errors,
+            sql_query=sql_query,
+            schema_insert=schema_insert,
+        )
+
     def _fix_errors(
         self,
         sql_query: str,
@@ -352,8 +578,11 @@ class SqlTranslator:
         apply_heuristics: bool,
         db: str | None = None,
         catalog: str | None = None,
-        ddl_schema: str | SQLGlotSchemaType | BirdSampleType | None = None,
+        ddl_schema: (
+            str | SQLGlotSchemaType | BirdSampleType | BqSchemaAndSamplesType | None
+        ) = None,
         number_of_candidates: int = 1,
+        fingerprint: str | None = None,
     ) -> str:
         """Fixes errors in the SQL query.
 
@@ -365,9 +594,11 @@ class SqlTranslator:
           catalog: The catalog to use for the translation. `catalog` is the SQLGlot
             term for the project ID. This field is optional.
           ddl_schema: The DDL schema to use for the translation. The DDL format can
-            be the SQLGlot format, the DDL schema format, a Bird dataset example, or
-            a string containing multiple DDL statements. This field is optional.
+            be the SQLGlot format, the DDL schema format, a Bird dataset example,
+            a `bq_schema_and_samples` dict, or a string containing multiple DDL
+            statements. This field is optional.
           number_of_candidates: The number of candidates to generate, default is 1.
+          fingerprint: The fingerprint of `ddl_schema`, if known.
 
         Returns:
           str: The fixed SQL query.
@@ -376,28 +607,35 @@ class SqlTranslator:
             sql_query = self._apply_heuristics(sql_query)
         # Reformat the schema if provided. This will remove any comments and
         # `INSERT INTO` statements.
-        schema_dict = self.rewrite_schema_for_sqlglot(ddl_schema)
+        schema_dict = self.rewrite_schema_for_sqlglot(ddl_schema, fingerprint)
         errors_and_sql: tuple[str | None, str] = self._check_for_errors(
             sql_query=sql_query,
             sql_dialect=self.OUTPUT_DIALECT,
             db=db,
             catalog=catalog,
             schema_dict=schema_dict,
+            fingerprint=fingerprint,
         )
         errors, sql_query = errors_and_sql
+        if errors:
+            errors, sql_query = self._repair_engine.repair(
+                sql_query,
+                errors,
+                schema_dict,
+                lambda candidate: self._check_for_errors(
+                    candidate,
+                    self.OUTPUT_DIALECT,
+                    db,
+                    catalog,
+                    schema_dict,
+                    fingerprint,
+                ),
+            )
         responses = sql_query  # Default to the input SQL query after error check.
         if errors:
             print("Processing input errors")
-            if schema_dict:
-                # If the schema is provided, then insert it into the prompt.
-                schema_insert = f"\nThe database schema is:\n{schema_dict}\n"
-            else:
-                schema_insert = "\n"
-            prompt: str = CORRECTION_PROMPT_TEMPLATE_V1_0.format(
-                sql_dialect=sql_dialect.lower(),
-                errors=errors,
-                sql_query=sql_query,
-                schema_insert=schema_insert,
+            prompt: str = self._correction_prompt(
+                sql_query, errors, sql_dialect, schema_dict
             )
             requests: list[str] = [prompt for _ in range(number_of_candidates)]
             responses: list[str] = self._model.call_parallel(
@@ -420,7 +658,10 @@ class SqlTranslator:
         sql_query: str,
         db: str | None = None,
         catalog: str | None = None,
-        ddl_schema: str | SQLGlotSchemaType | BirdSampleType | None = None,
+        ddl_schema: (
+            str | SQLGlotSchemaType | BirdSampleType | BqSchemaAndSamplesType | None
+        ) = None,
+        fingerprint: str | None = None,
     ) -> str:
         """Translates the SQL query to the output SQL dialect.
 
@@ -430,7 +671,11 @@ class SqlTranslator:
           catalog: The catalog to use for the translation. `catalog` is the SQLGlot
             term for the project ID. This field is optional.
           ddl_schema: The DDL schema to use for the translation. The DDL format can
-            be the SQLGlot format or the DDL schema format. This field is optional.
+            be the SQLGlot format, the DDL schema format or a
+            `bq_schema_and_samples` dict. This field is optional.
+          fingerprint: The fingerprint of `ddl_schema`, e.g. the
+            `bq_schema_fingerprint` of the database settings. Translations with
+            a fingerprint reuse the schema prepared by `prepare_schema`.
 
         Returns:
           The translated SQL query.
@@ -444,6 +689,7 @@ class SqlTranslator:
                 sql_dialect=self.OUTPUT_DIALECT,
                 ddl_schema=ddl_schema,
                 apply_heuristics=True,
+                fingerprint=fingerprint,
             )
         print("****** sql_query after fix_errors:", sql_query)
         sql_query = sqlglot.transpile(
@@ -463,9 +709,327 @@ class SqlTranslator:
                 sql_dialect=self.OUTPUT_DIALECT,
                 ddl_schema=ddl_schema,
                 apply_heuristics=True,
+                fingerprint=fingerprint,
             )
 
-        sql_query = sql_query.strip().replace('"', "`")
-        sql_query = self._apply_heuristics(sql_query)
+        return _finalize(sql_query)
 
-        return sql_query
+    def translate_many(
+        self,
+        sql_queries: list[str],
+        db: str | None = None,
+        catalog: str | None = None,
+        ddl_schema: (
+            str | SQLGlotSchemaType | BirdSampleType | BqSchemaAndSamplesType | None
+        ) = None,
+        fingerprint: str | None = None,
+        max_workers: int | None = None,
+        mp_context: multiprocessing.context.BaseContext | None = None,
+    ) -> list["TranslationResult"]:
+        """Translates many SQL queries, correcting the failing ones in one batch.
+
+        The queries go through the input error stage of `translate`. The
+        SQLGlot checks, local repairs and transpilation are CPU bound, so they
+        run in a process pool. Only the queries with remaining errors are sent
+        to the LLM, all in one `call_parallel` round per stage: one for the
+        input errors and, if tool output errors are processed, one for the
+        errors of the transpiled queries, which includes the corrected ones.
+
+        Args:
+          sql_queries: The SQL queries to translate.
+          db: The database to use for the translation. This field is optional.
+          catalog: The catalog to use for the translation. This field is
+            optional.
+          ddl_schema: The DDL schema to use for the translation, in any of the
+            formats of `translate`. This field is optional.
+          fingerprint: The fingerprint of `ddl_schema`, if known.
+          max_workers: The number of worker processes; 1 runs the SQLGlot
+            stages in this process. Defaults to the number of CPUs, and never
+            exceeds the number of queries.
+          mp_context: The multiprocessing context of the pool. Defaults to
+            forkserver where available, otherwise spawn; forking a process
+            with running threads can deadlock the children.
+
+        Returns:
+          The results, in the order of the queries.
+        """
+        schema_dict = self.rewrite_schema_for_sqlglot(ddl_schema, fingerprint)
+        schema = self.mapping_schema(schema_dict, self.OUTPUT_DIALECT, fingerprint)
+        tasks = [
+            (
+                sql_query,
+                db,
+                catalog,
+                self._process_input_errors,
+                self._process_tool_output_errors,
+            )
+            for sql_query in sql_queries
+        ]
+        max_workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+        if max_workers <= 1:
+            results = [
+                _translate_locally(*task, schema=schema, schema_dict=schema_dict)
+                for task in tasks
+            ]
+        else:
+            if mp_context is None:
+                mp_context = multiprocessing.get_context(
+                    "forkserver"
+                    if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"
+                )
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=mp_context,
+                initializer=_init_worker,
+                initargs=(schema_dict,),
+            ) as executor:
+                results = list(
+                    executor.map(
+                        _translate_in_worker,
+                        tasks,
+                        chunksize=max(1, len(tasks) // (4 * max_workers)),
+                    )
+                )
+
+        check_sql = _check_function(db, catalog, schema)
+        failing = [result for result in results if result.errors]
+        if failing:
+            print(f"Correcting {len(failing)} of {len(results)} queries")
+            responses, elapsed = self._correct(
+                [(result.checked_sql, result.errors) for result in failing],
+                schema_dict,
+            )
+            for result, response in zip(failing, responses):
+                result.timings["correct"] = elapsed
+                if _is_failed_response(response):
+                    # Translate the query as is, like `translate` does.
+                    response = result.checked_sql
+                else:
+                    result.corrected = True
+                transpiled = _transpile_result(result, response)
+                if self._process_tool_output_errors:
+                    _check_output(result, transpiled, check_sql, schema_dict)
+
+        failing = [result for result in results if result.output_errors]
+        if failing:
+            print(f"Correcting the output of {len(failing)} of {len(results)} queries")
+            responses, elapsed = self._correct(
+                [(result.checked_output, result.output_errors) for result in failing],
+                schema_dict,
+            )
+            for result, response in zip(failing, responses):
+                result.timings["output_correct"] = elapsed
+                if _is_failed_response(response):
+                    response = result.checked_output
+                else:
+                    result.corrected = True
+                result.translated = _finalize(response)
+
+        for result in results:
+            self._repair_engine.merge(result.repair_stats)
+        return results
+
+    def _correct(
+        self,
+        queries: list[tuple[str, str]],
+        schema_dict: SQLGlotSchemaType | None,
+    ) -> tuple[list[str | None], float]:
+        """Asks the LLM to fix the errors of queries in one batch.
+
+        Args:
+          queries: The SQL queries and their errors.
+          schema_dict: The SQLGlot schema.
+
+        Returns:
+          tuple of the responses, in the order of the queries, and the seconds
+          the batch took.
+        """
+        start = time.perf_counter()
+        responses = self._model.call_parallel(
+            [
+                self._correction_prompt(
+                    sql_query, errors, self.OUTPUT_DIALECT, schema_dict
+                )
+                for sql_query, errors in queries
+            ],
+            parser_func=self._parse_response,
+        )
+        return responses, time.perf_counter() - start
+
+
+@dataclasses.dataclass
+class TranslationResult:
+    """The outcome of translating one query with `translate_many`.
+
+    Attributes:
+      sql_query: The input SQL query.
+      translated: The translated SQL query, or None if it could not be
+        transpiled.
+      errors: The SQLGlot errors of the input SQL query after the local
+        repairs, or None.
+      checked_sql: The SQL query after the heuristics, the SQLGlot check and
+        the local repairs.
+      output_errors: The SQLGlot errors of the transpiled query after the
+        local repairs, or None.
+      checked_output: The transpiled query after the heuristics, the SQLGlot
+        check and the local repairs.
+      repaired: True if the local repair rules fixed the query.
+      corrected: True if the LLM corrected the query.
+      error: The transpilation error, or None.
+      timings: The seconds spent per stage: "check", "repair", "correct" (the
+        whole batched LLM round), "transpile" and, for the transpiled query,
+        "output_check", "output_repair" and "output_correct".
+      repair_stats: The stats of the repair engine for this query.
+    """
+
+    sql_query: str
+    translated: str | None = None
+    errors: str | None = None
+    checked_sql: str | None = None
+    output_errors: str | None = None
+    checked_output: str | None = None
+    repaired: bool = False
+    corrected: bool = False
+    error: str | None = None
+    timings: dict[str, float] = dataclasses.field(default_factory=dict)
+    repair_stats: dict[str, int] = dataclasses.field(default_factory=dict)
+
+
+def _is_failed_response(response: str | None) -> bool:
+    """True if `call_parallel` returned no usable SQL for a prompt."""
+    return (
+        not response
+        or response in ("Timeout", "Unhandled Error")
+        or response.startswith("Error after retries")
+    )
+
+
+def _finalize(sql_query: str) -> str:
+    """Applies the final clean-up of `translate` to a translated query."""
+    sql_query = sql_query.strip().replace('"', "`")
+    return SqlTranslator._apply_heuristics(sql_query)  # pylint: disable=protected-access
+
+
+def _transpile_result(result: TranslationResult, sql_query: str) -> str | None:
+    """Transpiles the query into the output dialect, as `translate` does.
+
+    Returns:
+      The transpiled query before the final clean-up, or None on errors.
+    """
+    start = time.perf_counter()
+    transpiled = None
+    try:
+        transpiled = sqlglot.transpile(
+            sql=sql_query,
+            read=SqlTranslator.INPUT_DIALECT,
+            write=SqlTranslator.OUTPUT_DIALECT,
+            error_level=sqlglot.ErrorLevel.IMMEDIATE,
+        )[0]
+        result.translated = _finalize(transpiled)
+    except sqlglot.errors.SqlglotError as e:
+        result.error = str(e)
+    result.timings["transpile"] = time.perf_counter() - start
+    return transpiled
+
+
+def _check_function(
+    db: str | None,
+    catalog: str | None,
+    schema: sqlglot.schema.MappingSchema | None,
+) -> Callable[[str], tuple[str | None, str]]:
+    """Returns the SQLGlot check of `_fix_errors` for a prepared schema."""
+
+    def check_sql(candidate: str) -> tuple[str | None, str]:
+        return SqlTranslator._parse_and_optimize(  # pylint: disable=protected-access
+            candidate, SqlTranslator.OUTPUT_DIALECT, db, catalog, schema
+        )
+
+    return check_sql
+
+
+def _check_and_repair(
+    result: TranslationResult,
+    sql_query: str,
+    check_sql: Callable[[str], tuple[str | None, str]],
+    schema_dict: SQLGlotSchemaType | None,
+    stage: str,
+) -> tuple[str | None, str]:
+    """Runs the heuristics, the SQLGlot check and the local repairs of
+    `_fix_errors` on a query; returns its remaining errors and the query."""
+    start = time.perf_counter()
+    errors, sql_query = check_sql(
+        SqlTranslator._apply_heuristics(sql_query)  # pylint: disable=protected-access
+    )
+    result.timings[f"{stage}check"] = time.perf_counter() - start
+    if errors:
+        start = time.perf_counter()
+        # A fresh engine, so that the stats can be returned to the parent.
+        engine = SqlRepairEngine()
+        errors, sql_query = engine.repair(sql_query, errors, schema_dict, check_sql)
+        result.repaired = result.repaired or errors is None
+        result.repair_stats = dict(
+            collections.Counter(result.repair_stats) + engine.stats
+        )
+        result.timings[f"{stage}repair"] = time.perf_counter() - start
+    return errors, sql_query
+
+
+def _check_output(
+    result: TranslationResult,
+    transpiled: str | None,
+    check_sql: Callable[[str], tuple[str | None, str]],
+    schema_dict: SQLGlotSchemaType | None,
+) -> None:
+    """Runs the tool output stage of `translate` on a transpiled query."""
+    if transpiled is None:
+        return
+    result.output_errors, result.checked_output = _check_and_repair(
+        result, transpiled, check_sql, schema_dict, "output_"
+    )
+    if not result.output_errors:
+        result.translated = _finalize(result.checked_output)
+
+
+def _translate_locally(
+    sql_query: str,
+    db: str | None,
+    catalog: str | None,
+    check: bool,
+    check_output: bool,
+    schema: sqlglot.schema.MappingSchema | None,
+    schema_dict: SQLGlotSchemaType | None = None,
+) -> TranslationResult:
+    """Runs the local stages of a translation; errors are left to the LLM."""
+    result = TranslationResult(sql_query=sql_query, checked_sql=sql_query)
+    check_sql = _check_function(db, catalog, schema)
+    if check:
+        result.errors, result.checked_sql = _check_and_repair(
+            result, sql_query, check_sql, schema_dict, ""
+        )
+    if not result.errors:
+        transpiled = _transpile_result(result, result.checked_sql)
+        if check_output:
+            _check_output(result, transpiled, check_sql, schema_dict)
+    return result
+
+
+# The schema of a worker process of `translate_many`, built once per worker.
+_worker_schema: sqlglot.schema.MappingSchema | None = None
+_worker_schema_dict: SQLGlotSchemaType | None = None
+
+
+def _init_worker(schema_dict: SQLGlotSchemaType | None) -> None:
+    global _worker_schema, _worker_schema_dict
+    _worker_schema_dict = schema_dict
+    _worker_schema = (
+        sqlglot.schema.MappingSchema(schema_dict, dialect=SqlTranslator.OUTPUT_DIALECT)
+        if schema_dict
+        else None
+    )
+
+
+def _translate_in_worker(task: tuple[str, str | None, str | None, bool, bool]):
+    return _translate_locally(
+        *task, schema=_worker_schema, schema_dict=_worker_schema_dict
+    )
@@ -0,0 +1,230 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Dry-run validation of generated SQL before `execute_sql` runs it.
+
+Every query is dry run first, which validates it and returns the number of
+bytes it would process, without running it or billing for it. Invalid
+queries and queries above the byte budget are answered with an error that
+tells the agent how to revise the SQL, instead of being executed.
+
+`LocalDryRun` stands in for BigQuery in tests: it validates against a schema
+with sqlglot and estimates the bytes from table sizes.
+"""
+
+import collections
+import dataclasses
+import logging
+import threading
+from typing import Any, Protocol
+
+import sqlglot
+from google.adk.tools.bigquery.client import get_bigquery_client
+from google.cloud import bigquery
+from sqlglot import exp
+from sqlglot.optimizer.qualify import qualify
+
+from data_science.config import get_optional_env_var
+
+_GIB = 1024**3
+
+
+@dataclasses.dataclass
+class DryRunResult:
+    """The outcome of a dry run: the bytes it would process, or an error."""
+
+    total_bytes_processed: int | None = None
+    error: str | None = None
+
+
+class DryRunBackend(Protocol):
+    def dry_run(self, project_id: str, query: str) -> DryRunResult: ...
+
+
+class BigQueryDryRun:
+    """Dry runs queries on BigQuery."""
+
+    def __init__(self, client=None):
+        """Initializes the backend.
+
+        Args:
+            client (bigquery.Client, optional): Client to run the dry runs
+              with. Created on first use if omitted.
+        """
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_bigquery_client(
+                project=get_optional_env_var("BQ_COMPUTE_PROJECT_ID"),
+                credentials=None,
+            )
+        return self._client
+
+    def dry_run(self, project_id: str, query: str) -> DryRunResult:
+        try:
+            job = self.client.query(
+                query,
+                project=project_id,
+                job_config=bigquery.QueryJobConfig(
+                    dry_run=True, use_query_cache=False
+                ),
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return DryRunResult(error=getattr(e, "message", None) or str(e))
+        return DryRunResult(total_bytes_processed=job.total_bytes_processed or 0)
+
+
+class LocalDryRun:
+    """Dry runs queries against a schema and table sizes with sqlglot.
+
+    A query is valid if sqlglot can resolve all of its columns. Like
+    BigQuery's on-demand pricing, it processes the share of each table's
+    bytes that its columns make up, assuming columns of equal size.
+    """
+
+    def __init__(
+        self,
+        schema: dict[str, dict[str, str]],
+        table_bytes: dict[str, int],
+    ):
+        """Initializes the backend.
+
+        Args:
+            schema (dict): Columns and their types per `project.dataset.table`
+              ID.
+            table_bytes (dict): The size in bytes per table ID.
+        """
+        self.schema = {}
+        for table_id, columns in schema.items():
+            project, dataset, table = table_id.split(".")
+            self.schema.setdefault(project, {}).setdefault(dataset, {})[table] = columns
+        self.table_columns = {
+            table_id.lower(): {c.lower() for c in columns}
+            for table_id, columns in schema.items()
+        }
+        self.table_bytes = {t.lower(): b for t, b in table_bytes.items()}
+
+    def dry_run(self, project_id: str, query: str) -> DryRunResult:
+        try:
+            expression = qualify(
+                sqlglot.parse_one(query, read="bigquery"),
+                schema=self.schema,
+                catalog=project_id,
+                dialect="bigquery",
+            )
+        except sqlglot.errors.SqlglotError as e:
+            return DryRunResult(error=str(e))
+
+        cte_names = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+        used_columns = collections.defaultdict(set)
+        aliases = {}
+        for table in expression.find_all(exp.Table):
+            if not table.db and table.name in cte_names:
+                continue
+            table_id = ".".join(p for p in (table.catalog, table.db, table.name) if p)
+            if table_id.lower() not in self.table_columns:
+                return DryRunResult(error=f"Not found: Table {table_id}")
+            aliases[table.alias_or_name.lower()] = table_id.lower()
+            used_columns.setdefault(table_id.lower(), set())
+        for column in expression.find_all(exp.Column):
+            table_id = aliases.get(column.table.lower())
+            if table_id is not None:
+                used_columns[table_id].add(column.name.lower())
+
+        total_bytes = 0
+        for table_id, columns in used_columns.items():
+            all_columns = self.table_columns[table_id]
+            share = len(columns & all_columns) / len(all_columns) if all_columns else 1
+            total_bytes += int(self.table_bytes.get(table_id, 0) * share)
+        return DryRunResult(total_bytes_processed=total_bytes)
+
+
+class QueryValidator:
+    """Rejects invalid queries and queries above a byte budget."""
+
+    def __init__(self, backend: DryRunBackend, max_bytes_processed: int = 0):
+        """Initializes the validator.
+
+        Args:
+            backend (DryRunBackend): Where the dry runs are made.
+            max_bytes_processed (int): The byte budget of a query; 0 disables
+              the budget, but queries are still validated.
+        """
+        self.backend = backend
+        self.max_bytes_processed = max_bytes_processed
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += value
+
+    def validate(self, project_id: str, query: str) -> dict[str, Any] | None:
+        """Dry runs a query.
+
+        Returns:
+            dict: An `execute_sql` error response that explains how to revise
+            the query, or None if the query may run.
+        """
+        self._count("queries")
+        result = self.backend.dry_run(project_id, query)
+        if result.error is not None:
+            self._count("invalid")
+            return {
+                "status": "ERROR",
+                "error_details": (
+                    f"The dry run of the query failed: {result.error}. "
+                    "Fix the SQL and try again."
+                ),
+            }
+        self._count("bytes_processed", result.total_bytes_processed)
+        if 0 < self.max_bytes_processed < result.total_bytes_processed:
+            self._count("over_budget")
+            logging.warning(
+                "Rejected a query that would process %d bytes", result.total_bytes_processed
+            )
+            return {
+                "status": "ERROR",
+                "error_details": (
+                    "The query would process "
+                    f"{result.total_bytes_processed / _GIB:.2f} GiB, more than "
+                    f"the budget of {self.max_bytes_processed / _GIB:.2f} GiB. "
+                    "Rewrite the SQL to read less data: select only the "
+                    "columns you need, filter on partitioning or clustering "
+                    "columns, or aggregate before joining."
+                ),
+            }
+        return None
+
+
+_query_validator: QueryValidator | None = None
+_query_validator_lock = threading.Lock()
+
+
+def get_query_validator() -> QueryValidator | None:
+    """Returns the validator configured through environment variables."""
+    global _query_validator
+    if get_optional_env_var("BQ_DRY_RUN_VALIDATION", "true").lower() != "true":
+        return None
+    with _query_validator_lock:
+        if _query_validator is None:
+            _query_validator = QueryValidator(
+                BigQueryDryRun(),
+                max_bytes_processed=int(
+                    get_optional_env_var("BQ_MAX_BYTES_PROCESSED", str(100 * _GIB))
+                ),
+            )
+        return _query_validator
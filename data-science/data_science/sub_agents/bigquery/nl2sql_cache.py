@@ -0,0 +1,504 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache for the SQL generated by the NL2SQL tools.
+
+Entries are keyed by the normalized question within a namespace made of the
+schema fingerprint, the model and the NL2SQL method, so a schema change or a
+different generation setup never serves stale SQL. Optionally, a question that
+misses the exact key is embedded and matched against the cached questions of
+the same namespace by cosine similarity.
+
+Backends:
+  memory: An in-process LRU with a TTL (default).
+  sqlite:PATH: A SQLite file, shared by the processes on one host.
+  redis://...: A Redis-compatible server, shared by all replicas. Requires the
+    `redis` package.
+"""
+
+import abc
+import asyncio
+import collections
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Callable
+
+import numpy as np
+import sqlglot
+from google.adk.tools import ToolContext
+from sqlglot import exp
+
+from data_science.config import get_optional_env_var
+
+from .schema_index import schema_fingerprint
+
+DEFAULT_NL2SQL_CACHE_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_NL2SQL_CACHE_MAX_ENTRIES = 1024
+DEFAULT_EMBEDDING_MODEL = "text-embedding-005"
+
+Embedder = Callable[[str], list[float]]
+
+# What the NL2SQL tools return instead of SQL when generation fails.
+_FAILURE_PREFIXES = ("Error", "Timeout", "Unhandled Error")
+
+
+def normalize_question(question: str) -> str:
+    """Normalizes case, whitespace and trailing punctuation of a question."""
+    question = unicodedata.normalize("NFKC", question).lower()
+    question = re.sub(r"\s+", " ", question)
+    return question.strip(" \t\n?!.;")
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def is_cacheable_sql(sql: str | None) -> bool:
+    """True if `sql` is a single query rather than a failure message."""
+    if not sql or sql.lstrip().startswith(_FAILURE_PREFIXES):
+        return False
+    try:
+        statements = sqlglot.parse(sql, read="bigquery")
+    except sqlglot.errors.SqlglotError:
+        return False
+    statements = [s for s in statements if s is not None]
+    return len(statements) == 1 and isinstance(statements[0], exp.Query)
+
+
+class Nl2SqlCacheBackend(abc.ABC):
+    """Storage for NL2SQL cache entries, with TTL and size-based eviction."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> dict[str, Any] | None:
+        """Returns the live entry stored under `key`, or None."""
+
+    @abc.abstractmethod
+    def put(self, namespace: str, key: str, entry: dict[str, Any]) -> None:
+        """Stores `entry` under `key` in `namespace`."""
+
+    @abc.abstractmethod
+    def entries(self, namespace: str) -> list[dict[str, Any]]:
+        """Returns the live entries of `namespace`."""
+
+
+class InMemoryNl2SqlCacheBackend(Nl2SqlCacheBackend):
+    """LRU cache in process memory."""
+
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_NL2SQL_CACHE_TTL_SECONDS,
+        max_entries: int = DEFAULT_NL2SQL_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # key -> (namespace, expires_at, entry), least recently used first.
+        self._entries: collections.OrderedDict[
+            str, tuple[str, float, dict[str, Any]]
+        ] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[2]
+
+    def put(self, namespace: str, key: str, entry: dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (namespace, time.time() + self.ttl_seconds, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def entries(self, namespace: str) -> list[dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            return [
+                entry
+                for entry_namespace, expires_at, entry in self._entries.values()
+                if entry_namespace == namespace and expires_at > now
+            ]
+
+
+class SqliteNl2SqlCacheBackend(Nl2SqlCacheBackend):
+    """LRU cache in a SQLite file."""
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: float = DEFAULT_NL2SQL_CACHE_TTL_SECONDS,
+        max_entries: int = DEFAULT_NL2SQL_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS nl2sql_cache ("
+                " key TEXT PRIMARY KEY, namespace TEXT NOT NULL, entry TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS nl2sql_cache_namespace"
+                " ON nl2sql_cache (namespace)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        now = time.time()
+        with self._lock, self._connect() as connection:
+            row = connection.execute(
+                "SELECT entry FROM nl2sql_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE nl2sql_cache SET last_used = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(row[0])
+
+    def put(self, namespace: str, key: str, entry: dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO nl2sql_cache VALUES (?, ?, ?, ?, ?)",
+                (key, namespace, json.dumps(entry), now + self.ttl_seconds, now),
+            )
+            connection.execute(
+                "DELETE FROM nl2sql_cache WHERE expires_at <= ?", (now,)
+            )
+            connection.execute(
+                "DELETE FROM nl2sql_cache WHERE key IN (SELECT key FROM nl2sql_cache"
+                " ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def entries(self, namespace: str) -> list[dict[str, Any]]:
+        with self._lock, self._connect() as connection:
+            rows = connection.execute(
+                "SELECT entry FROM nl2sql_cache WHERE namespace = ? AND expires_at > ?",
+                (namespace, time.time()),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class RedisNl2SqlCacheBackend(Nl2SqlCacheBackend):
+    """Cache on a Redis-compatible server.
+
+    Entries expire through Redis TTLs. Size-based eviction is left to the
+    server's `maxmemory-policy` (e.g. `allkeys-lru`).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        ttl_seconds: float = DEFAULT_NL2SQL_CACHE_TTL_SECONDS,
+        key_prefix: str = "nl2sql:",
+    ):
+        # pylint: disable=g-import-not-at-top
+        import redis
+        # pylint: enable=g-import-not-at-top
+
+        self._client = redis.Redis.from_url(url)
+        self.ttl_seconds = int(ttl_seconds)
+        self.key_prefix = key_prefix
+
+    def _namespace_key(self, namespace: str) -> str:
+        return f"{self.key_prefix}ns:{namespace}"
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        value = self._client.get(self.key_prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def put(self, namespace: str, key: str, entry: dict[str, Any]) -> None:
+        pipeline = self._client.pipeline()
+        pipeline.set(self.key_prefix + key, json.dumps(entry), ex=self.ttl_seconds)
+        pipeline.sadd(self._namespace_key(namespace), key)
+        pipeline.expire(self._namespace_key(namespace), self.ttl_seconds)
+        pipeline.execute()
+
+    def entries(self, namespace: str) -> list[dict[str, Any]]:
+        keys = [k.decode() for k in self._client.smembers(self._namespace_key(namespace))]
+        if not keys:
+            return []
+        values = self._client.mget([self.key_prefix + k for k in keys])
+        expired = [k for k, v in zip(keys, values) if v is None]
+        if expired:
+            self._client.srem(self._namespace_key(namespace), *expired)
+        return [json.loads(v) for v in values if v is not None]
+
+
+class Nl2SqlCache:
+    """Exact and, optionally, similarity-based lookup of generated SQL."""
+
+    def __init__(
+        self,
+        backend: Nl2SqlCacheBackend,
+        similarity_threshold: float = 0,
+        embed: Embedder | None = None,
+    ):
+        """Initializes the cache.
+
+        Args:
+            backend (Nl2SqlCacheBackend): Where entries are stored.
+            similarity_threshold (float): Minimum cosine similarity for a
+              cached question to answer a different question. 0 disables the
+              similarity lookup.
+            embed (callable, optional): Returns the embedding of a question.
+              Required for the similarity lookup.
+        """
+        self.backend = backend
+        self.similarity_threshold = similarity_threshold
+        self._embed = functools.lru_cache(maxsize=256)(embed) if embed else None
+        self.stats = collections.Counter()
+
+    @staticmethod
+    def namespace(schema_version: str, model: str, method: str) -> str:
+        return _digest(schema_version, model, method)
+
+    @staticmethod
+    def _key(namespace: str, question: str) -> str:
+        return f"{namespace}:{_digest(question)}"
+
+    def _embedding(self, question: str) -> list[float] | None:
+        if self._embed is None or self.similarity_threshold <= 0:
+            return None
+        return list(self._embed(question))
+
+    def lookup(self, namespace: str, question: str) -> str | None:
+        """Returns the cached SQL for a question, or None on a miss."""
+        question = normalize_question(question)
+        entry = self.backend.get(self._key(namespace, question))
+        if entry is not None:
+            self.stats["hits"] += 1
+            return entry["sql"]
+
+        embedding = self._embedding(question)
+        if embedding is not None:
+            candidates = [
+                e for e in self.backend.entries(namespace) if e.get("embedding")
+            ]
+            if candidates:
+                matrix = np.array([e["embedding"] for e in candidates], dtype=np.float32)
+                query = np.array(embedding, dtype=np.float32)
+                similarities = matrix @ query / (
+                    np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12
+                )
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self.stats["similar_hits"] += 1
+                    logging.info(
+                        "NL2SQL cache: %r answered by %r (similarity %.3f)",
+                        question,
+                        candidates[best]["question"],
+                        similarities[best],
+                    )
+                    return candidates[best]["sql"]
+        self.stats["misses"] += 1
+        return None
+
+    def store(self, namespace: str, question: str, sql: str) -> None:
+        """Caches the SQL generated for a question."""
+        question = normalize_question(question)
+        self.backend.put(
+            namespace,
+            self._key(namespace, question),
+            {
+                "question": question,
+                "sql": sql,
+                "embedding": self._embedding(question),
+                "created_at": time.time(),
+            },
+        )
+
+
+def _vertex_embedder(model: str) -> Embedder:
+    """Returns an embedder that calls a Vertex AI text embedding model."""
+    # pylint: disable=g-import-not-at-top
+    from google.genai import Client
+    # pylint: enable=g-import-not-at-top
+
+    client = Client(
+        vertexai=True,
+        project=os.getenv("GOOGLE_CLOUD_PROJECT"),
+        location=os.getenv("GOOGLE_CLOUD_LOCATION"),
+    )
+
+    def embed(text: str) -> list[float]:
+        response = client.models.embed_content(model=model, contents=text)
+        return response.embeddings[0].values
+
+    return embed
+
+
+def get_nl2sql_cache_backend(
+    location: str | None = None,
+    ttl_seconds: float | None = None,
+    max_entries: int | None = None,
+    key_prefix: str = "nl2sql:",
+) -> Nl2SqlCacheBackend | None:
+    """Returns the backend for a cache location.
+
+    The backends store arbitrary JSON entries, so other caches (e.g. the
+    query-result cache) reuse them with their own settings.
+
+    Args:
+        location: `memory`, `sqlite:PATH`, a `redis://` or `rediss://` URL, or
+          `none` to disable the cache. Defaults to the `NL2SQL_CACHE_BACKEND`
+          environment variable, or `memory`.
+        ttl_seconds: Lifetime of an entry. Defaults to the
+          `NL2SQL_CACHE_TTL_SECONDS` environment variable, or one day.
+        max_entries: Maximum number of entries. Defaults to the
+          `NL2SQL_CACHE_MAX_ENTRIES` environment variable, or 1024.
+        key_prefix: Prefix of the Redis keys.
+
+    Returns:
+        Nl2SqlCacheBackend: The backend, or None if the cache is disabled.
+    """
+    if location is None:
+        location = get_optional_env_var("NL2SQL_CACHE_BACKEND", "memory")
+    if ttl_seconds is None:
+        ttl_seconds = float(
+            get_optional_env_var(
+                "NL2SQL_CACHE_TTL_SECONDS", str(DEFAULT_NL2SQL_CACHE_TTL_SECONDS)
+            )
+        )
+    if max_entries is None:
+        max_entries = int(
+            get_optional_env_var(
+                "NL2SQL_CACHE_MAX_ENTRIES", str(DEFAULT_NL2SQL_CACHE_MAX_ENTRIES)
+            )
+        )
+    if location in ("", "none"):
+        return None
+    if location == "memory":
+        return InMemoryNl2SqlCacheBackend(ttl_seconds, max_entries)
+    if location.startswith("sqlite:"):
+        return SqliteNl2SqlCacheBackend(
+            os.path.expanduser(location.removeprefix("sqlite:")),
+            ttl_seconds,
+            max_entries,
+        )
+    if location.startswith(("redis://", "rediss://")):
+        return RedisNl2SqlCacheBackend(location, ttl_seconds, key_prefix)
+    raise ValueError(f"Unsupported NL2SQL cache backend: {location}")
+
+
+_nl2sql_cache: Nl2SqlCache | None = None
+_nl2sql_cache_lock = threading.Lock()
+
+
+def get_nl2sql_cache() -> Nl2SqlCache | None:
+    """Returns the NL2SQL cache configured through environment variables."""
+    global _nl2sql_cache
+    with _nl2sql_cache_lock:
+        if _nl2sql_cache is None:
+            backend = get_nl2sql_cache_backend()
+            if backend is None:
+                return None
+            threshold = float(
+                get_optional_env_var("NL2SQL_CACHE_SIMILARITY_THRESHOLD", "0")
+            )
+            embed = None
+            if threshold > 0:
+                embed = _vertex_embedder(
+                    get_optional_env_var(
+                        "NL2SQL_CACHE_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL
+                    )
+                )
+            _nl2sql_cache = Nl2SqlCache(backend, threshold, embed)
+        return _nl2sql_cache
+
+
+def cache_nl2sql(method: str, model: Callable[[ToolContext], str]):
+    """Decorates an NL2SQL tool so that repeated questions skip generation.
+
+    On a hit, the cached SQL is stored in `tool_context.state["sql_query"]`
+    and returned without calling the tool. Only results that are a single
+    SELECT query are cached, so failed generations are retried.
+
+    Args:
+        method (str): The NL2SQL method of the tool, e.g. `baseline`.
+        model (callable): Returns a string identifying the model and generation
+          settings for a tool context.
+
+    Returns:
+        callable: The decorator.
+    """
+
+    def namespace(cache: Nl2SqlCache, tool_context: ToolContext) -> str:
+        settings = tool_context.state["database_settings"]
+        schema_version = settings.get("bq_schema_fingerprint") or schema_fingerprint(
+            settings["bq_schema_and_samples"]
+        )
+        return cache.namespace(schema_version, model(tool_context), method)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(question: str, tool_context: ToolContext) -> str:
+                cache = get_nl2sql_cache()
+                if cache is None:
+                    return await func(question, tool_context)
+                cache_namespace = namespace(cache, tool_context)
+                sql = await asyncio.to_thread(cache.lookup, cache_namespace, question)
+                if sql is not None:
+                    tool_context.state["sql_query"] = sql
+                    return sql
+                sql = await func(question, tool_context)
+                if is_cacheable_sql(sql):
+                    await asyncio.to_thread(cache.store, cache_namespace, question, sql)
+                return sql
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(question: str, tool_context: ToolContext) -> str:
+            cache = get_nl2sql_cache()
+            if cache is None:
+                return func(question, tool_context)
+            cache_namespace = namespace(cache, tool_context)
+            sql = cache.lookup(cache_namespace, question)
+            if sql is not None:
+                tool_context.state["sql_query"] = sql
+                return sql
+            sql = func(question, tool_context)
+            if is_cacheable_sql(sql):
+                cache.store(cache_namespace, question, sql)
+            return sql
+
+        return wrapper
+
+    return decorator
@@ -38,7 +38,8 @@ def return_instructions_bigquery() -> str:
 
       Use the provided tools to help generate the most accurate SQL:
       1. First, use {db_tool_name} tool to generate initial SQL from the question.
-      2. Then you should use the execute_sql tool to validate and execute the SQL. If there are any errors with the SQL, you should go back to step 1 and recreate the SQL by addressing the error.
+      2. Then you should use the execute_sql tool to validate and execute the SQL. If there are any errors with the SQL, you should go back to step 1 and recreate the SQL by addressing the error. This includes queries rejected by the dry run because they would process more bytes than the budget: follow the advice in the error to make the query read less data.
+      3. If the user needs more rows than you need to read (e.g. for charts, models or further analysis), use the export_query_result tool with the validated SQL instead, without the LIMIT that only keeps the rows shown to you small. It stores the full result for the analytics agent and only returns its summary; report that summary in "sql_results".
       4. Generate the final result in JSON format with four keys: "explain", "sql", "sql_results", "nl_results".
           "explain": "write out step-by-step reasoning to explain how you are generating the query based on the schema, example, and question.",
           "sql": "Output your generated SQL!",
@@ -50,7 +51,7 @@ def return_instructions_bigquery() -> str:
       NOTE: you should ALWAYS USE THE TOOL {db_tool_name} to generate SQL, not make up SQL WITHOUT CALLING TOOLS.
       Keep in mind that you are an orchestration agent, not a SQL expert, so use the tools to help you generate SQL, but do not make up SQL.
 
-      NOTE: you must ALWAYS PASS the project_id {get_env_var("BQ_COMPUTE_PROJECT_ID")} to the execute_sql tool. DO NOT pass any other project id.
+      NOTE: you must ALWAYS PASS the project_id {get_env_var("BQ_COMPUTE_PROJECT_ID")} to the execute_sql and export_query_result tools. DO NOT pass any other project id.
 
     """
 
@@ -0,0 +1,251 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache for the results of the ADK `execute_sql` tool.
+
+Results are keyed by the SQL canonicalized with sqlglot, so formatting,
+comments and keyword case do not matter, and by the project the query runs
+in. Every entry records the `modified` time of the tables the query reads;
+an entry is only served while none of these tables changed. A view does not
+change when its base tables do, so views are resolved to the tables they
+read. Queries that are not plain reads of resolvable tables, or that call
+non-deterministic functions, directly or through a view, are never cached.
+
+The cache is process-wide and therefore shared across sessions; with the
+SQLite or Redis backend it is also shared across processes.
+"""
+
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import logging
+import threading
+import time
+from typing import Any
+
+import sqlglot
+from google.adk.tools.bigquery.client import get_bigquery_client
+from sqlglot import exp
+
+from data_science.config import get_optional_env_var
+
+from .nl2sql_cache import Nl2SqlCacheBackend, get_nl2sql_cache_backend
+
+_NON_DETERMINISTIC_FUNCTIONS = (
+    exp.CurrentDate,
+    exp.CurrentDatetime,
+    exp.CurrentTime,
+    exp.CurrentTimestamp,
+    exp.CurrentUser,
+    exp.Rand,
+    exp.Uuid,
+)
+_NON_DETERMINISTIC_FUNCTION_NAMES = frozenset({"SESSION_USER", "GENERATE_UUID"})
+_VIEW_TYPES = frozenset({"VIEW", "MATERIALIZED_VIEW"})
+# Views of views are resolved up to this depth.
+_MAX_VIEW_DEPTH = 8
+# Lookups whose tool response never arrived are forgotten beyond this number.
+_MAX_PENDING = 1024
+# Concurrent table metadata requests per lookup.
+_MAX_TABLE_REQUESTS = 8
+
+
+def canonicalize_sql(
+    sql: str, default_project: str
+) -> tuple[str, list[str]] | None:
+    """Canonicalizes a read-only query and resolves the tables it reads.
+
+    Args:
+        sql (str): The BigQuery SQL.
+        default_project (str): The project that unqualified datasets resolve to.
+
+    Returns:
+        tuple: The canonical SQL and the sorted `project.dataset.table` IDs it
+        reads, or None if the query must not be cached.
+    """
+    try:
+        expressions = sqlglot.parse(sql, read="bigquery")
+    except sqlglot.errors.ParseError:
+        return None
+    if len(expressions) != 1 or not isinstance(expressions[0], exp.Query):
+        return None
+    expression = expressions[0]
+
+    for function in expression.find_all(exp.Func):
+        if isinstance(function, _NON_DETERMINISTIC_FUNCTIONS):
+            return None
+        if (
+            isinstance(function, exp.Anonymous)
+            and function.name.upper() in _NON_DETERMINISTIC_FUNCTION_NAMES
+        ):
+            return None
+
+    cte_names = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+    tables = set()
+    for table in expression.find_all(exp.Table):
+        if not table.db:
+            if table.name in cte_names:
+                continue
+            # A bare table name cannot be resolved to a version.
+            return None
+        tables.add(f"{table.catalog or default_project}.{table.db}.{table.name}")
+    return expression.sql(dialect="bigquery", comments=False), sorted(tables)
+
+
+def _timestamp(value: datetime.datetime | None) -> str | None:
+    return value.isoformat() if value is not None else None
+
+
+class QueryResultCache:
+    """Caches `execute_sql` responses until a referenced table changes."""
+
+    def __init__(self, backend: Nl2SqlCacheBackend, client=None):
+        """Initializes the cache.
+
+        Args:
+            backend (Nl2SqlCacheBackend): Where the responses are stored.
+            client (bigquery.Client, optional): Client used to look up the
+              `modified` time of tables. Created on first use if omitted.
+        """
+        self.backend = backend
+        self._client = client
+        # Versions seen by `lookup`, kept until the tool response arrives,
+        # oldest first. Calls that fail before their response are evicted.
+        self._pending: collections.OrderedDict[
+            str, tuple[str, dict[str, str | None]]
+        ] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=_MAX_TABLE_REQUESTS,
+            thread_name_prefix="result_cache",
+        )
+        self.stats = collections.Counter()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_bigquery_client(
+                project=get_optional_env_var("BQ_COMPUTE_PROJECT_ID"),
+                credentials=None,
+            )
+        return self._client
+
+    def _table_versions(self, tables: list[str]) -> dict[str, str | None] | None:
+        """Returns the `modified` time of the tables and of the base tables
+        of views, or None if a view cannot be resolved.
+
+        The tables of each level of views are looked up concurrently, so a
+        query costs one metadata round trip per level rather than per table.
+        """
+        versions = {}
+        level = set(tables)
+        for depth in range(_MAX_VIEW_DEPTH + 1):
+            if not level:
+                break
+            base_tables = set()
+            for table_id, table in zip(
+                level, self._executor.map(self.client.get_table, level)
+            ):
+                versions[table_id] = _timestamp(table.modified)
+                if table.table_type not in _VIEW_TYPES:
+                    continue
+                view_query = table.view_query or table.mview_query
+                if (
+                    depth >= _MAX_VIEW_DEPTH
+                    or table.view_use_legacy_sql
+                    or not view_query
+                ):
+                    return None
+                canonical = canonicalize_sql(view_query, table_id.split(".")[0])
+                if canonical is None:
+                    return None
+                base_tables.update(canonical[1])
+            level = base_tables - versions.keys()
+        return dict(sorted(versions.items()))
+
+    def lookup(
+        self, call_id: str, project_id: str, query: str
+    ) -> dict[str, Any] | None:
+        """Returns the cached response of a query, or None on a miss.
+
+        On a miss, the current table versions are remembered under `call_id`
+        until `store` is called with the response of the same call. Looking
+        up the versions calls BigQuery; run it in a worker thread from async
+        code.
+        """
+        canonical = canonicalize_sql(query, project_id)
+        if canonical is None:
+            self.stats["uncacheable"] += 1
+            return None
+        sql, tables = canonical
+        key = "result:" + hashlib.sha1(f"{project_id}\n{sql}".encode("utf-8")).hexdigest()
+        try:
+            versions = self._table_versions(tables)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.warning("Not caching query, table lookup failed: %s", e)
+            self.stats["uncacheable"] += 1
+            return None
+        if versions is None:
+            self.stats["uncacheable"] += 1
+            return None
+
+        entry = self.backend.get(key)
+        if entry is not None and entry["table_versions"] == versions:
+            self.stats["hits"] += 1
+            return entry["response"]
+        self.stats["misses"] += 1
+        with self._lock:
+            self._pending[call_id] = (key, versions)
+            while len(self._pending) > _MAX_PENDING:
+                self._pending.popitem(last=False)
+        return None
+
+    def store(self, call_id: str, response: dict[str, Any]) -> None:
+        """Caches a successful response of a call that missed the cache."""
+        with self._lock:
+            pending = self._pending.pop(call_id, None)
+        if pending is None or response.get("status") != "SUCCESS":
+            return
+        key, versions = pending
+        self.backend.put(
+            "results",
+            key,
+            {"response": response, "table_versions": versions, "created_at": time.time()},
+        )
+
+
+_query_result_cache: QueryResultCache | None = None
+_query_result_cache_lock = threading.Lock()
+
+
+def get_query_result_cache() -> QueryResultCache | None:
+    """Returns the result cache configured through environment variables."""
+    global _query_result_cache
+    with _query_result_cache_lock:
+        if _query_result_cache is None:
+            backend = get_nl2sql_cache_backend(
+                get_optional_env_var("BQ_RESULT_CACHE_BACKEND", "memory"),
+                ttl_seconds=float(
+                    get_optional_env_var("BQ_RESULT_CACHE_TTL_SECONDS", "3600")
+                ),
+                max_entries=int(
+                    get_optional_env_var("BQ_RESULT_CACHE_MAX_ENTRIES", "256")
+                ),
+                key_prefix="bq_result:",
+            )
+            if backend is None:
+                return None
+            _query_result_cache = QueryResultCache(backend)
+        return _query_result_cache
@@ -0,0 +1,169 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Export of full query results for analysis, beyond the `execute_sql` cap.
+
+`execute_sql` returns at most `MAX_NUM_ROWS` rows, which the agent reads.
+`export_query_result` instead streams the whole result in Arrow record
+batches into the session's Parquet artifact, up to a memory ceiling, and only
+returns its summary: the analytics sandbox reads the full data from the
+artifact.
+
+Batches are read through the BigQuery Storage Read API when
+`google-cloud-bigquery-storage` (the `bqstorage` extra) is installed, and
+page by page through the much slower REST API otherwise.
+"""
+
+import asyncio
+import functools
+import logging
+from typing import Any, Iterator
+
+import pyarrow as pa
+import sqlglot
+from google.adk.tools import ToolContext
+from google.adk.tools.bigquery.client import get_bigquery_client
+from google.cloud import bigquery
+from sqlglot import exp
+
+from data_science.config import get_optional_env_var
+from data_science.utils.result_artifacts import (
+    format_summary,
+    save_parquet_result,
+    write_parquet,
+)
+
+try:
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
+
+_MIB = 1024**2
+
+# The Arrow size of the rows of an export stays below this; larger results are
+# truncated.
+RESULT_MEMORY_LIMIT_BYTES = int(
+    get_optional_env_var("BQ_RESULT_MEMORY_LIMIT_BYTES", str(256 * _MIB))
+)
+# Rows per page when the result is read through the REST API.
+RESULT_PAGE_SIZE = int(get_optional_env_var("BQ_RESULT_PAGE_SIZE", "50000"))
+
+
+def _read_only_error(query: str) -> str | None:
+    """Returns why the query may not be exported, or None if it may."""
+    try:
+        statements = sqlglot.parse(query, read="bigquery")
+    except sqlglot.errors.SqlglotError as e:
+        return f"The query could not be parsed: {e}"
+    statements = [s for s in statements if s is not None]
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        return "Only a single SELECT statement can be exported."
+    return None
+
+
+@functools.cache
+def _log_rest_fallback() -> None:
+    logging.warning(
+        "google-cloud-bigquery-storage is not installed; reading query "
+        "results through the REST API. Install the bqstorage extra for the "
+        "Storage Read API."
+    )
+
+
+def _record_batches(
+    client: bigquery.Client, project_id: str, query: str
+) -> Iterator[pa.RecordBatch]:
+    """Runs the query and yields its result in Arrow record batches."""
+    job = client.query(query, project=project_id)
+    rows = job.result(page_size=RESULT_PAGE_SIZE)
+    if bigquery_storage is None:
+        _log_rest_fallback()
+        yield from rows.to_arrow_iterable()
+        return
+    # Uses the application default credentials, like `get_bigquery_client`.
+    with bigquery_storage.BigQueryReadClient() as bqstorage_client:
+        yield from rows.to_arrow_iterable(bqstorage_client=bqstorage_client)
+
+
+def export_to_parquet(
+    client: bigquery.Client,
+    project_id: str,
+    query: str,
+    memory_limit: int = RESULT_MEMORY_LIMIT_BYTES,
+) -> tuple[bytes, dict[str, Any]]:
+    """Streams the result of a query into Parquet.
+
+    Reading stops at the memory ceiling, which cancels the remaining
+    download.
+
+    Returns:
+        tuple: The Parquet data and its summary (see `write_parquet`).
+    """
+    batches = _record_batches(client, project_id, query)
+    try:
+        return write_parquet(batches, memory_limit)
+    finally:
+        batches.close()
+
+
+async def export_query_result(
+    project_id: str, query: str, tool_context: ToolContext
+) -> dict[str, Any]:
+    """Runs a SELECT query and stores its full result for the analytics agent.
+
+    Use this instead of execute_sql when the result has more rows than you
+    need to read, e.g. rows for a chart, a model or further analysis. The
+    rows are not returned; you get the row count, the column statistics and
+    the first rows.
+
+    Args:
+        project_id (str): The GCP project that runs the query.
+        query (str): The SELECT query.
+        tool_context (ToolContext): The tool context.
+
+    Returns:
+        dict: The status, the summary of the result and whether it was
+        truncated at the memory ceiling.
+    """
+    error = _read_only_error(query)
+    if error is not None:
+        return {"status": "ERROR", "error_details": error}
+
+    client = get_bigquery_client(project=project_id, credentials=None)
+    try:
+        data, summary = await asyncio.to_thread(
+            export_to_parquet, client, project_id, query
+        )
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return {"status": "ERROR", "error_details": getattr(e, "message", None) or str(e)}
+    if summary["truncated"]:
+        logging.warning(
+            "Truncated a query result at %d rows (%d bytes)",
+            summary["num_rows"],
+            RESULT_MEMORY_LIMIT_BYTES,
+        )
+
+    summary = await save_parquet_result(tool_context, data, summary)
+    response = {
+        "status": "SUCCESS",
+        "num_rows": summary["num_rows"],
+        "truncated": summary["truncated"],
+        "summary": format_summary(summary),
+    }
+    if summary["truncated"]:
+        response["note"] = (
+            "The result was cut at the memory ceiling; aggregate or filter in "
+            "SQL to export all of it."
+        )
+    return response
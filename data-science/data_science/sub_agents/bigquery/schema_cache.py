@@ -0,0 +1,310 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent, versioned cache for BigQuery schema and sample values.
+
+The cache stores one snapshot per dataset. Each table entry is tagged with the
+table `etag` and `modified` time reported by BigQuery, so a process only has
+to re-fetch the tables that changed since the snapshot was written. Snapshots
+are written through a small byte-level backend, so replicas can share a
+snapshot on local disk, on a mounted volume or in Cloud Storage.
+"""
+
+import abc
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Iterable
+
+from data_science.config import get_optional_env_var
+
+# Bump this whenever the layout of a table entry changes. Snapshots written
+# with a different version are ignored and rebuilt from BigQuery.
+SCHEMA_CACHE_VERSION = 2
+
+DEFAULT_SCHEMA_CACHE_DIR = os.path.join(
+    tempfile.gettempdir(), "data_science_schema_cache"
+)
+
+
+class SchemaCacheBackend(abc.ABC):
+    """Byte-level storage used by the schema cache."""
+
+    @abc.abstractmethod
+    def read(self, name: str) -> bytes | None:
+        """Returns the stored bytes for `name`, or None if missing."""
+
+    @abc.abstractmethod
+    def write(self, name: str, data: bytes) -> None:
+        """Stores `data` under `name`, replacing any previous value."""
+
+
+class InMemorySchemaCacheBackend(SchemaCacheBackend):
+    """Backend that keeps snapshots in process memory only."""
+
+    def __init__(self):
+        self._blobs: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def read(self, name: str) -> bytes | None:
+        with self._lock:
+            return self._blobs.get(name)
+
+    def write(self, name: str, data: bytes) -> None:
+        with self._lock:
+            self._blobs[name] = data
+
+
+class FileSchemaCacheBackend(SchemaCacheBackend):
+    """Backend that stores snapshots as files in a local directory."""
+
+    def __init__(self, directory: str = DEFAULT_SCHEMA_CACHE_DIR):
+        self.directory = directory
+
+    def read(self, name: str) -> bytes | None:
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, name: str, data: bytes) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see
+        # a partially written snapshot.
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+
+class GcsSchemaCacheBackend(SchemaCacheBackend):
+    """Backend that stores snapshots in a Cloud Storage bucket."""
+
+    def __init__(self, uri: str):
+        # pylint: disable=g-import-not-at-top
+        from google.cloud import storage
+        # pylint: enable=g-import-not-at-top
+
+        bucket_name, _, prefix = uri.removeprefix("gs://").partition("/")
+        self._bucket = storage.Client().bucket(bucket_name)
+        self._prefix = prefix.strip("/")
+
+    def _blob(self, name: str):
+        path = f"{self._prefix}/{name}" if self._prefix else name
+        return self._bucket.blob(path)
+
+    def read(self, name: str) -> bytes | None:
+        # pylint: disable=g-import-not-at-top
+        from google.api_core import exceptions
+        # pylint: enable=g-import-not-at-top
+
+        try:
+            return self._blob(name).download_as_bytes()
+        except exceptions.NotFound:
+            return None
+
+    def write(self, name: str, data: bytes) -> None:
+        self._blob(name).upload_from_string(data)
+
+
+def _timestamp(value: datetime.datetime | str | None) -> str | None:
+    """Normalizes a BigQuery `modified` value for comparison and storage."""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+class SchemaSnapshot:
+    """Schema and sample values of one dataset, with per-table versions."""
+
+    def __init__(
+        self,
+        dataset: str,
+        tables: dict[str, dict[str, Any]] | None = None,
+        created_at: float | None = None,
+    ):
+        self.dataset = dataset
+        self.tables: dict[str, dict[str, Any]] = tables or {}
+        self.created_at = created_at if created_at is not None else time.time()
+        self.changed = False
+
+    def is_fresh(self, max_age_seconds: float) -> bool:
+        """True if the snapshot was validated less than the max age ago."""
+        return (
+            bool(self.tables)
+            and max_age_seconds > 0
+            and time.time() - self.created_at < max_age_seconds
+        )
+
+    def get_table(
+        self,
+        table: str,
+        etag: str | None,
+        modified: datetime.datetime | str | None,
+    ) -> dict[str, Any] | None:
+        """Returns the cached table entry if its version still matches."""
+        entry = self.tables.get(table)
+        if entry is None:
+            return None
+        if entry.get("etag") != etag or entry.get("modified") != _timestamp(modified):
+            return None
+        return entry["context"]
+
+    def put_table(
+        self,
+        table: str,
+        etag: str | None,
+        modified: datetime.datetime | str | None,
+        context: dict[str, Any],
+    ) -> None:
+        """Stores the schema and samples of a table together with its version."""
+        self.tables[table] = {
+            "etag": etag,
+            "modified": _timestamp(modified),
+            "context": context,
+        }
+        self.changed = True
+
+    def retain(self, tables: Iterable[str]) -> None:
+        """Drops entries of tables that no longer exist in the dataset."""
+        keep = set(tables)
+        for table in list(self.tables):
+            if table not in keep:
+                del self.tables[table]
+                self.changed = True
+
+    def tables_context(self) -> dict[str, dict[str, Any]]:
+        """Returns the snapshot in the `bq_schema_and_samples` format."""
+        return {table: entry["context"] for table, entry in self.tables.items()}
+
+    def to_bytes(self) -> bytes:
+        return json.dumps(
+            {
+                "version": SCHEMA_CACHE_VERSION,
+                "dataset": self.dataset,
+                "created_at": self.created_at,
+                "tables": self.tables,
+            },
+            default=str,
+        ).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, dataset: str, data: bytes | None) -> "SchemaSnapshot":
+        """Loads a snapshot, or returns an empty one if it is unusable."""
+        if not data:
+            return cls(dataset)
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            return cls(dataset)
+        if (
+            payload.get("version") != SCHEMA_CACHE_VERSION
+            or payload.get("dataset") != dataset
+        ):
+            return cls(dataset)
+        tables = payload.get("tables", {})
+        for entry in tables.values():
+            # JSON turns the (column name, column type) tuples into lists.
+            context = entry["context"]
+            context["table_schema"] = [tuple(c) for c in context["table_schema"]]
+        return cls(dataset, tables=tables, created_at=payload.get("created_at"))
+
+
+class SchemaCache:
+    """Versioned schema-and-samples cache on top of a pluggable backend."""
+
+    def __init__(self, backend: SchemaCacheBackend, max_age_seconds: float = 0):
+        self.backend = backend
+        self.max_age_seconds = max_age_seconds
+
+    @staticmethod
+    def snapshot_name(dataset: str) -> str:
+        return f"{dataset}.schema.json"
+
+    def load(self, dataset: str) -> SchemaSnapshot:
+        """Loads the snapshot of `dataset`, or an empty snapshot."""
+        return SchemaSnapshot.from_bytes(
+            dataset, self.backend.read(self.snapshot_name(dataset))
+        )
+
+    def save(self, snapshot: SchemaSnapshot, validated: bool = False) -> None:
+        """Persists the snapshot if any table changed since it was loaded.
+
+        Args:
+            snapshot (SchemaSnapshot): The snapshot.
+            validated (bool): True if every table of the snapshot was just
+              checked against BigQuery. With a max age, this restarts the
+              period in which the snapshot is used without revalidation, even
+              if no table changed.
+        """
+        if validated and self.max_age_seconds > 0:
+            snapshot.created_at = time.time()
+            snapshot.changed = True
+        if not snapshot.changed:
+            return
+        self.backend.write(self.snapshot_name(snapshot.dataset), snapshot.to_bytes())
+        snapshot.changed = False
+
+
+_backends: dict[str, SchemaCacheBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_schema_cache_backend(location: str | None = None) -> SchemaCacheBackend:
+    """Returns the backend for a cache location.
+
+    Backends are shared per location, so that the `memory` backend keeps its
+    snapshots across calls.
+
+    Args:
+        location: A local directory, a `gs://bucket/prefix` URI, or `memory`.
+          Defaults to the `BQ_SCHEMA_CACHE_DIR` environment variable.
+
+    Returns:
+        SchemaCacheBackend: The backend for the location.
+    """
+    if location is None:
+        location = get_optional_env_var(
+            "BQ_SCHEMA_CACHE_DIR", DEFAULT_SCHEMA_CACHE_DIR
+        )
+    with _backends_lock:
+        if location not in _backends:
+            if location == "memory":
+                _backends[location] = InMemorySchemaCacheBackend()
+            elif location.startswith("gs://"):
+                _backends[location] = GcsSchemaCacheBackend(location)
+            else:
+                _backends[location] = FileSchemaCacheBackend(
+                    os.path.expanduser(location)
+                )
+        return _backends[location]
+
+
+def get_schema_cache() -> SchemaCache:
+    """Returns the schema cache configured through environment variables."""
+    return SchemaCache(
+        get_schema_cache_backend(),
+        max_age_seconds=float(
+            get_optional_env_var("BQ_SCHEMA_CACHE_MAX_AGE_SECONDS", "0")
+        ),
+    )
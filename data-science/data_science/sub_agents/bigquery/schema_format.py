@@ -0,0 +1,150 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Serializers for putting the BigQuery schema into prompts.
+
+Supported formats:
+  dict: The Python repr of the `bq_schema_and_samples` dict (legacy).
+  ddl: One `CREATE TABLE` statement per table, with the sample values of each
+    column in a trailing comment.
+  tsv: Per table, a header with the column names and types followed by the
+    sample rows as tab-separated values.
+
+Newlines, carriage returns and tabs in sample values are written as escape
+sequences, so that every sample row, and every column of a `CREATE TABLE`
+statement, stays on one line.
+"""
+
+import logging
+import re
+from typing import Any
+
+from data_science.config import get_optional_env_var
+
+SCHEMA_FORMATS = ("dict", "ddl", "tsv")
+DEFAULT_SCHEMA_FORMAT = get_optional_env_var("SCHEMA_PROMPT_FORMAT", "ddl")
+
+# Approximates a subword tokenizer: short letter runs, short digit runs and
+# single punctuation characters each count as one token.
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]{1,6}|\d{1,3}|[^\sA-Za-z\d]")
+# The escapes of BigQuery string literals, which the sample values are.
+_SAMPLE_ESCAPES = str.maketrans({"\n": "\\n", "\r": "\\r", "\t": "\\t"})
+
+
+def count_tokens(text: str) -> int:
+    """Estimates the number of prompt tokens of a text without a remote call."""
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def _unique(values: list[str]) -> list[str]:
+    return list(dict.fromkeys(values))
+
+
+def _escape(value: Any) -> str:
+    return str(value).translate(_SAMPLE_ESCAPES)
+
+
+def _table_to_ddl(table_name: str, table_context: dict[str, Any]) -> str:
+    example_values = table_context.get("example_values", {})
+    lines = [f"CREATE TABLE `{table_name}` ("]
+    for column_name, column_type in table_context["table_schema"]:
+        line = f"  `{column_name}` {column_type},"
+        samples = _unique(example_values.get(column_name, []))
+        if samples:
+            line += f" -- e.g. {', '.join(_escape(v) for v in samples)}"
+        lines.append(line)
+    lines.append(")")
+    partitioning = table_context.get("partitioning")
+    if partitioning:
+        lines.append(f"PARTITION BY `{partitioning['field']}`")
+    if table_context.get("clustering"):
+        lines.append(
+            "CLUSTER BY " + ", ".join(f"`{c}`" for c in table_context["clustering"])
+        )
+    lines[-1] += ";"
+    return "\n".join(lines)
+
+
+def _table_to_tsv(table_name: str, table_context: dict[str, Any]) -> str:
+    example_values = table_context.get("example_values", {})
+    columns = [column_name for column_name, _ in table_context["table_schema"]]
+    lines = [
+        f"# {table_name}",
+        "\t".join(columns),
+        "\t".join(column_type for _, column_type in table_context["table_schema"]),
+    ]
+    num_rows = max((len(example_values.get(c, [])) for c in columns), default=0)
+    for row in range(num_rows):
+        lines.append(
+            "\t".join(
+                _escape(v[row]) if row < len(v) else ""
+                for v in (example_values.get(c, []) for c in columns)
+            )
+        )
+    return "\n".join(lines)
+
+
+def serialize_table(
+    table_name: str, table_context: dict[str, Any], schema_format: str | None = None
+) -> str:
+    """Serializes the schema and samples of one table."""
+    schema_format = schema_format or DEFAULT_SCHEMA_FORMAT
+    if schema_format == "ddl":
+        return _table_to_ddl(table_name, table_context)
+    if schema_format == "tsv":
+        return _table_to_tsv(table_name, table_context)
+    if schema_format == "dict":
+        return str({table_name: table_context})
+    raise ValueError(f"Unsupported schema format: {schema_format}")
+
+
+def serialize_schema(
+    schema_and_samples: dict[str, dict[str, Any]],
+    schema_format: str | None = None,
+) -> str:
+    """Serializes the `bq_schema_and_samples` dict for a prompt.
+
+    Args:
+        schema_and_samples (dict): The schema and samples to serialize.
+        schema_format (str, optional): One of `SCHEMA_FORMATS`. Defaults to the
+          `SCHEMA_PROMPT_FORMAT` environment variable, or `ddl`.
+
+    Returns:
+        str: The serialized schema.
+    """
+    schema_format = schema_format or DEFAULT_SCHEMA_FORMAT
+    if schema_format == "dict":
+        text = str(schema_and_samples)
+    else:
+        text = "\n\n".join(
+            serialize_table(table_name, table_context, schema_format)
+            for table_name, table_context in schema_and_samples.items()
+        )
+    logging.info(
+        "Serialized %d tables as %s: ~%d tokens",
+        len(schema_and_samples),
+        schema_format,
+        count_tokens(text),
+    )
+    return text
+
+
+def schema_token_report(
+    schema_and_samples: dict[str, dict[str, Any]],
+) -> dict[str, int]:
+    """Returns the estimated token count of the schema in every format."""
+    return {
+        schema_format: count_tokens(serialize_schema(schema_and_samples, schema_format))
+        for schema_format in SCHEMA_FORMATS
+    }
@@ -0,0 +1,357 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local BM25 index over the columns of the BigQuery schema.
+
+Every column is a document made of its name, its type and its sample values.
+Postings are kept in flat NumPy arrays, so a question is scored against all
+columns in a few vectorized operations and schema linking needs no remote
+calls. The index is persisted next to the schema cache snapshot and updated
+per table: only tables whose schema or samples changed are re-indexed.
+"""
+
+import collections
+import hashlib
+import io
+import json
+import re
+import threading
+from typing import Any
+
+import numpy as np
+
+from .schema_cache import SchemaCacheBackend, get_schema_cache_backend
+
+# Bump this whenever the persisted layout or the tokenizer changes.
+SCHEMA_INDEX_VERSION = 1
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by do does for from had has have how i in is it me "
+    "my of on or show that the their there these this those to was were what "
+    "when where which who why with list give find get all each per many much "
+    "number total table tables".split()
+)
+
+# Column names are repeated so that they weigh more than sample values.
+_COLUMN_NAME_WEIGHT = 2
+
+
+def _normalize_term(term: str) -> str:
+    """Lowercases a term and strips a plural suffix."""
+    term = term.lower()
+    if len(term) > 4 and term.endswith("ies"):
+        return term[:-3] + "y"
+    if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+        return term[:-1]
+    return term
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits identifiers and natural language into normalized terms.
+
+    Splits on non-alphanumeric characters and on camelCase boundaries, so that
+    `YrSold`, `yr_sold` and "yr sold" produce the same terms.
+    """
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", str(text))
+    terms = [_normalize_term(t) for t in re.split(r"[^A-Za-z0-9]+", text) if t]
+    return [t for t in terms if t not in _STOPWORDS]
+
+
+def table_version(table_context: dict[str, Any]) -> str:
+    """Returns a fingerprint of the schema and samples of a table."""
+    return hashlib.sha1(
+        json.dumps(table_context, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def schema_fingerprint(schema_and_samples: dict[str, dict[str, Any]]) -> str:
+    """Returns a fingerprint of the schema and samples of all tables."""
+    return hashlib.sha1(
+        json.dumps(
+            sorted(
+                (table, table_version(context))
+                for table, context in schema_and_samples.items()
+            )
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def _column_documents(table_context: dict[str, Any]):
+    """Yields (column name, column type, term counts) for each column."""
+    example_values = table_context.get("example_values", {})
+    for column_name, column_type in table_context["table_schema"]:
+        terms = tokenize(column_name) * _COLUMN_NAME_WEIGHT + tokenize(column_type)
+        for value in example_values.get(column_name, []):
+            terms.extend(tokenize(value))
+        yield column_name, column_type, collections.Counter(terms)
+
+
+class SchemaIndex:
+    """BM25 index with one document per (table, column)."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.terms: list[str] = []
+        self.vocabulary: dict[str, int] = {}
+        # (table, column name, column type) of every document.
+        self.columns: list[tuple[str, str, str]] = []
+        self.table_versions: dict[str, str] = {}
+        # Term counts in coordinate format: one entry per (document, term).
+        self._doc_ids = np.zeros(0, dtype=np.int32)
+        self._term_ids = np.zeros(0, dtype=np.int32)
+        self._counts = np.zeros(0, dtype=np.float32)
+        self._build_postings()
+
+    @property
+    def tables(self) -> set[str]:
+        return set(self.table_versions)
+
+    def _build_postings(self) -> None:
+        """Sorts the term counts by term and precomputes the BM25 statistics."""
+        num_docs, num_terms = len(self.columns), len(self.terms)
+        order = np.argsort(self._term_ids, kind="stable")
+        self._postings_docs = self._doc_ids[order]
+        self._postings_counts = self._counts[order]
+        self._indptr = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self._term_ids, minlength=num_terms), out=self._indptr[1:]
+        )
+        self._doc_lengths = np.bincount(
+            self._doc_ids, weights=self._counts, minlength=num_docs
+        ).astype(np.float32)
+        self._average_doc_length = (
+            float(self._doc_lengths.mean()) if num_docs else 1.0
+        ) or 1.0
+        doc_freqs = np.diff(self._indptr).astype(np.float32)
+        self._idf = np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+    def update(self, schema_and_samples: dict[str, dict[str, Any]]) -> bool:
+        """Re-indexes the tables that were added, changed or removed.
+
+        Args:
+            schema_and_samples (dict): The `bq_schema_and_samples` dict.
+
+        Returns:
+            bool: True if the index changed.
+        """
+        versions = {
+            table: table_version(context)
+            for table, context in schema_and_samples.items()
+        }
+        stale = {
+            table
+            for table, version in self.table_versions.items()
+            if versions.get(table) != version
+        }
+        added = [
+            table
+            for table, version in versions.items()
+            if self.table_versions.get(table) != version
+        ]
+        if not stale and not added:
+            return False
+
+        # Drop the documents of stale tables and renumber the remaining ones.
+        keep = np.array(
+            [table not in stale for table, _, _ in self.columns], dtype=bool
+        )
+        new_doc_ids = np.cumsum(keep, dtype=np.int32) - 1
+        entry_mask = keep[self._doc_ids]
+        doc_ids = [new_doc_ids[self._doc_ids[entry_mask]]]
+        term_ids = [self._term_ids[entry_mask]]
+        counts = [self._counts[entry_mask]]
+        columns = [column for column, k in zip(self.columns, keep) if k]
+
+        for table in added:
+            for column_name, column_type, term_counts in _column_documents(
+                schema_and_samples[table]
+            ):
+                doc_id = len(columns)
+                columns.append((table, column_name, column_type))
+                for term in term_counts:
+                    if term not in self.vocabulary:
+                        self.vocabulary[term] = len(self.terms)
+                        self.terms.append(term)
+                doc_ids.append(np.full(len(term_counts), doc_id, dtype=np.int32))
+                term_ids.append(
+                    np.fromiter(
+                        (self.vocabulary[t] for t in term_counts),
+                        dtype=np.int32,
+                        count=len(term_counts),
+                    )
+                )
+                counts.append(
+                    np.fromiter(
+                        term_counts.values(), dtype=np.float32, count=len(term_counts)
+                    )
+                )
+
+        self.columns = columns
+        self._doc_ids = np.concatenate(doc_ids)
+        self._term_ids = np.concatenate(term_ids)
+        self._counts = np.concatenate(counts)
+        self.table_versions = versions
+        self._build_postings()
+        return True
+
+    def score(self, question: str) -> np.ndarray:
+        """Returns the BM25 score of every column for a question."""
+        scores = np.zeros(len(self.columns), dtype=np.float32)
+        for term in set(tokenize(question)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self._indptr[term_id], self._indptr[term_id + 1]
+            docs = self._postings_docs[start:end]
+            counts = self._postings_counts[start:end]
+            norm = self.K1 * (
+                1 - self.B + self.B * self._doc_lengths[docs] / self._average_doc_length
+            )
+            # A document appears at most once in the postings of a term.
+            scores[docs] += self._idf[term_id] * counts * (self.K1 + 1) / (counts + norm)
+        return scores
+
+    def top_k_columns(
+        self, question: str, k: int = 20
+    ) -> list[tuple[str, str, float]]:
+        """Returns the k best matching (table, column, score) for a question."""
+        scores = self.score(question)
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [
+            (self.columns[i][0], self.columns[i][1], float(scores[i]))
+            for i in candidates
+            if scores[i] > 0
+        ]
+
+    def column_scores(self, question: str) -> dict[str, dict[str, float]]:
+        """Returns the non-zero column scores of a question, grouped by table."""
+        scores = self.score(question)
+        grouped: dict[str, dict[str, float]] = collections.defaultdict(dict)
+        for i in np.flatnonzero(scores):
+            table, column, _ = self.columns[i]
+            grouped[table][column] = float(scores[i])
+        return grouped
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        tables = list(self.table_versions)
+        versions = [self.table_versions[table] for table in tables]
+        np.savez_compressed(
+            buffer,
+            version=np.array(SCHEMA_INDEX_VERSION),
+            terms=np.array(self.terms, dtype=str),
+            column_tables=np.array([c[0] for c in self.columns], dtype=str),
+            column_names=np.array([c[1] for c in self.columns], dtype=str),
+            column_types=np.array([c[2] for c in self.columns], dtype=str),
+            version_tables=np.array(tables, dtype=str),
+            version_values=np.array(versions, dtype=str),
+            doc_ids=self._doc_ids,
+            term_ids=self._term_ids,
+            counts=self._counts,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes | None) -> "SchemaIndex":
+        """Loads an index, or returns an empty one if it is unusable."""
+        index = cls()
+        if not data:
+            return index
+        try:
+            arrays = np.load(io.BytesIO(data), allow_pickle=False)
+            if int(arrays["version"]) != SCHEMA_INDEX_VERSION:
+                return index
+            index.terms = arrays["terms"].tolist()
+            index.vocabulary = {term: i for i, term in enumerate(index.terms)}
+            index.columns = list(
+                zip(
+                    arrays["column_tables"].tolist(),
+                    arrays["column_names"].tolist(),
+                    arrays["column_types"].tolist(),
+                )
+            )
+            index.table_versions = dict(
+                zip(
+                    arrays["version_tables"].tolist(),
+                    arrays["version_values"].tolist(),
+                )
+            )
+            index._doc_ids = arrays["doc_ids"]
+            index._term_ids = arrays["term_ids"]
+            index._counts = arrays["counts"]
+        except (OSError, ValueError, KeyError):
+            return cls()
+        index._build_postings()
+        return index
+
+
+_schema_index: SchemaIndex | None = None
+_schema_index_lock = threading.Lock()
+
+
+def load_schema_index(
+    dataset: str,
+    schema_and_samples: dict[str, dict[str, Any]],
+    backend: SchemaCacheBackend | None = None,
+) -> SchemaIndex:
+    """Loads the persisted index of a dataset and brings it up to date.
+
+    Only tables whose schema or samples changed since the index was persisted
+    are re-indexed. The updated index is persisted and used by schema linking.
+
+    Args:
+        dataset (str): The `project.dataset` the schema belongs to.
+        schema_and_samples (dict): The `bq_schema_and_samples` dict.
+        backend (SchemaCacheBackend, optional): Where the index is persisted.
+          Defaults to the backend of the schema cache.
+
+    Returns:
+        SchemaIndex: The up-to-date index.
+    """
+    global _schema_index
+    if backend is None:
+        backend = get_schema_cache_backend()
+    name = f"{dataset}.index.npz"
+    index = SchemaIndex.from_bytes(backend.read(name))
+    if index.update(schema_and_samples):
+        backend.write(name, index.to_bytes())
+    with _schema_index_lock:
+        _schema_index = index
+    return index
+
+
+def get_schema_index(schema_and_samples: dict[str, dict[str, Any]]) -> SchemaIndex:
+    """Returns the current index, building it in memory if it does not match.
+
+    Args:
+        schema_and_samples (dict): The `bq_schema_and_samples` dict the index
+          should cover.
+
+    Returns:
+        SchemaIndex: An index over the tables of `schema_and_samples`.
+    """
+    global _schema_index
+    with _schema_index_lock:
+        index = _schema_index
+        if index is None or index.tables != set(schema_and_samples):
+            index = SchemaIndex()
+            index.update(schema_and_samples)
+            _schema_index = index
+        return index
@@ -0,0 +1,141 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Question-aware schema linking for the NL2SQL prompts.
+
+Given the `bq_schema_and_samples` dict and a question, keeps the tables and
+columns that are relevant to the question so that the schema put into a prompt
+stays within a token budget. Scoring is purely local: columns are ranked with
+the BM25 schema index and tables by their column scores and name matches.
+"""
+
+import re
+from typing import Any
+
+from data_science.config import get_optional_env_var
+
+from .schema_format import count_tokens, serialize_table
+from .schema_index import SchemaIndex, get_schema_index, tokenize
+
+# Approximate number of prompt tokens the schema may use. Schemas that fit are
+# passed through unchanged. Set to 0 to disable pruning.
+SCHEMA_TOKEN_BUDGET = int(get_optional_env_var("SCHEMA_PROMPT_TOKEN_BUDGET", "8000"))
+
+# Columns that are likely join keys are kept whenever their table is kept.
+_KEY_COLUMN_PATTERN = re.compile(
+    r"(^(id|ID|Id|key)$|_(id|ID|key|KEY)$|[a-z](Id|ID|Key)$)"
+)
+
+TableContextType = dict[str, Any]
+SchemaAndSamplesType = dict[str, TableContextType]
+
+
+def _table_tokens(
+    table_name: str, table_context: TableContextType, schema_format: str | None
+) -> int:
+    """Estimates the prompt tokens of a table in the given schema format."""
+    return count_tokens(serialize_table(table_name, table_context, schema_format))
+
+
+def _prune_columns(
+    table_context: TableContextType, keep: set[str]
+) -> TableContextType:
+    """Returns a copy of the table context with only the given columns."""
+    example_values = table_context.get("example_values", {})
+    return {
+        **table_context,
+        "table_schema": [c for c in table_context["table_schema"] if c[0] in keep],
+        "example_values": {c: v for c, v in example_values.items() if c in keep},
+    }
+
+
+def prune_schema(
+    schema_and_samples: SchemaAndSamplesType,
+    question: str | None,
+    token_budget: int | None = None,
+    index: SchemaIndex | None = None,
+    schema_format: str | None = None,
+) -> SchemaAndSamplesType:
+    """Keeps the tables and columns of the schema relevant to a question.
+
+    Columns are scored with the BM25 schema index, and tables are ranked by the
+    sum of their column scores plus matches between the question and the table
+    name. Tables are added in rank order with all columns while
+    they fit into the budget; once they no longer fit, only the matching and
+    key-like columns of a table are added. Tables that match nothing are only
+    added if there is budget left.
+
+    Args:
+        schema_and_samples (dict): The `bq_schema_and_samples` dict.
+        question (str): The natural language question.
+        token_budget (int, optional): Approximate token budget for the schema.
+          Defaults to `SCHEMA_PROMPT_TOKEN_BUDGET`; 0 disables pruning.
+        index (SchemaIndex, optional): The index to score columns with.
+          Defaults to the index loaded for the schema.
+        schema_format (str, optional): The format the schema will be serialized
+          in, used to measure it against the budget. Defaults to
+          `SCHEMA_PROMPT_FORMAT`.
+
+    Returns:
+        dict: The pruned schema, in the same format as the input.
+    """
+    if token_budget is None:
+        token_budget = SCHEMA_TOKEN_BUDGET
+    if not schema_and_samples or not question or token_budget <= 0:
+        return schema_and_samples
+    costs = {
+        table_name: _table_tokens(table_name, table_context, schema_format)
+        for table_name, table_context in schema_and_samples.items()
+    }
+    if sum(costs.values()) <= token_budget:
+        return schema_and_samples
+
+    if index is None:
+        index = get_schema_index(schema_and_samples)
+    question_terms = set(tokenize(question))
+    scores_by_table = index.column_scores(question)
+    ranked = []
+    for table_name in schema_and_samples:
+        column_scores = scores_by_table.get(table_name, {})
+        # Only the table ID counts: project and dataset are shared by all tables.
+        table_id = table_name.split(".")[-1]
+        table_score = 3.0 * len(question_terms.intersection(tokenize(table_id)))
+        table_score += sum(column_scores.values())
+        ranked.append((table_score, table_name, column_scores))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+
+    pruned = {}
+    remaining = token_budget
+    for table_score, table_name, column_scores in ranked:
+        table_context = schema_and_samples[table_name]
+        cost = costs[table_name]
+        if cost > remaining:
+            if table_score <= 0:
+                continue
+            keep = set(column_scores) | {
+                column
+                for column, _ in table_context["table_schema"]
+                if _KEY_COLUMN_PATTERN.search(column)
+            }
+            # Filters on these columns are what keeps scans of the table small.
+            keep.update(table_context.get("clustering") or [])
+            if table_context.get("partitioning"):
+                keep.add(table_context["partitioning"]["field"])
+            table_context = _prune_columns(table_context, keep)
+            cost = _table_tokens(table_name, table_context, schema_format)
+            if cost > remaining and pruned:
+                continue
+        pruned[table_name] = table_context
+        remaining -= cost
+    return pruned
@@ -17,17 +17,34 @@
 import datetime
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import sqlglot
 from google.adk.tools import ToolContext
 from google.adk.tools.bigquery.client import get_bigquery_client
 from google.cloud import bigquery
 from google.genai import Client
 from dotenv import load_dotenv  
-from data_science.config import get_env_var
+from data_science.config import get_env_var, get_optional_env_var
+from data_science.utils.streaming import (
+    FencedBlockParser,
+    read_code_block,
+    record_progress,
+)
 
 from .chase_sql import chase_constants
+from .chase_sql.sql_postprocessor.partition_rewriter import rewrite_for_partitions
+from .chase_sql.sql_postprocessor.sql_translator import SqlTranslator
+from .nl2sql_cache import cache_nl2sql
+from .schema_cache import SchemaCache, get_schema_cache
+from .schema_format import serialize_schema
+from .schema_index import load_schema_index, schema_fingerprint
+from .schema_linking import prune_schema
 
 # Assume that `BQ_COMPUTE_PROJECT_ID` and `BQ_DATA_PROJECT_ID` are set in the
 # environment. See the `data_agent` README for more details.
@@ -38,11 +55,40 @@ vertex_project = get_env_var("GOOGLE_CLOUD_PROJECT")
 location = get_env_var("GOOGLE_CLOUD_LOCATION")
 llm_client = Client(vertexai=True, project=vertex_project, location=location)
 
-MAX_NUM_ROWS = 80
+# The most rows execute_sql returns to the agent; export_query_result has no
+# row cap.
+MAX_NUM_ROWS = int(get_optional_env_var("BQ_MAX_QUERY_RESULT_ROWS", "80"))
+
+# Schema discovery introspects up to this many tables at the same time, and
+# gives up on a single table after the timeout.
+SCHEMA_DISCOVERY_CONCURRENCY = int(
+    get_optional_env_var("BQ_SCHEMA_DISCOVERY_CONCURRENCY", "8")
+)
+SCHEMA_DISCOVERY_TABLE_TIMEOUT = float(
+    get_optional_env_var("BQ_SCHEMA_DISCOVERY_TABLE_TIMEOUT_SECONDS", "60")
+)
+
+NUM_SAMPLE_ROWS = 5
+TABLESAMPLE_PERCENT = float(get_optional_env_var("BQ_TABLESAMPLE_PERCENT", "1"))
+DEFAULT_SAMPLING_METHOD = "list_rows"
+
+# Scalar types whose sample values are written as quoted string literals.
+_QUOTED_FIELD_TYPES = frozenset(
+    {"STRING", "JSON", "GEOGRAPHY", "DATE", "DATETIME", "TIME", "TIMESTAMP"}
+)
 
 
 def _serialize_value_for_sql(value):
-    """Serializes a Python value from a pandas DataFrame into a BigQuery SQL literal."""
+    """Serializes a Python value into a BigQuery SQL literal."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, (list, np.ndarray)):
+        # Format arrays.
+        return f"[{', '.join(_serialize_value_for_sql(v) for v in value)}]"
+    if isinstance(value, dict):
+        # For STRUCT, BQ expects ('val1', 'val2', ...).
+        # The values() order from the dataframe should match the column order.
+        return f"({', '.join(_serialize_value_for_sql(v) for v in value.values())})"
     if pd.isna(value):
         return "NULL"
     if isinstance(value, str):
@@ -53,16 +99,44 @@ def _serialize_value_for_sql(value):
     if isinstance(value, (datetime.datetime, datetime.date, pd.Timestamp)):
         # Timestamps and datetimes need to be quoted.
         return f"'{value}'"
-    if isinstance(value, (list, np.ndarray)):
-        # Format arrays.
-        return f"[{', '.join(_serialize_value_for_sql(v) for v in value)}]"
-    if isinstance(value, dict):
-        # For STRUCT, BQ expects ('val1', 'val2', ...).
-        # The values() order from the dataframe should match the column order.
-        return f"({', '.join(_serialize_value_for_sql(v) for v in value.values())})"
     return str(value)
 
 
+def _quote_sql_strings(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Escapes and single-quotes every value of a string column."""
+    escaped = pc.replace_substring(column, "\\", "\\\\")
+    escaped = pc.replace_substring(escaped, "'", "''")
+    return pc.binary_join_element_wise("'", escaped, "'", "")
+
+
+def _serialize_column_for_sql(
+    column: pa.ChunkedArray, schema_field: bigquery.SchemaField
+) -> list[str]:
+    """Serializes a whole Arrow column into BigQuery SQL literals.
+
+    Scalar columns are converted with vectorized Arrow compute kernels chosen
+    from the BigQuery column type. Nested columns (ARRAY and STRUCT), BYTES and
+    types without a string cast fall back to `_serialize_value_for_sql` per
+    value.
+    """
+    if schema_field.mode != "REPEATED" and schema_field.field_type not in (
+        "RECORD",
+        "STRUCT",
+        "BYTES",
+    ):
+        if pa.types.is_floating(column.type):
+            # NaN is not a BigQuery literal; sample it as NULL, like pandas.
+            column = pc.if_else(pc.is_nan(column), None, column)
+        try:
+            literals = pc.cast(column, pa.string())
+            if schema_field.field_type in _QUOTED_FIELD_TYPES:
+                literals = _quote_sql_strings(literals)
+            return pc.fill_null(literals, "NULL").to_pylist()
+        except (pa.ArrowNotImplementedError, pa.ArrowInvalid):
+            pass
+    return [_serialize_value_for_sql(v) for v in column.to_pylist()]
+
+
 database_settings = None
 
 
@@ -78,45 +152,288 @@ def update_database_settings():
     """Update database settings."""
     global database_settings
     schema_and_samples = get_bigquery_schema_and_samples()
+    # Build the schema-linking index now so that NL2SQL calls only query it.
+    load_schema_index(f"{data_project}.{dataset_id}", schema_and_samples)
+    fingerprint = schema_fingerprint(schema_and_samples)
+    if os.getenv("NL2SQL_METHOD", "BASELINE") == "CHASE":
+        # The settings live in the session state, which must stay JSON
+        # serializable; the translator keeps the SQLGlot schema and its
+        # MappingSchema under the fingerprint instead.
+        SqlTranslator.prepare_schema(schema_and_samples, fingerprint)
     database_settings = {
         "bq_data_project_id": get_env_var("BQ_DATA_PROJECT_ID"),
         "bq_dataset_id": get_env_var("BQ_DATASET_ID"),
         "bq_schema_and_samples": schema_and_samples,
+        "bq_schema_fingerprint": fingerprint,
         # Include ChaseSQL-specific constants.
         **chase_constants.chase_sql_constants_dict,
     }
     return database_settings
 
 
-def get_bigquery_schema_and_samples():
-    """Retrieves schema and sample values for the BigQuery dataset tables."""
-    client=get_bigquery_client(project=compute_project, credentials=None)
-    dataset_ref = bigquery.DatasetReference(data_project, dataset_id)
-    tables_context = {}
-    for table in client.list_tables(dataset_ref):
-        table_info = client.get_table(
-            bigquery.TableReference(dataset_ref, table.table_id)
+def _sample_with_query(client, table_info, timeout=None):
+    """Samples rows with a billed `SELECT * ... LIMIT` query job."""
+    sample_query = f"SELECT * FROM `{table_info.reference}` LIMIT {NUM_SAMPLE_ROWS}"
+    return client.query(sample_query, timeout=timeout).result(timeout=timeout)
+
+
+def _sample_with_list_rows(client, table_info, timeout=None):
+    """Samples rows through the free `tabledata.list` API.
+
+    Views, materialized views and external tables cannot be listed, so they
+    fall back to a query job.
+    """
+    if table_info.table_type != "TABLE":
+        return _sample_with_query(client, table_info, timeout)
+    return client.list_rows(
+        table_info, max_results=NUM_SAMPLE_ROWS, timeout=timeout
+    )
+
+
+def _sample_with_tablesample(client, table_info, timeout=None):
+    """Samples rows with `TABLESAMPLE SYSTEM`, which only bills sampled blocks."""
+    if table_info.table_type != "TABLE":
+        return _sample_with_query(client, table_info, timeout)
+    columns = ", ".join(f"`{field.name}`" for field in table_info.schema)
+    sample_query = (
+        f"SELECT {columns} FROM `{table_info.reference}` "
+        f"TABLESAMPLE SYSTEM ({TABLESAMPLE_PERCENT} PERCENT) "
+        f"LIMIT {NUM_SAMPLE_ROWS}"
+    )
+    return client.query(sample_query, timeout=timeout).result(timeout=timeout)
+
+
+SAMPLING_METHODS = {
+    "query": _sample_with_query,
+    "list_rows": _sample_with_list_rows,
+    "tablesample": _sample_with_tablesample,
+}
+
+
+def get_sampling_method(dataset: str) -> str:
+    """Returns the sampling method configured for a dataset.
+
+    `BQ_SAMPLING_METHOD` is a comma-separated list of methods. A bare method
+    sets the default, and a `dataset=method` entry overrides it for one
+    dataset, e.g. `list_rows,sales=tablesample`.
+
+    Args:
+        dataset (str): The dataset ID, with or without the project prefix.
+
+    Returns:
+        str: One of the keys of `SAMPLING_METHODS`.
+    """
+    method = DEFAULT_SAMPLING_METHOD
+    overrides = {}
+    setting = get_optional_env_var("BQ_SAMPLING_METHOD", DEFAULT_SAMPLING_METHOD)
+    for entry in setting.split(","):
+        name, _, value = entry.strip().rpartition("=")
+        if name:
+            overrides[name.strip()] = value.strip()
+        elif value:
+            method = value
+    method = overrides.get(dataset, overrides.get(dataset.split(".")[-1], method))
+    if method not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method: {method}")
+    return method
+
+
+def _get_table_schema_and_samples(
+    client, table_info, timeout=None, sampling_method=DEFAULT_SAMPLING_METHOD
+):
+    """Retrieves the schema and sample values of a single table."""
+    table_schema = [
+        (schema_field.name, schema_field.field_type)
+        for schema_field in table_info.schema
+    ]
+    rows = SAMPLING_METHODS[sampling_method](client, table_info, timeout).to_arrow()
+    sample_values = {
+        schema_field.name: _serialize_column_for_sql(
+            rows.column(schema_field.name), schema_field
+        )
+        for schema_field in table_info.schema
+        if schema_field.name in rows.column_names
+    }
+    return {
+        "table_schema": table_schema,
+        "example_values": sample_values,
+        "partitioning": _get_partitioning(table_info),
+        "clustering": table_info.clustering_fields or None,
+    }
+
+
+def _get_partitioning(table_info):
+    """Returns how a table is partitioned, or None if it is not.
+
+    Ingestion-time partitioned tables are partitioned on `_PARTITIONTIME`.
+    """
+    if table_info.time_partitioning is not None:
+        return {
+            "type": table_info.time_partitioning.type_,
+            "field": table_info.time_partitioning.field or "_PARTITIONTIME",
+            "require_filter": bool(table_info.require_partition_filter),
+        }
+    if table_info.range_partitioning is not None:
+        return {
+            "type": "RANGE",
+            "field": table_info.range_partitioning.field,
+            "require_filter": bool(table_info.require_partition_filter),
+        }
+    return None
+
+
+def _introspect_table(client, table_ref, snapshot, timeout, sampling_method):
+    """Introspects one table, reusing the snapshot entry if it is current.
+
+    Returns:
+        tuple: The table info, the table context (None if the cached entry is
+        still valid) and the elapsed time in seconds.
+    """
+    start_time = time.perf_counter()
+    table_info = client.get_table(table_ref, timeout=timeout)
+    table_context = None
+    if (
+        snapshot.get_table(str(table_ref), table_info.etag, table_info.modified)
+        is None
+    ):
+        table_context = _get_table_schema_and_samples(
+            client, table_info, timeout, sampling_method
         )
-        table_schema = [
-            (schema_field.name, schema_field.field_type)
-            for schema_field in table_info.schema
-        ]
-        table_ref = dataset_ref.table(table.table_id)
-        sample_query = f"SELECT * FROM `{table_ref}` LIMIT 5"
-        sample_values = client.query(sample_query).to_dataframe().to_dict(orient="list")
-        for key in sample_values:
-            sample_values[key] = [_serialize_value_for_sql(v) for v in sample_values[key]]
-        tables_context[str(table_ref)] = {"table_schema": table_schema, "example_values": sample_values}
+    return table_info, table_context, time.perf_counter() - start_time
 
+
+def get_bigquery_schema_and_samples(
+    schema_cache: SchemaCache | None = None,
+    max_workers: int | None = None,
+    table_timeout: float | None = None,
+    sampling_method: str | None = None,
+):
+    """Retrieves schema and sample values for the BigQuery dataset tables.
+
+    Tables are introspected concurrently. Tables whose `etag` and `modified`
+    time match the cached snapshot are served from the schema cache; only new
+    or changed tables are sampled again. A table that fails or times out is
+    logged and skipped (or served from a stale snapshot entry, if any) instead
+    of failing the whole discovery.
+
+    Args:
+        schema_cache (SchemaCache, optional): The cache to use. Defaults to the
+          cache configured through `BQ_SCHEMA_CACHE_DIR`.
+        max_workers (int, optional): Maximum number of tables introspected at
+          the same time. Defaults to `BQ_SCHEMA_DISCOVERY_CONCURRENCY`.
+        table_timeout (float, optional): Timeout in seconds for each BigQuery
+          call made for a table. Defaults to
+          `BQ_SCHEMA_DISCOVERY_TABLE_TIMEOUT_SECONDS`.
+        sampling_method (str, optional): How sample rows are read, one of
+          `query`, `list_rows` or `tablesample`. Defaults to the method
+          configured for the dataset through `BQ_SAMPLING_METHOD`.
+
+    Returns:
+        dict: The schema and sample values keyed by `project.dataset.table`.
+    """
+    if schema_cache is None:
+        schema_cache = get_schema_cache()
+    max_workers = max_workers or SCHEMA_DISCOVERY_CONCURRENCY
+    table_timeout = table_timeout or SCHEMA_DISCOVERY_TABLE_TIMEOUT
+    dataset_ref = bigquery.DatasetReference(data_project, dataset_id)
+    snapshot = schema_cache.load(str(dataset_ref))
+    sampling_method = sampling_method or get_sampling_method(str(dataset_ref))
+    if snapshot.is_fresh(schema_cache.max_age_seconds):
+        return snapshot.tables_context()
+
+    client=get_bigquery_client(project=compute_project, credentials=None)
+    table_refs = [
+        bigquery.TableReference(dataset_ref, table.table_id)
+        for table in client.list_tables(dataset_ref, timeout=table_timeout)
+    ]
+    tables_context = {}
+    timings = {}
+    failed = False
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_ref = {
+            executor.submit(
+                _introspect_table,
+                client,
+                table_ref,
+                snapshot,
+                table_timeout,
+                sampling_method,
+            ): table_ref
+            for table_ref in table_refs
+        }
+        for future in as_completed(future_to_ref):
+            table_ref = str(future_to_ref[future])
+            try:
+                table_info, table_context, timings[table_ref] = future.result()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.warning("Skipping table %s during schema discovery: %s",
+                                table_ref, e)
+                failed = True
+                stale_context = snapshot.tables_context().get(table_ref)
+                if stale_context is not None:
+                    tables_context[table_ref] = stale_context
+                continue
+            if table_context is None:
+                table_context = snapshot.get_table(
+                    table_ref, table_info.etag, table_info.modified
+                )
+            else:
+                snapshot.put_table(
+                    table_ref, table_info.etag, table_info.modified, table_context
+                )
+            tables_context[table_ref] = table_context
+
+    for table_ref, elapsed in sorted(
+        timings.items(), key=lambda item: item[1], reverse=True
+    ):
+        logging.info("Schema discovery of %s took %.3fs", table_ref, elapsed)
+
+    # Keep the listing order of the dataset regardless of completion order.
+    tables_context = {
+        str(table_ref): tables_context[str(table_ref)]
+        for table_ref in table_refs
+        if str(table_ref) in tables_context
+    }
+    snapshot.retain(str(table_ref) for table_ref in table_refs)
+    schema_cache.save(snapshot, validated=not failed)
     return tables_context
 
 
-def initial_bq_nl2sql(
+def _complete_sql_statement(sql: str) -> str | None:
+    """Returns the first statement of `sql` once it is terminated and parses.
+
+    Semicolons in strings and comments do not terminate a statement.
+    """
+    try:
+        tokens = sqlglot.Dialect.get_or_raise("bigquery").tokenize(sql)
+    except sqlglot.errors.SqlglotError:
+        # E.g. a string literal that is still being generated.
+        return None
+    for token in tokens:
+        if token.token_type == sqlglot.tokens.TokenType.SEMICOLON:
+            statement = sql[: token.end + 1]
+            try:
+                expression = sqlglot.parse_one(statement, read="bigquery")
+            except sqlglot.errors.SqlglotError:
+                return None
+            return statement.strip() if isinstance(expression, sqlglot.exp.Query) else None
+    return None
+
+
+@rewrite_for_partitions
+@cache_nl2sql("baseline", lambda _: os.getenv("BASELINE_NL2SQL_MODEL", ""))
+async def initial_bq_nl2sql(
     question: str,
     tool_context: ToolContext,
 ) -> str:
     """Generates an initial SQL query from a natural language question.
 
+    The model is called through the async client, so the event loop keeps
+    serving other sessions while the SQL is generated. The response is
+    streamed and the generation stops as soon as the SQL block or its first
+    statement is complete; the stage is recorded in `nl2sql_progress`.
+    Repeated questions are answered from the NL2SQL cache.
+
     Args:
         question (str): Natural language question.
         tool_context (ToolContext): The tool context to use for generating the SQL
@@ -157,21 +474,27 @@ The database structure is defined by the following table schemas (possibly with
 
    """
 
-    bq_schema_and_samples = tool_context.state["database_settings"]["bq_schema_and_samples"]
+    bq_schema_and_samples = prune_schema(
+        tool_context.state["database_settings"]["bq_schema_and_samples"], question
+    )
 
     prompt = prompt_template.format(
-        MAX_NUM_ROWS=MAX_NUM_ROWS, SCHEMA=bq_schema_and_samples, QUESTION=question
+        MAX_NUM_ROWS=MAX_NUM_ROWS,
+        SCHEMA=serialize_schema(bq_schema_and_samples),
+        QUESTION=question,
     )
 
-    response = llm_client.models.generate_content(
+    stream = await llm_client.aio.models.generate_content_stream(
         model=os.getenv("BASELINE_NL2SQL_MODEL"),
         contents=prompt,
         config={"temperature": 0.1},
     )
-
-    sql = response.text
-    if sql:
-        sql = sql.replace("```sql", "").replace("```", "").strip()
+    sql = await read_code_block(
+        stream,
+        FencedBlockParser(languages=("sql", "googlesql", "bigquery")),
+        on_progress=record_progress(tool_context.state, "nl2sql_progress"),
+        complete_statement=_complete_sql_statement,
+    )
 
     print("\n sql:", sql)
 
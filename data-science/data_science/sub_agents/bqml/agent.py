@@ -32,8 +32,11 @@ from .prompts import return_instructions_bqml
 
 from data_science.sub_agents.bigquery.agent import database_agent as bq_db_agent
 from data_science.sub_agents.bigquery.tools import (
+    MAX_NUM_ROWS,
     get_database_settings as get_bq_database_settings,
 )
+from data_science.sub_agents.bigquery.schema_format import serialize_schema
+from data_science.sub_agents.bigquery.schema_linking import prune_schema
 
 
 # BigQuery built-in tools in ADK
@@ -53,7 +56,19 @@ def setup_before_agent_call(callback_context: CallbackContext):
     # setting up schema in instruction
     if callback_context.state["all_db_settings"]["use_database"] == "BigQuery":
         callback_context.state["database_settings"] = get_bq_database_settings()
-        schema = callback_context.state["database_settings"]["bq_schema_and_samples"]
+        # Only put the part of the schema that is relevant to the user's
+        # message into the instruction.
+        question = None
+        if callback_context.user_content and callback_context.user_content.parts:
+            question = " ".join(
+                part.text for part in callback_context.user_content.parts if part.text
+            )
+        schema = serialize_schema(
+            prune_schema(
+                callback_context.state["database_settings"]["bq_schema_and_samples"],
+                question,
+            )
+        )
 
         callback_context._invocation_context.agent.instruction = (
             return_instructions_bqml()
@@ -93,7 +108,7 @@ async def call_db_agent(
 bigquery_tool_filter = [ADK_BUILTIN_BQ_EXECUTE_SQL_TOOL]
 bigquery_tool_config = BigQueryToolConfig(
     write_mode=WriteMode.ALLOWED, # to be able to execute CREATE MODEL statement
-    max_query_result_rows=80
+    max_query_result_rows=MAX_NUM_ROWS
 )
 bq_execute_sql = BigQueryToolset(
     tool_filter=bigquery_tool_filter,
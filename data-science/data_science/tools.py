@@ -22,6 +22,7 @@ from google.adk.tools import ToolContext
 from google.adk.tools.agent_tool import AgentTool
 
 from .sub_agents import ds_agent, db_agent
+from .utils.result_artifacts import data_context
 
 
 async def call_db_agent(
@@ -52,7 +53,9 @@ async def call_ds_agent(
     if question == "N/A":
         return tool_context.state["db_agent_output"]
 
-    input_data = tool_context.state["query_result"]
+    # Only a summary of the data goes into the prompt; the generated code
+    # loads the full result from the artifact.
+    input_data = data_context(tool_context.state)
 
     question_with_data = f"""
   Question to answer: {question}
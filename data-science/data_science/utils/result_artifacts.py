@@ -0,0 +1,321 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Handoff of query results from the database agent to the analytics agent.
+
+A query result is stored once, as a Parquet artifact of the session. Prompts
+only get a compact summary of it (schema, row count, first rows and column
+statistics), so their size does not grow with the result. The analytics
+sandbox gets the Parquet file itself.
+"""
+
+import io
+import json
+import logging
+from typing import Any, Iterable, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from google.genai import types
+
+from data_science.config import get_optional_env_var
+
+QUERY_RESULT_ARTIFACT = "query_result.parquet"
+PARQUET_MIME_TYPE = "application/vnd.apache.parquet"
+# State key of the summary of the latest query result.
+QUERY_RESULT_SUMMARY = "query_result_summary"
+SUMMARY_HEAD_ROWS = int(get_optional_env_var("QUERY_RESULT_SUMMARY_ROWS", "5"))
+# Distinct values of a string column are counted up to this limit.
+DISTINCT_LIMIT = 10000
+
+_JSON_TYPES = (str, int, float, bool, type(None))
+
+
+def _json_value(value: Any) -> Any:
+    """Returns the value, or its string form if it is not a JSON scalar."""
+    return value if isinstance(value, _JSON_TYPES) else str(value)
+
+
+def rows_to_table(rows: list[dict[str, Any]]) -> pa.Table:
+    """Converts `execute_sql` rows to an Arrow table.
+
+    Columns whose values Arrow cannot give a single type are kept as strings.
+    """
+    try:
+        return pa.Table.from_pylist(rows)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.Table.from_pylist(
+            [{k: None if v is None else str(v) for k, v in row.items()} for row in rows]
+        )
+
+
+def to_parquet(table: pa.Table) -> bytes:
+    """Serializes an Arrow table to Parquet."""
+    sink = io.BytesIO()
+    pq.write_table(table, sink)
+    return sink.getvalue()
+
+
+class _ColumnStats:
+    """Statistics of a column, accumulated over record batches."""
+
+    def __init__(self, field: pa.Field):
+        self.field = field
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.total = 0
+        self.count = 0
+        self.distinct: set | None = set()
+
+    @property
+    def numeric(self) -> bool:
+        return pa.types.is_integer(self.field.type) or pa.types.is_floating(
+            self.field.type
+        )
+
+    @property
+    def string(self) -> bool:
+        return pa.types.is_string(self.field.type) or pa.types.is_large_string(
+            self.field.type
+        )
+
+    def update(self, array: pa.Array) -> None:
+        self.nulls += array.null_count
+        if array.null_count == len(array):
+            return
+        if self.numeric or pa.types.is_temporal(self.field.type):
+            min_max = pc.min_max(array)
+            low, high = min_max["min"].as_py(), min_max["max"].as_py()
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+        if self.numeric:
+            self.total += pc.sum(array).as_py()
+            self.count += len(array) - array.null_count
+        elif self.string and self.distinct is not None:
+            self.distinct.update(pc.unique(array).to_pylist())
+            self.distinct.discard(None)
+            if len(self.distinct) > DISTINCT_LIMIT:
+                self.distinct = None
+
+    def summary(self) -> dict[str, Any]:
+        stats: dict[str, Any] = {
+            "name": self.field.name,
+            "type": str(self.field.type),
+            "nulls": self.nulls,
+        }
+        if self.numeric and self.count:
+            stats.update(min=self.min, max=self.max, mean=self.total / self.count)
+        elif self.min is not None:
+            stats.update(min=str(self.min), max=str(self.max))
+        elif self.string and (self.distinct is None or self.distinct):
+            stats["distinct"] = (
+                len(self.distinct) if self.distinct is not None else f">{DISTINCT_LIMIT}"
+            )
+        return stats
+
+
+class ResultSummarizer:
+    """Summarizes a query result that arrives in record batches."""
+
+    def __init__(self, schema: pa.Schema, head_rows: int = SUMMARY_HEAD_ROWS):
+        """Initializes the summarizer.
+
+        Args:
+            schema (pa.Schema): The schema of the query result.
+            head_rows (int): The number of rows to include.
+        """
+        self.head_rows = head_rows
+        self.num_rows = 0
+        self.columns = [_ColumnStats(field) for field in schema]
+        self.head: list[dict[str, Any]] = []
+
+    def update(self, batch: pa.RecordBatch) -> None:
+        self.num_rows += batch.num_rows
+        for stats, array in zip(self.columns, batch.columns):
+            stats.update(array)
+        if len(self.head) < self.head_rows:
+            self.head.extend(
+                {k: _json_value(v) for k, v in row.items()}
+                for row in batch.slice(0, self.head_rows - len(self.head)).to_pylist()
+            )
+
+    def summary(self) -> dict[str, Any]:
+        """Returns the row count, the statistics per column and the first rows."""
+        return {
+            "num_rows": self.num_rows,
+            "columns": [stats.summary() for stats in self.columns],
+            "head": self.head,
+        }
+
+
+def summarize(table: pa.Table, head_rows: int = SUMMARY_HEAD_ROWS) -> dict[str, Any]:
+    """Returns a JSON-serializable summary of a query result.
+
+    Args:
+        table (pa.Table): The query result.
+        head_rows (int): The number of rows to include.
+
+    Returns:
+        dict: The row count, the name, type and statistics of every column
+        and the first rows.
+    """
+    summarizer = ResultSummarizer(table.schema, head_rows)
+    for batch in table.to_batches():
+        summarizer.update(batch)
+    return summarizer.summary()
+
+
+def write_parquet(
+    batches: Iterable[pa.RecordBatch], memory_limit: int
+) -> tuple[bytes, dict[str, Any]]:
+    """Writes streamed record batches to Parquet under a memory ceiling.
+
+    The ceiling bounds the Arrow size of the rows read, which is also an upper
+    bound for the compressed Parquet data. Reading stops at the batch that
+    crosses it, and that batch is cut so that it fits.
+
+    Args:
+        batches (Iterable[pa.RecordBatch]): The query result.
+        memory_limit (int): The maximum Arrow size of the exported rows, in
+          bytes.
+
+    Returns:
+        tuple: The Parquet data and the summary of the rows it holds, with
+        `truncated` set if rows were left out.
+    """
+    sink = io.BytesIO()
+    writer = summarizer = None
+    truncated = False
+    read_bytes = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(sink, batch.schema)
+                summarizer = ResultSummarizer(batch.schema)
+            available = memory_limit - read_bytes
+            if batch.nbytes > available:
+                truncated = True
+                row_bytes = batch.nbytes / max(batch.num_rows, 1)
+                batch = batch.slice(0, max(0, int(available / row_bytes)))
+            read_bytes += batch.nbytes
+            if batch.num_rows:
+                writer.write_batch(batch)
+                summarizer.update(batch)
+            if truncated:
+                break
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        empty = pa.table({})
+        return to_parquet(empty), {**summarize(empty), "truncated": False}
+    return sink.getvalue(), {**summarizer.summary(), "truncated": truncated}
+
+
+def format_summary(summary: dict[str, Any]) -> str:
+    """Formats a summary for a prompt."""
+    lines = [f"Rows: {summary['num_rows']}", "Columns:"]
+    for column in summary["columns"]:
+        stats = ", ".join(
+            f"{k}={v}" for k, v in column.items() if k not in ("name", "type")
+        )
+        lines.append(f"  - {column['name']} ({column['type']}): {stats}")
+    lines.append(f"First {len(summary['head'])} rows:")
+    lines.extend(json.dumps(row, default=str) for row in summary["head"])
+    return "\n".join(lines)
+
+
+def data_context(state: Any) -> Optional[str]:
+    """Describes the latest query result of the session for a prompt.
+
+    Returns:
+        str: Where the code finds the full result and its summary, or None if
+        the session has no result.
+    """
+    summary = state.get(QUERY_RESULT_SUMMARY)
+    if summary is not None and summary.get("artifact"):
+        return (
+            f"The full result of the previous query is in the Parquet file "
+            f"`{summary['artifact']}` in the working directory of the code; "
+            f"load it with `pandas.read_parquet('{summary['artifact']}')` "
+            "instead of typing the data into the code. Its summary:\n"
+            + format_summary(summary)
+        )
+    if state.get("query_result") is not None:
+        # Sessions without an artifact service keep the rows in the state.
+        return f"The data of the previous query: {state['query_result']}"
+    return None
+
+
+async def save_query_result(context, table: pa.Table) -> dict[str, Any]:
+    """Saves a query result as the session's query result artifact.
+
+    Args:
+        context (ToolContext | CallbackContext): The context of the session.
+        table (pa.Table): The query result.
+
+    Returns:
+        dict: The summary, with the artifact name and version.
+    """
+    return await save_parquet_result(context, to_parquet(table), summarize(table))
+
+
+async def save_parquet_result(
+    context, data: bytes, summary: dict[str, Any]
+) -> dict[str, Any]:
+    """Saves Parquet data as the session's query result artifact.
+
+    The summary is stored in `context.state[QUERY_RESULT_SUMMARY]`. Without an
+    artifact service, the rows are stored in `context.state["query_result"]`
+    instead.
+
+    Args:
+        context (ToolContext | CallbackContext): The context of the session.
+        data (bytes): The query result in Parquet.
+        summary (dict): The summary of the query result.
+
+    Returns:
+        dict: The summary, with the artifact name and version.
+    """
+    summary = dict(summary)
+    try:
+        version = await context.save_artifact(
+            QUERY_RESULT_ARTIFACT,
+            types.Part.from_bytes(data=data, mime_type=PARQUET_MIME_TYPE),
+        )
+        summary.update(artifact=QUERY_RESULT_ARTIFACT, version=version)
+    except ValueError as e:
+        logging.warning("Keeping the query result in the state: %s", e)
+        summary.update(artifact=None, version=None)
+        context.state["query_result"] = [
+            {k: _json_value(v) for k, v in row.items()}
+            for row in pq.read_table(io.BytesIO(data)).to_pylist()
+        ]
+    context.state[QUERY_RESULT_SUMMARY] = summary
+    return summary
+
+
+async def load_query_result(context) -> Optional[bytes]:
+    """Returns the Parquet bytes of the session's query result, if any."""
+    summary = context.state.get(QUERY_RESULT_SUMMARY)
+    if not summary or not summary.get("artifact"):
+        return None
+    try:
+        part = await context.load_artifact(summary["artifact"], summary["version"])
+    except ValueError as e:
+        logging.warning("Could not load the query result: %s", e)
+        return None
+    return part.inline_data.data if part is not None and part.inline_data else None
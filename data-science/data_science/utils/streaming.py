@@ -0,0 +1,145 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental parsing of streamed model responses.
+
+Code generation tools only need the fenced code block of a response. Reading
+the response as a stream lets them stop the generation as soon as the block
+is complete, instead of waiting for (and paying for) whatever the model
+writes after it.
+"""
+
+import re
+from typing import Any, AsyncIterator, Callable, MutableMapping, Optional
+
+FENCE = "```"
+_OPENING_FENCE = re.compile(r"```([\w+-]*)[ \t]*\n")
+
+
+class FencedBlockParser:
+    """Finds the first fenced code block in text that arrives in chunks."""
+
+    def __init__(self, languages: tuple[str, ...] = ()):
+        """Initializes the parser.
+
+        Args:
+            languages (tuple[str, ...]): The languages of the blocks to extract,
+              e.g. ("sql",); "" matches a fence without a language. Empty
+              matches every block.
+        """
+        self.languages = tuple(language.lower() for language in languages)
+        self.text = ""
+        self._start: Optional[int] = None
+        self._end: Optional[int] = None
+
+    @property
+    def stage(self) -> str:
+        """"preamble" before the block, "code" inside it, "complete" after it."""
+        if self._start is None:
+            return "preamble"
+        return "code" if self._end is None else "complete"
+
+    @property
+    def code(self) -> Optional[str]:
+        """The code of the block so far, or None before the block starts."""
+        if self._start is None:
+            return None
+        end = len(self.text) if self._end is None else self._end
+        # A partial closing fence is not code.
+        return self.text[self._start : end].rstrip("`")
+
+    def feed(self, chunk: str) -> bool:
+        """Adds a chunk of the response; returns True once the block is closed."""
+        self.text += chunk
+        if self._start is None:
+            for match in _OPENING_FENCE.finditer(self.text):
+                if not self.languages or match.group(1).lower() in self.languages:
+                    self._start = match.end()
+                    break
+        if self._start is not None and self._end is None:
+            end = self.text.find(FENCE, self._start)
+            if end != -1:
+                self._end = end
+        return self._end is not None
+
+    def result(self) -> str:
+        """Returns the code block, or the text without fences if it has none."""
+        if self._start is not None:
+            return self.code.strip()
+        return _OPENING_FENCE.sub("", self.text).replace(FENCE, "").strip()
+
+
+def record_progress(
+    state: MutableMapping[str, Any], key: str
+) -> Callable[[str, FencedBlockParser], None]:
+    """Returns an `on_progress` callback that records the stage in the state.
+
+    Tools cannot emit events of their own, so the progress reaches the event
+    stream through the state delta of the tool's events.
+    """
+
+    def on_progress(stage: str, parser: FencedBlockParser) -> None:
+        state[key] = {"stage": stage, "chars": len(parser.text)}
+
+    return on_progress
+
+
+async def read_code_block(
+    stream: AsyncIterator[Any],
+    parser: FencedBlockParser,
+    on_progress: Optional[Callable[[str, FencedBlockParser], None]] = None,
+    complete_statement: Optional[Callable[[str], Optional[str]]] = None,
+) -> str:
+    """Reads a streamed response until its code block is complete.
+
+    The stream is closed as soon as the block is closed, or as soon as
+    `complete_statement` finds a complete statement in the code so far, which
+    stops the generation.
+
+    Args:
+        stream (AsyncIterator): The response chunks; each has a `text`.
+        parser (FencedBlockParser): The parser of the response.
+        on_progress (callable, optional): Called with the stage of the parser
+          (see `FencedBlockParser.stage`) and the parser whenever the stage
+          changes, and with "done" at the end.
+        complete_statement (callable, optional): Returns the complete statement
+          at the start of the code so far, or None if there is none yet.
+
+    Returns:
+        str: The statement found by `complete_statement`, the code block, or
+        the whole response without fences if it has no block.
+    """
+    stage = None
+    statement = None
+    try:
+        async for chunk in stream:
+            text = chunk.text or ""
+            closed = parser.feed(text)
+            if on_progress is not None and parser.stage != stage:
+                stage = parser.stage
+                on_progress(stage, parser)
+            if closed:
+                break
+            # Statements can only be complete once a terminator arrives.
+            if complete_statement is not None and parser.code and ";" in text:
+                statement = complete_statement(parser.code)
+                if statement is not None:
+                    break
+    finally:
+        aclose = getattr(stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    if on_progress is not None:
+        on_progress("done", parser)
+    return statement if statement is not None else parser.result()
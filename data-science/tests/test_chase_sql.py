@@ -0,0 +1,756 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the CHASE-SQL model utilities."""
+
+import asyncio
+import datetime
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery.chase_sql import llm_utils
+from data_science.sub_agents.bigquery.chase_sql.candidate_selector import (
+    SampleReplica,
+    select_candidate,
+)
+from data_science.sub_agents.bigquery.chase_sql import context_cache
+from data_science.sub_agents.bigquery.chase_sql.chase_db_tools import sql_validator
+from data_science.sub_agents.bigquery.chase_sql.context_cache import (
+    ContextCacheManager,
+    split_prompt_template,
+)
+from data_science.sub_agents.bigquery.chase_sql.dc_prompt_template import (
+    DC_PROMPT_TEMPLATE,
+)
+from data_science.sub_agents.bigquery.chase_sql.llm_utils import (
+    GEMINI_AVAILABLE_REGIONS,
+    GeminiModel,
+    RequestLimiter,
+    call_first_valid_async,
+)
+from data_science.sub_agents.bigquery.chase_sql.region_router import RegionRouter
+from data_science.sub_agents.bigquery.chase_sql.sql_postprocessor.partition_rewriter import (
+    PartitionRewriter,
+    rewrite_for_partitions,
+)
+from data_science.sub_agents.bigquery.chase_sql.sql_postprocessor.sql_repair import (
+    SqlRepairEngine,
+    match_column_names,
+    match_table_names,
+    repair_schema,
+)
+from data_science.sub_agents.bigquery.chase_sql.sql_postprocessor.sql_translator import (
+    SqlTranslator,
+    _LruCache,
+)
+from data_science.sub_agents.bigquery.chase_sql.retry_policy import (
+    RetryMetrics,
+    RetryPolicy,
+)
+from google.api_core import exceptions
+import sqlglot
+import sqlglot.optimizer
+
+
+class FakeGenerativeModel:
+    """Answers each prompt after the delay given in the prompt."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cancelled = 0
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay = float(prompt.split(":")[1])
+            if delay < 0:
+                raise ValueError("bad prompt")
+            await asyncio.sleep(delay)
+            return mock.Mock(text=f"answer to {prompt}")
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+
+class TestCallParallel(unittest.TestCase):
+    """Test cases for GeminiModel.call_parallel."""
+
+    def setUp(self):
+        self.model = GeminiModel(model_name="gemini-2.5-flash")
+        self.model.model = FakeGenerativeModel()
+
+    def test_results_keep_the_prompt_order(self):
+        results = self.model.call_parallel(
+            ["a:0.05", "b:0", "c:-1"], parser_func=str.upper
+        )
+        self.assertEqual(
+            results,
+            ["ANSWER TO A:0.05", "ANSWER TO B:0", "Error after retries: bad prompt"],
+        )
+
+    def test_timeout_cancels_outstanding_requests(self):
+        results = self.model.call_parallel(["a:0", "b:5"], timeout=0.2)
+        self.assertEqual(results, ["answer to a:0", "Timeout"])
+        self.assertEqual(self.model.model.cancelled, 1)
+
+    def test_limiter_caps_concurrency_across_calls(self):
+        with mock.patch.object(llm_utils, "REQUEST_LIMITER", RequestLimiter(2)):
+
+            async def run():
+                return await asyncio.gather(
+                    self.model.call_parallel_async(["a:0.05"] * 3),
+                    self.model.call_parallel_async(["b:0.05"] * 3),
+                )
+
+            results = asyncio.run(run())
+        self.assertEqual(results[1], ["answer to b:0.05"] * 3)
+        self.assertEqual(self.model.model.max_in_flight, 2)
+
+
+class TestCandidateSelection(unittest.TestCase):
+    """Test cases for the first-valid candidate selection."""
+
+    def setUp(self):
+        self.model = GeminiModel(model_name="gemini-2.5-flash")
+        self.model.model = FakeGenerativeModel()
+
+    def test_first_valid_response_cancels_the_rest(self):
+        response = asyncio.run(
+            call_first_valid_async(
+                [(self.model, p) for p in ("bad:0", "good:0.05", "good:5")],
+                is_valid=lambda r: "good" in r,
+            )
+        )
+        self.assertEqual(response, "answer to good:0.05")
+        self.assertEqual(self.model.model.cancelled, 1)
+
+    def test_falls_back_to_the_first_response(self):
+        response = asyncio.run(
+            call_first_valid_async(
+                [(self.model, p) for p in ("x:-1", "bad:0.05", "bad:0.1")],
+                is_valid=lambda r: False,
+            )
+        )
+        self.assertEqual(response, "answer to bad:0.05")
+
+    def test_returns_none_if_every_request_fails(self):
+        response = asyncio.run(
+            call_first_valid_async(
+                [(self.model, p) for p in ("x:-1", "y:-1")],
+                is_valid=lambda r: True,
+            )
+        )
+        self.assertIsNone(response)
+
+    def test_sql_validator_checks_the_schema(self):
+        is_valid = sql_validator(
+            {"p.ds.t": {"table_schema": [("a", "INT64"), ("s", "STRING")]}},
+            db="ds",
+            catalog="p",
+        )
+        self.assertTrue(is_valid("SELECT a FROM `p.ds.t` WHERE s = 'x'"))
+        self.assertFalse(is_valid("SELECT b FROM `p.ds.t`"))
+        self.assertFalse(is_valid("no sql here"))
+
+
+
+SCHEMA = {
+    "p.ds.train": {
+        "table_schema": [("YrSold", "INT64"), ("City", "STRING")],
+        "example_values": {
+            "YrSold": ["2008", "2009", "2008"],
+            "City": ["'O''Hare'", "NULL", "'Albany'"],
+        },
+    }
+}
+
+
+class TestCandidateVoting(unittest.TestCase):
+    """Test cases for the voting candidate selector."""
+
+    def test_replica_runs_bigquery_sql_on_the_samples(self):
+        replica = SampleReplica(SCHEMA)
+        self.assertEqual(
+            replica.execute(
+                "SELECT City FROM `p.ds.train` WHERE City IS NOT NULL ORDER BY 1"
+            ),
+            [("Albany",), ("O'Hare",)],
+        )
+        self.assertIsNone(replica.execute("SELECT ST_GEOGPOINT(1, 2) FROM `p.ds.train`"))
+
+    def test_majority_by_result(self):
+        candidates = [
+            "SELECT YrSold FROM `p.ds.train`",
+            "Timeout",
+            "SELECT DISTINCT YrSold FROM `p.ds.train`",
+            "SELECT YrSold FROM `p.ds.train` GROUP BY YrSold",
+            "SELECT Year FROM `p.ds.train`",
+        ]
+        self.assertEqual(
+            select_candidate(candidates, SCHEMA, db="ds", catalog="p"), candidates[2]
+        )
+
+    def test_majority_by_canonical_sql(self):
+        candidates = [
+            "SELECT YrSold FROM `p.ds.train` WHERE City = 'Oakland'",
+            "SELECT yrsold FROM `p.ds.train` AS t WHERE t.City = 'Paris'",
+            "select YrSold\nfrom `p.ds.train` where City='Paris'",
+        ]
+        self.assertEqual(
+            select_candidate(candidates, SCHEMA, db="ds", catalog="p"), candidates[1]
+        )
+
+    def test_falls_back_to_the_first_candidate(self):
+        self.assertEqual(
+            select_candidate(
+                ["Timeout", "SELECT 1 FROM `p.ds.nowhere`"], SCHEMA, db="ds", catalog="p"
+            ),
+            "Timeout",
+        )
+
+
+
+class TestRegionRouter(unittest.TestCase):
+    """Test cases for the region router."""
+
+    def test_regions_are_unique(self):
+        self.assertEqual(len(GEMINI_AVAILABLE_REGIONS), len(set(GEMINI_AVAILABLE_REGIONS)))
+        self.assertEqual(RegionRouter(["a", "b", "a"]).regions, ["a", "b"])
+
+    def test_prefers_the_faster_region(self):
+        router = RegionRouter(["fast", "slow"])
+        router.record_success("fast", 0.5)
+        router.record_success("slow", 5.0)
+        self.assertEqual({router.choose() for _ in range(20)}, {"fast"})
+        self.assertEqual(router.choose_distinct(3), ["fast", "slow", "fast"])
+
+    def test_throttling_region_is_ejected(self):
+        router = RegionRouter(["a", "b"], eject_after_failures=3)
+        for _ in range(3):
+            router.record_failure("a", exceptions.TooManyRequests("quota"))
+        # Client errors say nothing about the region.
+        router.record_failure("b", exceptions.BadRequest("bad prompt"))
+        self.assertEqual({router.choose() for _ in range(20)}, {"b"})
+        self.assertEqual(router.stats["a"].ejections, 1)
+        self.assertEqual(router.stats["b"].error_rate, 0)
+
+    def test_requests_are_routed_per_call(self):
+        router = RegionRouter(["a", "b"])
+        regional_models = {"a": FakeGenerativeModel(), "b": FakeGenerativeModel()}
+        model = GeminiModel(model_name="gemini-2.5-flash", distribute_requests=True)
+        with mock.patch.object(llm_utils, "REGION_ROUTER", router), mock.patch.object(
+            model, "_regional_model", side_effect=regional_models.get
+        ):
+            model.call_parallel(["p:0"] * 30)
+        self.assertEqual(set(router.stats), {"a", "b"})
+        self.assertTrue(all(s.latency is not None for s in router.stats.values()))
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """Test cases for the retry policy of the model calls."""
+
+    def setUp(self):
+        self.metrics = RetryMetrics()
+        self.sleep = mock.patch("time.sleep").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def policy(self, **kwargs):
+        return RetryPolicy(metrics=self.metrics, **kwargs)
+
+    def test_client_errors_are_not_retried(self):
+        func = mock.Mock(side_effect=exceptions.BadRequest("bad prompt"))
+        with self.assertRaises(exceptions.BadRequest):
+            self.policy().call(func)
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(self.metrics.snapshot()["not_retryable"], 1)
+
+    def test_throttling_is_retried_with_bounded_jitter(self):
+        func = mock.Mock(
+            side_effect=[exceptions.TooManyRequests("quota")] * 3 + ["ok"]
+        )
+        self.assertEqual(self.policy(base_delay=1, max_delay=3).call(func), "ok")
+        delays = [c.args[0] for c in self.sleep.call_args_list]
+        self.assertEqual(len(delays), 3)
+        for delay, ceiling in zip(delays, (1, 2, 3)):
+            self.assertTrue(0 <= delay <= ceiling)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual((snapshot["attempts"], snapshot["retries"]), (4, 3))
+        self.assertEqual(snapshot["retry_ratio"], 0.75)
+
+    def test_attempts_are_bounded(self):
+        func = mock.Mock(side_effect=exceptions.ServiceUnavailable("down"))
+        with self.assertRaises(exceptions.ServiceUnavailable):
+            self.policy(max_attempts=3).call(func)
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(self.metrics.snapshot()["exhausted"], 1)
+
+    def test_retry_after_is_honored_within_the_deadline(self):
+        error = exceptions.TooManyRequests(
+            "quota", response=mock.Mock(headers={"Retry-After": "7"})
+        )
+        func = mock.Mock(side_effect=[error, "ok"])
+        self.assertEqual(self.policy(deadline=10).call(func), "ok")
+        self.sleep.assert_called_once_with(7.0)
+
+        func = mock.Mock(side_effect=[error, "ok"])
+        with self.assertRaises(exceptions.TooManyRequests):
+            self.policy(deadline=5).call(func)
+        self.assertEqual(self.metrics.snapshot()["deadline_exceeded"], 1)
+
+    def test_async_calls_sleep_on_the_event_loop(self):
+        func = mock.AsyncMock(side_effect=[TimeoutError(), "ok"])
+        with mock.patch("asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            result = asyncio.run(self.policy().call_async(func))
+        self.assertEqual(result, "ok")
+        sleep.assert_awaited_once()
+        self.sleep.assert_not_called()
+
+
+class TestContextCache(unittest.TestCase):
+    """Test cases for the context cache manager."""
+
+    def setUp(self):
+        self.cached_content = mock.patch.object(
+            context_cache.caching, "CachedContent"
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+        self.cached_content.create.side_effect = lambda **kwargs: mock.Mock(
+            resource_name=f"caches/{kwargs['display_name']}"
+        )
+        self.clock = mock.patch("time.monotonic", return_value=1000.0).start()
+        self.manager = ContextCacheManager(ttl_seconds=600, refresh_margin_seconds=60)
+
+    def test_split_template_keeps_the_prompt(self):
+        prefix, question_part = split_prompt_template(DC_PROMPT_TEMPLATE)
+        kwargs = {"SCHEMA": "s", "BQ_DATA_PROJECT_ID": "p"}
+        self.assertEqual(
+            prefix.format(**kwargs) + question_part.format(QUESTION="q"),
+            DC_PROMPT_TEMPLATE.format(QUESTION="q", **kwargs),
+        )
+        self.assertNotIn("{SCHEMA}", question_part)
+
+    def test_cache_is_created_once_and_refreshed_before_expiry(self):
+        name = self.manager.cache_name("m", "dc", "prefix")
+        self.assertEqual(self.manager.cache_name("m", "dc", "prefix"), name)
+        self.cached_content.create.assert_called_once()
+
+        self.clock.return_value += 580
+        self.assertEqual(self.manager.cache_name("m", "dc", "prefix"), name)
+        self.cached_content.return_value.update.assert_called_once()
+        self.cached_content.create.assert_called_once()
+
+    def test_changed_prefix_replaces_the_cache(self):
+        old_name = self.manager.cache_name("m", "dc", "schema v1")
+        new_name = self.manager.cache_name("m", "dc", "schema v2")
+        self.assertNotEqual(old_name, new_name)
+        self.cached_content.assert_called_with(cached_content_name=old_name)
+        self.cached_content.return_value.delete.assert_called_once()
+        # Other templates keep their own cache.
+        self.manager.cache_name("m", "qp", "schema v2")
+        self.assertEqual(self.manager.stats["created"], 3)
+
+    def test_calls_do_not_wait_for_a_cache_being_created(self):
+        concurrent_names = []
+
+        def create(**kwargs):
+            # The lock is not held: a concurrent call returns at once.
+            concurrent_names.append(self.manager.cache_name("m", "dc", "prefix"))
+            return mock.Mock(resource_name="caches/dc")
+
+        self.cached_content.create.side_effect = create
+        self.assertEqual(self.manager.cache_name("m", "dc", "prefix"), "caches/dc")
+        self.assertEqual(concurrent_names, [None])
+        self.cached_content.create.assert_called_once()
+        self.assertEqual(self.manager.cache_name("m", "dc", "prefix"), "caches/dc")
+
+    def test_failed_creation_backs_off(self):
+        self.cached_content.create.side_effect = ValueError("too few tokens")
+        self.assertIsNone(self.manager.cache_name("m", "dc", "short"))
+        self.assertIsNone(self.manager.cache_name("m", "dc", "short"))
+        self.cached_content.create.assert_called_once()
+        self.assertIsNone(ContextCacheManager(ttl_seconds=0).cache_name("m", "dc", "p"))
+
+
+class TestSqlTranslatorCache(unittest.TestCase):
+    """Test cases for the schema and query caches of the SQL translator."""
+
+    DDL = "CREATE TABLE `p.ds.t` (\n  a INT64,\n  s STRING\n);\n"
+
+    def setUp(self):
+        SqlTranslator._schema_cache.clear()
+        SqlTranslator._query_cache.clear()
+
+    def test_schema_is_converted_once(self):
+        with mock.patch.object(
+            SqlTranslator,
+            "extract_schema_from_ddls",
+            wraps=SqlTranslator.extract_schema_from_ddls,
+        ) as extract:
+            first = SqlTranslator.rewrite_schema_for_sqlglot(self.DDL)
+            second = SqlTranslator.rewrite_schema_for_sqlglot(str(self.DDL))
+        self.assertIs(first, second)
+        self.assertEqual(first, {"p": {"ds": {"t": {"a": "INT64", "s": "STRING"}}}})
+        extract.assert_called_once()
+        self.assertIs(
+            SqlTranslator.mapping_schema(first, "BigQuery"),
+            SqlTranslator.mapping_schema(first, "bigquery"),
+        )
+
+    def test_query_checks_are_memoized_per_schema(self):
+        schema = SqlTranslator.rewrite_schema_for_sqlglot(self.DDL)
+        check = lambda sql, schema_dict: SqlTranslator._check_for_errors(
+            sql, "bigquery", db="ds", catalog="p", schema_dict=schema_dict
+        )
+        with mock.patch(
+            "sqlglot.optimizer.optimize", wraps=sqlglot.optimizer.optimize
+        ) as optimize:
+            errors, sql = check("SELECT a FROM t", schema)
+            self.assertEqual(check("SELECT a FROM t", schema), (errors, sql))
+            self.assertEqual(optimize.call_count, 1)
+            # Another schema may resolve the query differently.
+            errors, _ = check("SELECT a FROM t", {"p": {"ds": {"t": {"b": "INT64"}}}})
+        self.assertIsNone(check("SELECT a FROM t", schema)[0])
+        self.assertIn("could not be resolved", errors)
+        self.assertEqual(optimize.call_count, 2)
+
+    def test_bq_schema_and_samples_is_prepared_once(self):
+        translator = SqlTranslator(process_input_errors=True)
+        with mock.patch.object(
+            SqlTranslator,
+            "format_bq_schema_and_samples",
+            wraps=SqlTranslator.format_bq_schema_and_samples,
+        ) as convert, mock.patch.object(
+            translator._model, "call_parallel"
+        ) as call_llm:
+            SqlTranslator.prepare_schema(SCHEMA, "v1")
+            for _ in range(2):
+                sql = translator.translate(
+                    "SELECT YrSold FROM train",
+                    db="ds",
+                    catalog="p",
+                    ddl_schema=SCHEMA,
+                    fingerprint="v1",
+                )
+        self.assertEqual(
+            sql, "SELECT `train`.`yrsold` AS `yrsold` FROM `p`.`ds`.`train` AS `train`"
+        )
+        convert.assert_called_once()
+        call_llm.assert_not_called()
+        self.assertEqual(
+            SqlTranslator.rewrite_schema_for_sqlglot(SCHEMA),
+            {"p": {"ds": {"train": {"YrSold": "INT64", "City": "STRING"}}}},
+        )
+
+    def test_translate_many_corrects_only_the_failing_queries(self):
+        translator = SqlTranslator(process_input_errors=True)
+        queries = ["SELECT YrSold FROM train", "SELECT Year FROM train", "SELECT a FROM"]
+        with mock.patch.object(
+            translator._model,
+            "call_parallel",
+            return_value=["SELECT City FROM train", "Timeout"],
+        ) as call_llm:
+            results = translator.translate_many(
+                queries, db="ds", catalog="p", ddl_schema=SCHEMA, max_workers=2
+            )
+        prompts = call_llm.call_args.args[0]
+        self.assertEqual(len(prompts), 2)
+        self.assertIn("SELECT Year FROM train", prompts[0])
+        self.assertEqual([r.sql_query for r in results], queries)
+        self.assertEqual([r.corrected for r in results], [False, True, False])
+        self.assertEqual(results[1].translated, "SELECT City FROM train")
+        self.assertIsNone(results[0].errors)
+        self.assertEqual(
+            set(results[1].timings), {"check", "repair", "correct", "transpile"}
+        )
+        # The uncorrected query is translated as is, and fails to transpile.
+        self.assertIsNone(results[2].translated)
+        self.assertIsNotNone(results[2].error)
+
+    def test_translate_many_rechecks_the_corrected_queries(self):
+        translator = SqlTranslator(
+            process_input_errors=True, process_tool_output_errors=True
+        )
+        queries = ["SELECT YrSold FROM train", "SELECT Year FROM train"]
+        with mock.patch.object(
+            translator._model,
+            "call_parallel",
+            side_effect=lambda prompts, **kwargs: ["SELECT City FROM train"] * len(prompts),
+        ):
+            single = [
+                translator.translate(q, db="ds", catalog="p", ddl_schema=SCHEMA)
+                for q in queries
+            ]
+            results = translator.translate_many(
+                queries, db="ds", catalog="p", ddl_schema=SCHEMA, max_workers=1
+            )
+        self.assertEqual(results[0].translated, single[0])
+        self.assertEqual(
+            results[1].translated,
+            "SELECT `train`.`city` AS `city` FROM `p`.`ds`.`train` AS `train`",
+        )
+        self.assertIn("output_check", results[1].timings)
+        self.assertIsNone(results[1].output_errors)
+
+    def test_lru_cache_is_bounded(self):
+        cache = _LruCache(max_entries=2)
+        for key in ("a", "b", "a", "c"):
+            cache.get_or_compute(key, key.upper)
+        self.assertEqual(cache.get_or_compute("a", lambda: "new"), "A")
+        self.assertEqual(cache.get_or_compute("b", lambda: "new"), "new")
+        self.assertEqual(dict(cache.stats), {"hits": 2, "misses": 4})
+
+
+class TestSqlRepair(unittest.TestCase):
+    """Test cases for the rule-based repairs before the LLM correction."""
+
+    def setUp(self):
+        SqlTranslator._query_cache.clear()
+        self.schema = SqlTranslator.rewrite_schema_for_sqlglot(SCHEMA)
+        self.engine = SqlRepairEngine()
+
+    def repair(self, sql_query):
+        check = lambda sql: SqlTranslator._check_for_errors(
+            sql, "bigquery", db="ds", catalog="p", schema_dict=self.schema
+        )
+        errors, sql_query = check(sql_query)
+        self.assertIsNotNone(errors)
+        return self.engine.repair(sql_query, errors, self.schema, check)
+
+    def test_names_are_matched_against_the_schema(self):
+        self.assertEqual(
+            self.repair("SELECT YRSOLD FROM `Train`"),
+            (None, "SELECT `train`.`yrsold` AS `yrsold` FROM `p`.`ds`.`train` AS `train`"),
+        )
+        self.assertIsNone(self.repair("SELECT T2.City FROM train AS T1")[0])
+        rates = self.engine.hit_rates()
+        self.assertEqual(rates["drop_unknown_qualifiers"]["hit_rate"], 1.0)
+        self.assertEqual(self.engine.stats["repaired"], 2)
+
+    def test_doubled_quotes_are_escaped_and_empty_strings_kept(self):
+        self.assertEqual(
+            SqlTranslator._apply_heuristics("WHERE City = 'O''Hare' OR City = ''"),
+            "WHERE City = 'O\\'Hare' OR City = ''",
+        )
+
+    def test_tables_are_qualified_from_the_schema(self):
+        check = lambda sql: SqlTranslator._check_for_errors(
+            sql, "bigquery", schema_dict=self.schema
+        )
+        errors, _ = check("SELECT CITY FROM train")
+        self.assertIn("not qualified", errors)
+        self.assertEqual(
+            self.engine.repair("SELECT CITY FROM train", errors, self.schema, check),
+            (None, "SELECT `train`.`city` AS `city` FROM `p`.`ds`.`train` AS `train`"),
+        )
+        self.assertEqual(self.engine.stats["qualify_tables.fixed"], 1)
+
+    def test_columns_are_matched_in_their_own_scope(self):
+        schema = {
+            "train": {"YrSold": "INT64", "City": "STRING"},
+            "cities": {"Name": "STRING", "State": "STRING"},
+        }
+        sql = "SELECT c.CITY FROM train AS t JOIN cities AS c ON t.City = c.Name"
+        errors = "Column 'CITY' could not be resolved for table: 'c'"
+        self.assertIsNone(match_column_names(sql, errors, repair_schema(schema)))
+        self.assertEqual(
+            match_column_names(
+                "SELECT t.CITY FROM train AS t JOIN cities AS c ON t.City = c.Name",
+                "Column 'CITY' could not be resolved for table: 't'",
+                repair_schema(schema),
+            ),
+            "SELECT t.City FROM train AS t JOIN cities AS c ON t.City = c.Name",
+        )
+
+    def test_misspelled_names_are_left_to_the_llm(self):
+        schema = repair_schema({"sales_2023": {"amount": "FLOAT64"}})
+        self.assertIsNone(
+            match_table_names("SELECT amount FROM sales_2024", "", schema)
+        )
+        self.assertIsNone(
+            match_column_names(
+                "SELECT amount_usd FROM sales_2023",
+                "Column 'amount_usd' could not be resolved",
+                schema,
+            )
+        )
+
+    def test_rewrites_that_do_not_pass_are_dropped(self):
+        sql = "SELECT Year FROM Trains"
+        errors, repaired = self.repair(sql)
+        self.assertEqual(repaired, sql)
+        self.assertIn("could not be resolved", errors)
+        self.assertEqual(self.engine.stats["repaired"], 0)
+
+    def test_unrepairable_queries_go_to_the_llm(self):
+        translator = SqlTranslator(process_input_errors=True)
+        with mock.patch.object(
+            translator._model, "call_parallel", return_value=["SELECT City FROM train"]
+        ) as call_llm:
+            self.assertEqual(
+                translator.translate(
+                    "SELECT T2.CITY FROM train AS T1", db="ds", catalog="p", ddl_schema=SCHEMA
+                ),
+                "SELECT `t1`.`city` AS `city` FROM `p`.`ds`.`train` AS `t1`",
+            )
+            call_llm.assert_not_called()
+            translator.translate(
+                "SELECT Year FROM train", db="ds", catalog="p", ddl_schema=SCHEMA
+            )
+        call_llm.assert_called_once()
+
+
+class TestPartitionRewriter(unittest.TestCase):
+    """Test cases for the partition-aware rewriting of generated SQL."""
+
+    TODAY = datetime.date(2025, 3, 12)
+    SCHEMA = {
+        "p.ds.events": {
+            "table_schema": [
+                ("event_date", "DATE"),
+                ("user_id", "STRING"),
+                ("created_at", "TIMESTAMP"),
+            ],
+            "partitioning": {
+                "type": "DAY",
+                "field": "event_date",
+                "require_filter": False,
+            },
+            "clustering": ["user_id"],
+        },
+        "p.ds.logs": {
+            "table_schema": [("msg", "STRING")],
+            "partitioning": {
+                "type": "DAY",
+                "field": "_PARTITIONTIME",
+                "require_filter": True,
+            },
+            "clustering": None,
+        },
+    }
+
+    def setUp(self):
+        self.rewriter = PartitionRewriter(self.SCHEMA)
+
+    def test_year_filters_become_ranges(self):
+        result = self.rewriter.rewrite(
+            "SELECT COUNT(*) FROM `p.ds.events`"
+            " WHERE EXTRACT(YEAR FROM event_date) = 2024"
+        )
+        self.assertEqual(
+            result.sql,
+            "SELECT COUNT(*) FROM `p.ds.events`"
+            " WHERE (event_date >= CAST('2024-01-01' AS DATE)"
+            " AND event_date < CAST('2025-01-01' AS DATE))",
+        )
+        self.assertEqual(result.warnings, [])
+
+    def test_time_range_of_the_question_is_only_a_hint(self):
+        sql = "SELECT user_id FROM `p.ds.events` AS e LIMIT 10"
+        result = self.rewriter.rewrite(
+            sql, "Active users in the last 2 weeks", self.TODAY
+        )
+        self.assertFalse(result.changed)
+        self.assertEqual(result.sql, sql)
+        self.assertEqual(len(result.warnings), 1)
+        self.assertIn("[2025-02-24, 2025-03-13)", result.warnings[0])
+
+    def test_explicit_period_filters_the_only_date_column(self):
+        schema = {
+            "p.ds.orders": {
+                "table_schema": [("order_date", "DATE"), ("amount", "FLOAT64")],
+                "partitioning": {
+                    "type": "DAY",
+                    "field": "order_date",
+                    "require_filter": False,
+                },
+                "clustering": None,
+            }
+        }
+        rewriter = PartitionRewriter(schema)
+        result = rewriter.rewrite(
+            "SELECT SUM(amount) FROM `p.ds.orders` AS o WHERE amount > 0",
+            "Total order amount in March 2024",
+            self.TODAY,
+        )
+        self.assertEqual(
+            result.sql,
+            "SELECT SUM(amount) FROM `p.ds.orders` AS o WHERE amount > 0"
+            " AND (o.order_date >= CAST('2024-03-01' AS DATE)"
+            " AND o.order_date < CAST('2024-04-01' AS DATE))",
+        )
+        self.assertEqual(result.warnings, [])
+
+        # Relative ranges, several years and tables with other date columns
+        # are left to the model.
+        for question in (
+            "Total order amount in the last 30 days",
+            "Total order amount in 2023 and 2024",
+        ):
+            sql = "SELECT SUM(amount) FROM `p.ds.orders`"
+            self.assertEqual(rewriter.rewrite(sql, question, self.TODAY).sql, sql)
+        self.assertFalse(
+            self.rewriter.rewrite(
+                "SELECT COUNT(*) FROM `p.ds.events`", "Events in 2024", self.TODAY
+            ).changed
+        )
+
+    def test_period_filtered_through_another_column_is_kept(self):
+        schema = {
+            "p.d.sales": {
+                "table_schema": [("YrSold", "INT64"), ("load_date", "DATE")],
+                "partitioning": {
+                    "type": "DAY",
+                    "field": "load_date",
+                    "require_filter": False,
+                },
+                "clustering": None,
+            }
+        }
+        sql = "SELECT COUNT(*) FROM p.d.sales WHERE YrSold = 2008"
+        result = PartitionRewriter(schema).rewrite(
+            sql, "How many houses were sold in 2008?", self.TODAY
+        )
+        self.assertFalse(result.changed)
+        self.assertEqual(result.sql, sql)
+        self.assertIn("load_date", result.warnings[0])
+
+    def test_full_scans_are_flagged(self):
+        tool_context = mock.Mock(
+            state={"database_settings": {"bq_schema_and_samples": self.SCHEMA}}
+        )
+        tool = rewrite_for_partitions(
+            lambda question, tool_context: "SELECT msg FROM `p.ds.logs`"
+        )
+        sql = tool("Show all log messages", tool_context)
+        self.assertEqual(sql, "SELECT msg FROM `p.ds.logs`")
+        self.assertEqual(tool_context.state["sql_query"], sql)
+        (warning,) = tool_context.state["partition_rewrite"]["warnings"]
+        self.assertTrue(warning.startswith("Full scan of partitioned table p.ds.logs"))
+        self.assertIn("rejects queries", warning)
+        result = self.rewriter.rewrite(
+            "SELECT msg FROM `p.ds.logs` WHERE _PARTITIONTIME > '2025-01-01'"
+        )
+        self.assertEqual(result.warnings, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
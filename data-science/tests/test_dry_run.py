@@ -0,0 +1,94 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the dry-run validation of execute_sql queries."""
+
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery import agent
+from data_science.sub_agents.bigquery.dry_run import LocalDryRun, QueryValidator
+
+GIB = 1024**3
+SCHEMA = {
+    "p.house_prices.train": {
+        "Id": "INT64",
+        "YrSold": "INT64",
+        "City": "STRING",
+        "SalePrice": "FLOAT64",
+    }
+}
+
+
+class TestDryRun(unittest.TestCase):
+    """Test cases for the dry-run validator."""
+
+    def setUp(self):
+        self.backend = LocalDryRun(SCHEMA, {"p.house_prices.train": 4 * GIB})
+        self.validator = QueryValidator(self.backend, max_bytes_processed=2 * GIB)
+
+    def test_bytes_are_estimated_per_column(self):
+        self.assertEqual(
+            self.backend.dry_run(
+                "p", "SELECT YrSold FROM `p.house_prices.train`"
+            ).total_bytes_processed,
+            GIB,
+        )
+        self.assertEqual(
+            self.backend.dry_run(
+                "p",
+                "WITH t AS (SELECT * FROM house_prices.train) SELECT City FROM t",
+            ).total_bytes_processed,
+            4 * GIB,
+        )
+
+    def test_invalid_and_expensive_queries_are_rejected(self):
+        self.assertIsNone(
+            self.validator.validate("p", "SELECT City FROM `p.house_prices.train`")
+        )
+        over_budget = self.validator.validate(
+            "p", "SELECT * FROM `p.house_prices.train`"
+        )
+        invalid = self.validator.validate(
+            "p", "SELECT Year FROM `p.house_prices.train`"
+        )
+        self.assertEqual(over_budget["status"], "ERROR")
+        self.assertIn("more than the budget of 2.00 GiB", over_budget["error_details"])
+        self.assertIn("could not be resolved", invalid["error_details"])
+        self.assertEqual(self.validator.stats["over_budget"], 1)
+        self.assertEqual(self.validator.stats["invalid"], 1)
+
+    def test_callback_validates_execute_sql_calls(self):
+        tool = mock.Mock()
+        tool.name = "execute_sql"
+        args = {"project_id": "p", "query": "SELECT * FROM `p.house_prices.train`"}
+        with mock.patch.object(
+            agent, "get_query_validator", return_value=self.validator
+        ):
+            response = asyncio.run(agent.validate_query(tool, args, mock.Mock()))
+            self.assertIsNone(
+                asyncio.run(
+                    agent.validate_query(tool, {**args, "dry_run": True}, mock.Mock())
+                )
+            )
+        self.assertEqual(response["status"], "ERROR")
+
+
+if __name__ == "__main__":
+    unittest.main()
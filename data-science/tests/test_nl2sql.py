@@ -0,0 +1,273 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the baseline NL2SQL tool, its streaming and the NL2SQL cache."""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery import nl2sql_cache, tools
+from data_science.sub_agents.bigquery.nl2sql_cache import (
+    InMemoryNl2SqlCacheBackend,
+    Nl2SqlCache,
+    SqliteNl2SqlCacheBackend,
+    cache_nl2sql,
+)
+from data_science.utils.streaming import FencedBlockParser
+
+SCHEMA = {
+    "p.house_prices.train": {
+        "table_schema": [("YrSold", "INT64")],
+        "example_values": {"YrSold": ["2008"]},
+    }
+}
+
+
+class TestBaselineNl2Sql(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the baseline initial_bq_nl2sql tool."""
+
+    def setUp(self):
+        self.tool_context = mock.Mock(
+            state={"database_settings": {"bq_schema_and_samples": SCHEMA}}
+        )
+
+    def _streamed(self, chunks, delay=0.0):
+        """Returns a fake `generate_content_stream` that yields the chunks."""
+        self.read = []
+
+        async def stream():
+            for chunk in chunks:
+                await asyncio.sleep(delay)
+                self.read.append(chunk)
+                yield mock.Mock(text=chunk)
+
+        async def generate_content_stream(**kwargs):
+            return stream()
+
+        return generate_content_stream
+
+    async def _slow_generate_content(self, **kwargs):
+        return await self._streamed(
+            ["```sql\nSELECT DISTINCT YrSold", " FROM `p.house_prices.train`\n```"],
+            delay=0.1,
+        )()
+
+    async def test_concurrent_calls_do_not_block_the_event_loop(self):
+        with mock.patch.object(
+            nl2sql_cache, "get_nl2sql_cache", return_value=None
+        ), mock.patch.object(
+            tools.llm_client.aio.models,
+            "generate_content_stream",
+            side_effect=self._slow_generate_content,
+        ):
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            results = await asyncio.gather(
+                *[
+                    tools.initial_bq_nl2sql("What years were houses sold?", self.tool_context)
+                    for _ in range(5)
+                ]
+            )
+            elapsed = loop.time() - start
+
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(
+            results, ["SELECT DISTINCT YrSold FROM `p.house_prices.train`"] * 5
+        )
+        self.assertEqual(self.tool_context.state["sql_query"], results[0])
+
+    async def test_repeated_question_skips_the_model(self):
+        cache = Nl2SqlCache(InMemoryNl2SqlCacheBackend())
+        generate = mock.AsyncMock(side_effect=self._slow_generate_content)
+        with mock.patch.object(
+            nl2sql_cache, "get_nl2sql_cache", return_value=cache
+        ), mock.patch.object(
+            tools.llm_client.aio.models, "generate_content_stream", generate
+        ):
+            first = await tools.initial_bq_nl2sql(
+                "What years were houses sold?", self.tool_context
+            )
+            self.tool_context.state["sql_query"] = None
+            second = await tools.initial_bq_nl2sql(
+                "  what years were houses  SOLD ", self.tool_context
+            )
+            self.assertEqual(generate.await_count, 1)
+            self.assertEqual(second, first)
+            self.assertEqual(self.tool_context.state["sql_query"], first)
+
+            # A different schema must not be answered from the cache.
+            self.tool_context.state["database_settings"]["bq_schema_fingerprint"] = "v2"
+            await tools.initial_bq_nl2sql(
+                "What years were houses sold?", self.tool_context
+            )
+            self.assertEqual(generate.await_count, 2)
+        self.assertEqual(cache.stats["hits"], 1)
+
+    async def _generate(self, chunks):
+        with mock.patch.object(
+            nl2sql_cache, "get_nl2sql_cache", return_value=None
+        ), mock.patch.object(
+            tools.llm_client.aio.models,
+            "generate_content_stream",
+            side_effect=self._streamed(chunks),
+        ):
+            return await tools.initial_bq_nl2sql("Which years?", self.tool_context)
+
+    async def test_stream_stops_at_the_closing_fence(self):
+        sql = await self._generate(
+            [
+                "Step 1: find the years.\n```sql\nSELECT YrSold\n",
+                "FROM `p.house_prices.train`\n```\n",
+                "Explanation: this query ...",
+            ]
+        )
+        self.assertEqual(sql, "SELECT YrSold\nFROM `p.house_prices.train`")
+        self.assertEqual(len(self.read), 2)
+        self.assertEqual(
+            self.tool_context.state["nl2sql_progress"]["stage"], "done"
+        )
+
+    async def test_stream_stops_at_the_first_complete_statement(self):
+        sql = await self._generate(
+            [
+                "```sql\nSELECT YrSold FROM t WHERE c = 'a;b' -- x;\n",
+                "AND d = 1;\nSELECT",
+                " 2;\n```",
+            ]
+        )
+        self.assertEqual(sql, "SELECT YrSold FROM t WHERE c = 'a;b' -- x;\nAND d = 1;")
+        self.assertEqual(len(self.read), 2)
+
+
+class TestFencedBlockParser(unittest.TestCase):
+    """Test cases for the incremental code block parser."""
+
+    def test_block_is_found_across_chunks(self):
+        parser = FencedBlockParser(languages=("sql",))
+        stages = []
+        for chunk in ["Plan:\n```py", "thon\nx = 1\n```\n``", "`SQL\nSELECT 1\n`", "``"]:
+            closed = parser.feed(chunk)
+            stages.append(parser.stage)
+        self.assertTrue(closed)
+        self.assertEqual(stages, ["preamble", "preamble", "code", "complete"])
+        self.assertEqual(parser.result(), "SELECT 1")
+
+    def test_text_without_a_block_is_kept(self):
+        parser = FencedBlockParser(languages=("python", "py", ""))
+        parser.feed("import pandas as pd\n")
+        parser.feed("print(pd.__version__)")
+        self.assertEqual(parser.stage, "preamble")
+        self.assertEqual(parser.result(), "import pandas as pd\nprint(pd.__version__)")
+
+
+class TestNl2SqlCache(unittest.TestCase):
+    """Test cases for the NL2SQL cache."""
+
+    @staticmethod
+    def _embed(text):
+        vocabulary = ["year", "house", "sold", "price", "city"]
+        return [float(word in text) for word in vocabulary]
+
+    def test_similar_question_is_answered_from_the_cache(self):
+        cache = Nl2SqlCache(
+            InMemoryNl2SqlCacheBackend(), similarity_threshold=0.9, embed=self._embed
+        )
+        cache.store("ns", "Which year were houses sold?", "SELECT 1")
+        self.assertEqual(cache.lookup("ns", "In which year was a house sold"), "SELECT 1")
+        self.assertIsNone(cache.lookup("ns", "What is the average price per city?"))
+        self.assertIsNone(cache.lookup("other", "Which year were houses sold?"))
+        self.assertEqual(cache.stats["similar_hits"], 1)
+
+    def test_sqlite_backend_persists_and_evicts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "nl2sql.db")
+            backend = SqliteNl2SqlCacheBackend(path, max_entries=2)
+            for i in range(3):
+                backend.put("ns", f"k{i}", {"sql": f"SELECT {i}"})
+                time.sleep(0.01)
+            backend.get("k1")
+
+            reopened = SqliteNl2SqlCacheBackend(path, max_entries=2)
+            self.assertIsNone(reopened.get("k0"))
+            self.assertEqual(reopened.get("k2"), {"sql": "SELECT 2"})
+            self.assertEqual(len(reopened.entries("ns")), 2)
+
+            expired = SqliteNl2SqlCacheBackend(path, ttl_seconds=-1)
+            expired.put("ns", "k3", {"sql": "SELECT 3"})
+            self.assertIsNone(expired.get("k3"))
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = InMemoryNl2SqlCacheBackend(max_entries=2)
+        backend.put("ns", "a", {"sql": "a"})
+        backend.put("ns", "b", {"sql": "b"})
+        backend.get("a")
+        backend.put("ns", "c", {"sql": "c"})
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), {"sql": "a"})
+
+    def test_sync_tools_are_wrapped(self):
+        calls = []
+
+        @cache_nl2sql("chase", lambda _: "model")
+        def generate(question, tool_context):
+            calls.append(question)
+            return "SELECT 1"
+
+        tool_context = mock.Mock(
+            state={"database_settings": {"bq_schema_and_samples": SCHEMA}}
+        )
+        cache = Nl2SqlCache(InMemoryNl2SqlCacheBackend())
+        with mock.patch.object(nl2sql_cache, "get_nl2sql_cache", return_value=cache):
+            generate("q", tool_context)
+            generate("Q?", tool_context)
+        self.assertEqual(calls, ["q"])
+
+
+    def test_failed_generations_are_not_cached(self):
+        results = iter(["Timeout", "Error after retries: 503", "SELECT 1"])
+        calls = []
+
+        @cache_nl2sql("chase", lambda _: "model")
+        async def generate(question, tool_context):
+            calls.append(question)
+            return next(results)
+
+        tool_context = mock.Mock(
+            state={"database_settings": {"bq_schema_and_samples": SCHEMA}}
+        )
+        cache = Nl2SqlCache(InMemoryNl2SqlCacheBackend())
+        with mock.patch.object(nl2sql_cache, "get_nl2sql_cache", return_value=cache):
+            for _ in range(4):
+                asyncio.run(generate("q", tool_context))
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(cache.stats["hits"], 1)
+
+    def test_only_single_queries_are_cacheable(self):
+        self.assertTrue(
+            nl2sql_cache.is_cacheable_sql("WITH a AS (SELECT 1) SELECT * FROM a")
+        )
+        self.assertFalse(nl2sql_cache.is_cacheable_sql("Unhandled Error"))
+        self.assertFalse(nl2sql_cache.is_cacheable_sql("SELECT 1; SELECT 2"))
+        self.assertFalse(nl2sql_cache.is_cacheable_sql("DROP TABLE t"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the handoff of query results as artifacts."""
+
+import asyncio
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery import agent, result_export
+from data_science.utils.result_artifacts import (
+    QUERY_RESULT_SUMMARY,
+    data_context,
+    load_query_result,
+    rows_to_table,
+    summarize,
+    write_parquet,
+)
+
+ROWS = [
+    {"YrSold": 2006 + i % 5, "City": f"city-{i % 3}", "Price": 100.0 * i}
+    for i in range(1000)
+]
+
+
+class FakeContext:
+    """Stands in for a tool context with an in-memory artifact service."""
+
+    def __init__(self, artifact_service=True):
+        self.state = {}
+        self.artifacts = {} if artifact_service else None
+
+    async def save_artifact(self, filename, artifact):
+        if self.artifacts is None:
+            raise ValueError("Artifact service is not initialized.")
+        versions = self.artifacts.setdefault(filename, [])
+        versions.append(artifact)
+        return len(versions) - 1
+
+    async def load_artifact(self, filename, version=None):
+        return self.artifacts[filename][-1 if version is None else version]
+
+
+class TestResultArtifacts(unittest.TestCase):
+    """Test cases for the query result artifacts."""
+
+    def store(self, context, rows=ROWS):
+        tool = mock.Mock()
+        tool.name = "execute_sql"
+        with mock.patch.object(agent, "get_query_result_cache", return_value=None):
+            asyncio.run(
+                agent.store_results_in_context(
+                    tool, {}, context, {"status": "SUCCESS", "rows": rows}
+                )
+            )
+
+    def test_summary_is_bounded(self):
+        summary = summarize(rows_to_table(ROWS), head_rows=3)
+        self.assertEqual(summary["num_rows"], 1000)
+        self.assertEqual(len(summary["head"]), 3)
+        self.assertEqual(
+            summary["columns"][0],
+            {
+                "name": "YrSold",
+                "type": "int64",
+                "nulls": 0,
+                "min": 2006,
+                "max": 2010,
+                "mean": 2008.0,
+            },
+        )
+        self.assertEqual(summary["columns"][1]["distinct"], 3)
+        prompt = data_context({QUERY_RESULT_SUMMARY: {**summary, "artifact": "r"}})
+        self.assertLess(len(prompt), 1000)
+
+    def test_result_is_stored_once_as_parquet(self):
+        context = FakeContext()
+        self.store(context)
+        self.assertNotIn("query_result", context.state)
+        self.assertEqual(context.state[QUERY_RESULT_SUMMARY]["version"], 0)
+        data = asyncio.run(load_query_result(context))
+        self.assertEqual(pq.read_table(io.BytesIO(data)).to_pylist(), ROWS)
+        self.assertIn(
+            "pandas.read_parquet('query_result.parquet')", data_context(context.state)
+        )
+
+    def test_rows_stay_in_the_state_without_an_artifact_service(self):
+        context = FakeContext(artifact_service=False)
+        self.store(context, ROWS[:2])
+        self.assertEqual(context.state["query_result"], ROWS[:2])
+        self.assertIsNone(asyncio.run(load_query_result(context)))
+        self.assertIn("city-1", data_context(context.state))
+
+
+class FakeClient:
+    """Stands in for a BigQuery client whose results arrive in batches."""
+
+    def __init__(self, table, batch_size=100):
+        self.batches = table.to_batches(max_chunksize=batch_size)
+        self.batches_read = 0
+
+    def query(self, query, project=None):
+        return self
+
+    def result(self, page_size=None):
+        return self
+
+    def to_arrow_iterable(self, bqstorage_client=None):
+        self.bqstorage_client = bqstorage_client
+        for batch in self.batches:
+            self.batches_read += 1
+            yield batch
+
+
+class TestResultExport(unittest.TestCase):
+    """Test cases for the streaming export of query results."""
+
+    def export(self, query, client, context):
+        with mock.patch.object(
+            result_export, "get_bigquery_client", return_value=client
+        ), mock.patch.object(result_export, "bigquery_storage", None):
+            return asyncio.run(
+                result_export.export_query_result("p", query, context)
+            )
+
+    def test_summary_of_batches_matches_summary_of_table(self):
+        table = rows_to_table(ROWS)
+        data, summary = write_parquet(table.to_batches(max_chunksize=64), 1 << 30)
+        self.assertFalse(summary.pop("truncated"))
+        self.assertEqual(summary, summarize(table))
+        self.assertEqual(pq.read_table(io.BytesIO(data)), table)
+
+    def test_memory_ceiling_truncates_and_stops_reading(self):
+        table = rows_to_table(ROWS)
+        client = FakeClient(table)
+        data, summary = result_export.export_to_parquet(
+            client, "p", "SELECT 1", memory_limit=table.nbytes // 4
+        )
+        self.assertTrue(summary["truncated"])
+        self.assertLess(0, summary["num_rows"])
+        self.assertLess(summary["num_rows"], len(ROWS))
+        self.assertEqual(pq.read_table(io.BytesIO(data)).num_rows, summary["num_rows"])
+        self.assertLess(client.batches_read, len(client.batches))
+
+    def test_memory_ceiling_bounds_the_arrow_size_of_the_rows(self):
+        table = pa.table({"n": pa.array(range(1000), pa.int64())})
+        data, summary = write_parquet(table.to_batches(max_chunksize=100), 2000)
+        self.assertTrue(summary["truncated"])
+        # Two batches of 800 bytes, and 50 rows of 8 bytes of the third.
+        self.assertEqual(summary["num_rows"], 250)
+        self.assertEqual(pq.read_table(io.BytesIO(data)).num_rows, 250)
+
+    def test_full_result_is_exported_as_artifact(self):
+        context = FakeContext()
+        response = self.export(
+            "SELECT * FROM t", FakeClient(rows_to_table(ROWS)), context
+        )
+        self.assertEqual(response["status"], "SUCCESS")
+        self.assertEqual(response["num_rows"], len(ROWS))
+        self.assertNotIn("rows", response)
+        data = asyncio.run(load_query_result(context))
+        self.assertEqual(pq.read_table(io.BytesIO(data)).to_pylist(), ROWS)
+
+    def test_storage_read_client_is_closed(self):
+        client = FakeClient(rows_to_table(ROWS))
+        bigquery_storage = mock.Mock()
+        read_client = bigquery_storage.BigQueryReadClient.return_value
+        read_client.__enter__ = mock.Mock(return_value=read_client)
+        read_client.__exit__ = mock.Mock(return_value=False)
+        with mock.patch.object(result_export, "bigquery_storage", bigquery_storage):
+            _, summary = result_export.export_to_parquet(client, "p", "SELECT 1")
+        self.assertEqual(summary["num_rows"], len(ROWS))
+        self.assertIs(client.bqstorage_client, read_client)
+        read_client.__exit__.assert_called_once()
+
+    def test_rest_fallback_is_logged_once(self):
+        result_export._log_rest_fallback.cache_clear()
+        with self.assertLogs(level="WARNING") as logs:
+            for _ in range(2):
+                self.export(
+                    "SELECT * FROM t", FakeClient(rows_to_table(ROWS)), FakeContext()
+                )
+        self.assertEqual(
+            sum("REST API" in message for message in logs.output), 1
+        )
+
+    def test_only_queries_are_exported(self):
+        client = FakeClient(rows_to_table(ROWS))
+        response = self.export("DELETE FROM t WHERE TRUE", client, FakeContext())
+        self.assertEqual(response["status"], "ERROR")
+        self.assertEqual(client.batches_read, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the execute_sql result cache."""
+
+import datetime
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery.nl2sql_cache import InMemoryNl2SqlCacheBackend
+from data_science.sub_agents.bigquery import result_cache
+from data_science.sub_agents.bigquery.result_cache import (
+    QueryResultCache,
+    canonicalize_sql,
+)
+
+RESPONSE = {"status": "SUCCESS", "rows": [{"YrSold": 2008}]}
+
+
+class FakeBigQueryClient:
+    """Returns a configurable `modified` time per table, and views."""
+
+    def __init__(self, delay=0.0):
+        self.modified = {}
+        self.views = {}
+        self.delay = delay
+
+    def get_table(self, table_id):
+        time.sleep(self.delay)
+        return mock.Mock(
+            modified=self.modified.setdefault(
+                table_id, datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+            ),
+            table_type="VIEW" if table_id in self.views else "TABLE",
+            view_query=self.views.get(table_id),
+            mview_query=None,
+            view_use_legacy_sql=False,
+        )
+
+
+class TestResultCache(unittest.TestCase):
+    """Test cases for the query-result cache."""
+
+    def setUp(self):
+        self.client = FakeBigQueryClient()
+        self.cache = QueryResultCache(InMemoryNl2SqlCacheBackend(), client=self.client)
+
+    def test_canonicalize_sql(self):
+        first = canonicalize_sql(
+            "select YrSold  from `p.house_prices.train` -- years\n limit 10", "p"
+        )
+        second = canonicalize_sql(
+            "WITH t AS (SELECT * FROM house_prices.train)\nSELECT YrSold FROM t", "p"
+        )
+        self.assertEqual(
+            first,
+            ("SELECT YrSold FROM `p.house_prices.train` LIMIT 10", ["p.house_prices.train"]),
+        )
+        self.assertEqual(second[1], ["p.house_prices.train"])
+        self.assertIsNone(canonicalize_sql("SELECT CURRENT_DATE()", "p"))
+        self.assertIsNone(canonicalize_sql("SELECT * FROM train", "p"))
+        self.assertIsNone(canonicalize_sql("DELETE FROM d.t WHERE TRUE", "p"))
+
+    def test_repeated_query_is_served_until_a_table_changes(self):
+        query = "SELECT YrSold FROM `p.house_prices.train`"
+        self.assertIsNone(self.cache.lookup("call-1", "p", query))
+        self.cache.store("call-1", RESPONSE)
+
+        self.assertEqual(
+            self.cache.lookup("call-2", "p", "select YrSold\nfrom `p.house_prices.train`"),
+            RESPONSE,
+        )
+
+        self.client.modified["p.house_prices.train"] = datetime.datetime(
+            2025, 1, 2, tzinfo=datetime.timezone.utc
+        )
+        self.assertIsNone(self.cache.lookup("call-3", "p", query))
+        self.assertEqual(self.cache.stats["hits"], 1)
+        self.assertEqual(self.cache.stats["misses"], 2)
+
+    def test_views_are_served_until_a_base_table_changes(self):
+        self.client.views["p.house_prices.recent"] = (
+            "SELECT * FROM house_prices.train WHERE YrSold > 2008"
+        )
+        query = "SELECT YrSold FROM `p.house_prices.recent`"
+        self.cache.lookup("call-1", "p", query)
+        self.cache.store("call-1", RESPONSE)
+        self.assertEqual(self.cache.lookup("call-2", "p", query), RESPONSE)
+
+        # The view itself is unchanged.
+        self.client.modified["p.house_prices.train"] = datetime.datetime(
+            2025, 1, 2, tzinfo=datetime.timezone.utc
+        )
+        self.assertIsNone(self.cache.lookup("call-3", "p", query))
+
+        self.client.views["p.house_prices.today"] = (
+            "SELECT * FROM house_prices.train WHERE date = CURRENT_DATE()"
+        )
+        self.assertIsNone(
+            self.cache.lookup("call-4", "p", "SELECT * FROM `p.house_prices.today`")
+        )
+        self.assertEqual(self.cache.stats["uncacheable"], 1)
+
+    def test_errors_are_not_cached(self):
+        query = "SELECT YrSold FROM `p.house_prices.train`"
+        self.cache.lookup("call-1", "p", query)
+        self.cache.store("call-1", {"status": "ERROR", "error_details": "quota"})
+        self.assertIsNone(self.cache.lookup("call-2", "p", query))
+
+
+    def test_tables_are_looked_up_concurrently(self):
+        cache = QueryResultCache(
+            InMemoryNl2SqlCacheBackend(), client=FakeBigQueryClient(delay=0.2)
+        )
+        query = " UNION ALL ".join(
+            f"SELECT YrSold FROM `p.house_prices.t{i}`" for i in range(5)
+        )
+        start = time.monotonic()
+        cache.lookup("call-1", "p", query)
+        self.assertLess(time.monotonic() - start, 0.6)
+
+    def test_unanswered_lookups_are_bounded(self):
+        query = "SELECT YrSold FROM `p.house_prices.train`"
+        with mock.patch.object(result_cache, "_MAX_PENDING", 2):
+            for i in range(3):
+                self.cache.lookup(f"call-{i}", "p", query)
+        self.assertEqual(list(self.cache._pending), ["call-1", "call-2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
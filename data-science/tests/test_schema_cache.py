@@ -0,0 +1,255 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the BigQuery schema-and-samples cache."""
+
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+import pyarrow as pa
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from google.cloud import bigquery
+from data_science.sub_agents.bigquery import tools
+from data_science.sub_agents.bigquery.schema_cache import (
+    FileSchemaCacheBackend,
+    SchemaCache,
+    get_schema_cache_backend,
+)
+
+
+def _to_arrow(frame):
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+class FakeBigQueryClient:
+    """Minimal stand-in for the BigQuery client used by schema discovery."""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.partitioning = {}
+        self.forbidden = set()
+        self.queries = []
+        self.listed = []
+
+    def list_tables(self, dataset_ref, timeout=None):
+        return [mock.Mock(table_id=table_id) for table_id in self.tables]
+
+    def get_table(self, table_ref, timeout=None):
+        if table_ref.table_id in self.forbidden:
+            raise PermissionError(f"Access denied: {table_ref}")
+        etag, frame = self.tables[table_ref.table_id]
+        return mock.Mock(
+            reference=table_ref,
+            table_type="TABLE",
+            etag=etag,
+            modified=datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc),
+            schema=[
+                bigquery.SchemaField(name, "STRING") for name in frame.columns
+            ],
+            time_partitioning=self.partitioning.get(table_ref.table_id),
+            range_partitioning=None,
+            require_partition_filter=None,
+            clustering_fields=(
+                ["year"] if table_ref.table_id in self.partitioning else None
+            ),
+        )
+
+    def query(self, sql, timeout=None):
+        self.queries.append(sql)
+        table_id = sql.split("`")[-2].split(".")[-1]
+        rows = mock.Mock(to_arrow=mock.Mock(return_value=_to_arrow(self.tables[table_id][1])))
+        return mock.Mock(result=mock.Mock(return_value=rows))
+
+    def list_rows(self, table_info, max_results=None, timeout=None):
+        self.listed.append(table_info.reference.table_id)
+        frame = self.tables[table_info.reference.table_id][1]
+        return mock.Mock(to_arrow=mock.Mock(return_value=_to_arrow(frame.head(max_results))))
+
+
+class TestSchemaCache(unittest.TestCase):
+    """Test cases for the schema cache."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        self.cache = SchemaCache(FileSchemaCacheBackend(self.cache_dir.name))
+        os.environ["BQ_SAMPLING_METHOD"] = "query"
+        self.addCleanup(os.environ.pop, "BQ_SAMPLING_METHOD")
+        self.client = FakeBigQueryClient(
+            {
+                "train": ("etag-1", pd.DataFrame({"year": ["2008"]})),
+                "test": ("etag-1", pd.DataFrame({"name": ["it's"]})),
+            }
+        )
+        patcher = mock.patch.object(
+            tools, "get_bigquery_client", return_value=self.client
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_changed_tables_are_sampled(self):
+        """Unchanged tables are served from the snapshot on a second run."""
+        first = tools.get_bigquery_schema_and_samples(schema_cache=self.cache)
+        self.assertEqual(len(self.client.queries), 2)
+
+        self.client.tables["train"] = ("etag-2", pd.DataFrame({"year": ["2009"]}))
+        # A fresh cache object simulates another replica reading the snapshot.
+        cache = SchemaCache(FileSchemaCacheBackend(self.cache_dir.name))
+        second = tools.get_bigquery_schema_and_samples(schema_cache=cache)
+
+        self.assertEqual(len(self.client.queries), 3)
+        self.assertIn("train", self.client.queries[-1])
+        test_table = f"{tools.data_project}.{tools.dataset_id}.test"
+        self.assertEqual(second[test_table], first[test_table])
+        self.assertEqual(second[test_table]["table_schema"], [("name", "STRING")])
+        self.assertEqual(
+            second[f"{tools.data_project}.{tools.dataset_id}.train"]["example_values"],
+            {"year": ["'2009'"]},
+        )
+
+    def test_partitioning_and_clustering_are_captured(self):
+        self.client.partitioning["train"] = bigquery.TimePartitioning(type_="DAY")
+        tables = tools.get_bigquery_schema_and_samples(schema_cache=self.cache)
+        # Read back from the snapshot, which stores the entries as JSON.
+        cache = SchemaCache(FileSchemaCacheBackend(self.cache_dir.name))
+        cached = cache.load(f"{tools.data_project}.{tools.dataset_id}").tables_context()
+        train = f"{tools.data_project}.{tools.dataset_id}.train"
+        test = f"{tools.data_project}.{tools.dataset_id}.test"
+        self.assertEqual(
+            tables[train]["partitioning"],
+            {"type": "DAY", "field": "_PARTITIONTIME", "require_filter": False},
+        )
+        self.assertEqual(tables[train]["clustering"], ["year"])
+        self.assertIsNone(tables[test]["partitioning"])
+        self.assertEqual(cached[train], tables[train])
+
+    def test_fresh_snapshot_skips_bigquery(self):
+        """A snapshot younger than the max age is used without any API call."""
+        tools.get_bigquery_schema_and_samples(schema_cache=self.cache)
+        self.cache.max_age_seconds = 3600
+        with mock.patch.object(self.client, "list_tables") as list_tables:
+            tools.get_bigquery_schema_and_samples(schema_cache=self.cache)
+        list_tables.assert_not_called()
+
+    def test_unchanged_revalidation_restarts_the_max_age(self):
+        self.cache.max_age_seconds = 3600
+        with mock.patch("time.time", return_value=1000.0):
+            tools.get_bigquery_schema_and_samples(schema_cache=self.cache)
+        with mock.patch("time.time", return_value=5000.0):
+            tools.get_bigquery_schema_and_samples(schema_cache=self.cache)
+        self.assertEqual(len(self.client.queries), 2)
+        with mock.patch("time.time", return_value=6000.0), mock.patch.object(
+            self.client, "list_tables"
+        ) as list_tables:
+            tools.get_bigquery_schema_and_samples(schema_cache=self.cache)
+        list_tables.assert_not_called()
+
+    def test_memory_backend_is_shared(self):
+        self.assertIs(
+            get_schema_cache_backend("memory"), get_schema_cache_backend("memory")
+        )
+
+    def test_failing_table_does_not_fail_discovery(self):
+        """A forbidden table is skipped, or served from a stale snapshot entry."""
+        self.client.forbidden.add("test")
+        tables_context = tools.get_bigquery_schema_and_samples(
+            schema_cache=self.cache
+        )
+        self.assertEqual(
+            list(tables_context), [f"{tools.data_project}.{tools.dataset_id}.train"]
+        )
+
+        self.client.forbidden = {"train"}
+        tables_context = tools.get_bigquery_schema_and_samples(
+            schema_cache=self.cache, max_workers=1
+        )
+        self.assertEqual(len(tables_context), 2)
+
+    def test_sampling_method_is_selectable_per_dataset(self):
+        """Datasets can override the default sampling method."""
+        os.environ["BQ_SAMPLING_METHOD"] = "tablesample, sales=list_rows"
+        self.assertEqual(tools.get_sampling_method("p.sales"), "list_rows")
+        self.assertEqual(tools.get_sampling_method("p.other"), "tablesample")
+
+        os.environ["BQ_SAMPLING_METHOD"] = f"{tools.dataset_id}=list_rows"
+        tools.get_bigquery_schema_and_samples(schema_cache=self.cache)
+        self.assertEqual(sorted(self.client.listed), ["test", "train"])
+        self.assertEqual(self.client.queries, [])
+
+    def test_tablesample_projects_columns(self):
+        """TABLESAMPLE sampling names the columns instead of using `*`."""
+        tables_context = tools.get_bigquery_schema_and_samples(
+            schema_cache=self.cache, sampling_method="tablesample"
+        )
+        self.assertEqual(len(tables_context), 2)
+        self.assertTrue(
+            all("TABLESAMPLE SYSTEM" in q and "*" not in q for q in self.client.queries)
+        )
+
+
+class TestSampleSerialization(unittest.TestCase):
+    """Test cases for the column-typed sample value serializer."""
+
+    def test_columns_are_serialized_by_type(self):
+        rows = pa.table(
+            {
+                "name": ["it's", None],
+                "year": [2008, None],
+                "sold": [datetime.date(2008, 2, 1), None],
+                "tags": [["a", "b"], []],
+                "address": [{"city": "Albany", "zip": 94706}, None],
+            }
+        )
+        fields = {
+            "name": bigquery.SchemaField("name", "STRING"),
+            "year": bigquery.SchemaField("year", "INT64"),
+            "sold": bigquery.SchemaField("sold", "DATE"),
+            "tags": bigquery.SchemaField("tags", "STRING", mode="REPEATED"),
+            "address": bigquery.SchemaField("address", "RECORD"),
+        }
+        serialized = {
+            name: tools._serialize_column_for_sql(rows.column(name), field)
+            for name, field in fields.items()
+        }
+        self.assertEqual(
+            serialized,
+            {
+                "name": ["'it''s'", "NULL"],
+                "year": ["2008", "NULL"],
+                "sold": ["'2008-02-01'", "NULL"],
+                "tags": ["['a', 'b']", "[]"],
+                "address": ["('Albany', 94706)", "NULL"],
+            },
+        )
+
+
+    def test_nan_is_serialized_as_null(self):
+        column = pa.chunked_array([[1.5, float("nan"), None]])
+        self.assertEqual(
+            tools._serialize_column_for_sql(
+                column, bigquery.SchemaField("price", "FLOAT64")
+            ),
+            ["1.5", "NULL", "NULL"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
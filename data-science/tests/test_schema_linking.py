@@ -0,0 +1,178 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for question-aware schema linking."""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_science.sub_agents.bigquery.schema_cache import InMemorySchemaCacheBackend
+from data_science.sub_agents.bigquery.schema_format import (
+    schema_token_report,
+    serialize_schema,
+)
+from data_science.sub_agents.bigquery.schema_index import (
+    SchemaIndex,
+    load_schema_index,
+    tokenize,
+)
+from data_science.sub_agents.bigquery.schema_linking import prune_schema
+
+
+def _table(columns, values=None):
+    values = values or {}
+    return {
+        "table_schema": [(c, "STRING") for c in columns],
+        "example_values": {c: values.get(c, ["'x'"] * 5) for c in columns},
+    }
+
+
+SCHEMA = {
+    "p.house_prices.train": _table(
+        ["Id", "YrSold", "SalePrice"] + [f"Feature{i}" for i in range(60)]
+    ),
+    "p.house_prices.customers": _table(
+        ["customer_id", "city"], {"city": ["'Albany'", "'Oakland'"]}
+    ),
+    "p.house_prices.audit_log": _table([f"event_{i}" for i in range(80)]),
+}
+
+
+class TestSchemaLinking(unittest.TestCase):
+    """Test cases for schema pruning."""
+
+    def test_tokenize_splits_identifiers(self):
+        self.assertEqual(tokenize("YrSold"), tokenize("yr_sold"))
+        self.assertEqual(tokenize("What years were houses sold?"), ["year", "house", "sold"])
+
+    def test_small_schema_is_unchanged(self):
+        self.assertIs(prune_schema(SCHEMA, "anything", token_budget=10**6), SCHEMA)
+        self.assertIs(prune_schema(SCHEMA, "anything", token_budget=0), SCHEMA)
+
+    def test_prunes_to_relevant_tables_and_columns(self):
+        pruned = prune_schema(
+            SCHEMA, "What years were houses sold in Albany?", token_budget=200
+        )
+        self.assertNotIn("p.house_prices.audit_log", pruned)
+        self.assertEqual(
+            [c for c, _ in pruned["p.house_prices.train"]["table_schema"]],
+            ["Id", "YrSold"],
+        )
+        # Matched through a sample value; small enough to keep whole.
+        self.assertIn("p.house_prices.customers", pruned)
+
+
+class TestSchemaIndex(unittest.TestCase):
+    """Test cases for the BM25 schema index."""
+
+    def test_top_k_columns(self):
+        index = SchemaIndex()
+        index.update(SCHEMA)
+        top = index.top_k_columns("which city is the customer in", k=2)
+        self.assertEqual(
+            [(t, c) for t, c, _ in top],
+            [("p.house_prices.customers", "city"), ("p.house_prices.customers", "customer_id")],
+        )
+        self.assertEqual(index.top_k_columns("zebra"), [])
+
+    def test_only_changed_tables_are_reindexed(self):
+        index = SchemaIndex()
+        index.update(SCHEMA)
+        self.assertFalse(index.update(SCHEMA))
+
+        changed = dict(SCHEMA)
+        changed["p.house_prices.customers"] = _table(["customer_id", "zip_code"])
+        del changed["p.house_prices.audit_log"]
+        self.assertTrue(index.update(changed))
+        self.assertEqual(index.tables, set(changed))
+        self.assertEqual(index.top_k_columns("city"), [])
+        self.assertEqual(index.top_k_columns("zip")[0][1], "zip_code")
+        self.assertEqual(index.top_k_columns("sold")[0][1], "YrSold")
+
+    def test_index_is_persisted_and_reloaded(self):
+        backend = InMemorySchemaCacheBackend()
+        index = load_schema_index("p.house_prices", SCHEMA, backend=backend)
+        self.assertIsNotNone(backend.read("p.house_prices.index.npz"))
+
+        reloaded = SchemaIndex.from_bytes(backend.read("p.house_prices.index.npz"))
+        self.assertEqual(reloaded.table_versions, index.table_versions)
+        self.assertFalse(reloaded.update(SCHEMA))
+        question = "What years were houses sold in Albany?"
+        self.assertEqual(reloaded.top_k_columns(question), index.top_k_columns(question))
+
+    def test_scoring_is_fast(self):
+        schema = {
+            f"p.d.table_{t}": _table([f"column_{t}_{c}" for c in range(50)])
+            for t in range(200)
+        }
+        index = SchemaIndex()
+        index.update(schema)
+        start = time.perf_counter()
+        index.top_k_columns("column 42 of table 7")
+        self.assertLess(time.perf_counter() - start, 0.1)
+
+
+class TestSchemaFormat(unittest.TestCase):
+    """Test cases for the prompt schema serializers."""
+
+    def test_ddl_and_tsv_formats(self):
+        schema = {
+            "p.d.sales": {
+                "table_schema": [("year", "INT64"), ("city", "STRING")],
+                "example_values": {"year": ["2008", "2008"], "city": ["'Albany'", "NULL"]},
+            }
+        }
+        self.assertEqual(
+            serialize_schema(schema, "ddl"),
+            "CREATE TABLE `p.d.sales` (\n"
+            "  `year` INT64, -- e.g. 2008\n"
+            "  `city` STRING, -- e.g. 'Albany', NULL\n"
+            ");",
+        )
+        self.assertEqual(
+            serialize_schema(schema, "tsv"),
+            "# p.d.sales\nyear\tcity\nINT64\tSTRING\n2008\t'Albany'\n2008\tNULL",
+        )
+        self.assertEqual(serialize_schema(schema, "dict"), str(schema))
+
+    def test_line_breaks_and_tabs_in_samples_are_escaped(self):
+        schema = {
+            "p.d.notes": {
+                "table_schema": [("id", "INT64"), ("text", "STRING")],
+                "example_values": {"id": ["1"], "text": ["'a\nb\r\tc'"]},
+            }
+        }
+        self.assertEqual(
+            serialize_schema(schema, "ddl"),
+            "CREATE TABLE `p.d.notes` (\n"
+            "  `id` INT64, -- e.g. 1\n"
+            "  `text` STRING, -- e.g. 'a\\nb\\r\\tc'\n"
+            ");",
+        )
+        self.assertEqual(
+            serialize_schema(schema, "tsv").splitlines()[-1], "1\t'a\\nb\\r\\tc'"
+        )
+
+    def test_compact_formats_use_fewer_tokens(self):
+        report = schema_token_report(SCHEMA)
+        self.assertLess(report["ddl"], report["dict"])
+        self.assertLess(report["tsv"], report["dict"])
+
+
+if __name__ == "__main__":
+    unittest.main()